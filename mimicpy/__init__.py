@@ -11,6 +11,8 @@ from mimicpy.scripts.ndx import Ndx
 from mimicpy.coords.base import CoordsIO
 from mimicpy.coords.gro import Gro
 from mimicpy.coords.pdb import Pdb
+from mimicpy.coords.trr import Trr
+from mimicpy.coords.xtc import Xtc
 
 logging.basicConfig(format='%(message)s',
                     filemode='w',
@@ -121,6 +121,63 @@ def prepqm(args):
         except KeyError: # invalid commands
             print("Invalid command! Please try again. Type 'help' for more information.")
 
+def batchqm(args):
+
+    from os.path import isdir
+    from mimicpy import Preparation, DefaultSelector
+
+    mpt = get_nsa_mpt(args)
+
+    coords = args.coords
+    if coords is None:
+        if isdir(args.traj):
+            print('\nError: -coords is needed to select the QM region when -traj is a directory! Exiting..\n')
+            sys.exit(1)
+        coords = args.traj
+
+    print('')
+    loader = Loader('**Selecting QM atoms**')
+
+    try:
+        prep = Preparation(DefaultSelector(mpt, coords))
+        commands = {'add': prep.add,
+                    'add-link': lambda selection: prep.add(selection, True),
+                    'delete': prep.delete}
+        for line in mimicpy.utils.file_handler.read(args.sele).splitlines():
+            command, _, selection = line.strip().partition(' ')
+            if not command or command.startswith('#'):
+                continue
+            elif command.lower() == 'clear':
+                prep.clear()
+            elif command.lower() in commands:
+                commands[command.lower()](selection)
+            else:
+                raise mimicpy.utils.errors.SelectionError('Invalid command {} in {}'.format(command, args.sele))
+    except FileNotFoundError as e:
+        print('\n\nError: Cannot find file {}! Exiting..\n'.format(e.filename))
+        loader.close(halt=True)
+        sys.exit(1)
+    except (mimicpy.utils.errors.ParserError, mimicpy.utils.errors.MiMiCPyError) as e:
+        print(e)
+        loader.close(halt=True)
+        sys.exit(1)
+
+    loader.close()
+    loader = Loader('**Writing CPMD input scripts**')
+
+    try:
+        prep.get_mimic_inputs(args.traj, args.inp, args.ndx, args.out, args.start, args.stop, args.step, args.nproc)
+    except FileNotFoundError as e:
+        print('\n\nError: Cannot find file {}! Exiting..\n'.format(e.filename))
+        loader.close(halt=True)
+        sys.exit(1)
+    except (mimicpy.utils.errors.ParserError, mimicpy.utils.errors.MiMiCPyError) as e:
+        print(e)
+        loader.close(halt=True)
+        sys.exit(1)
+
+    loader.close()
+
 def get_nsa_mpt(args, only_nsa=False):
     nsa_dct = {}
     if args.nsa:
@@ -154,7 +211,8 @@ def get_nsa_mpt(args, only_nsa=False):
     print("\n**Reading topology**\n")
 
     try:
-        return mimicpy.Mpt.from_file(args.top, mode='w', nonstandard_atomtypes=nsa_dct)
+        return mimicpy.Mpt.from_file(args.top, mode='w', nonstandard_atomtypes=nsa_dct,
+                                     workers=getattr(args, 'nproc', 1), cache_dir=getattr(args, 'cache', None))
     except FileNotFoundError as e:
         print('\n\nError: Cannot find file {}! Exiting..\n'.format(e.filename))
         sys.exit(1)
@@ -163,7 +221,7 @@ def get_nsa_mpt(args, only_nsa=False):
         sys.exit(1)
 
 def getmpt(args):
-    get_nsa_mpt(args).write(args.mpt)
+    get_nsa_mpt(args).write(args.mpt, args.version)
 
 def cpmd2coords(args):
     mpt = get_nsa_mpt(args)
@@ -237,6 +295,22 @@ def main():
                                default='topol.mpt',
                                help='MiMiCPy topology file',
                                metavar='[.mpt] (topol.mpt)')
+    getmpt_others = parser_getmpt.add_argument_group('other options')
+    getmpt_others.add_argument('-version',
+                               type=int,
+                               choices=[1, 2],
+                               default=mimicpy.topology.mpt.MPT_VERSION,
+                               help='version of the MiMiCPy topology format, version 1 is XDR-based',
+                               metavar='[1/2] ({})'.format(mimicpy.topology.mpt.MPT_VERSION))
+    getmpt_others.add_argument('-nproc',
+                               type=int,
+                               default=1,
+                               help='number of processes used to read itp files',
+                               metavar='(1)')
+    getmpt_others.add_argument('-cache',
+                               required=False,
+                               help='directory to cache the parsed topology, unchanged files are not parsed again',
+                               metavar='[dir]')
     parser_getmpt.set_defaults(func=getmpt)
     ##
     #####
@@ -269,9 +343,82 @@ def main():
                               required=False,
                               help='CPMD template input script',
                               metavar='[.inp]')
+    prepqm_others.add_argument('-nproc',
+                              type=int,
+                              default=1,
+                              help='number of processes used to read itp files',
+                              metavar='(1)')
+    prepqm_others.add_argument('-cache',
+                              required=False,
+                              help='directory to cache the parsed topology, unchanged files are not parsed again',
+                              metavar='[dir]')
     parser_prepqm.set_defaults(func=prepqm)
     ##
     #####
+    parser_batchqm = subparsers.add_parser('batchqm',
+                                           help='create CPMD/MiMiC inputs for all frames of a trajectory')
+    batchqm_input = parser_batchqm.add_argument_group('options to specify input files')
+    batchqm_input.add_argument('-top',
+                               required=True,
+                               help='Topology file',
+                               metavar='[.top/.mpt]')
+    batchqm_input.add_argument('-traj',
+                               required=True,
+                               help='Trajectory file or directory of gro files',
+                               metavar='[.gro/.pdb/.trr/.xtc/dir]')
+    batchqm_input.add_argument('-sele',
+                               required=True,
+                               help='QM region as prepqm commands (add, add-link, delete, clear), one per line',
+                               metavar='[.txt/.dat]')
+    batchqm_input.add_argument('-coords',
+                               required=False,
+                               help='Coordinate file used for the selection, first frame of trajectory by default',
+                               metavar='[.gro/.pdb]')
+    batchqm_output = parser_batchqm.add_argument_group('options to specify output files')
+    batchqm_output.add_argument('-out',
+                                default='cpmd_{}.inp',
+                                help='CPMD scripts for MiMiC runs, {} is replaced by the frame index or gro file name',
+                                metavar='[.inp] (cpmd_{}.inp)')
+    batchqm_output.add_argument('-ndx',
+                                default='index.ndx',
+                                help='Gromacs index file',
+                                metavar='[.ndx] (index.ndx)')
+    batchqm_others = parser_batchqm.add_argument_group('other options')
+    batchqm_others.add_argument('-nsa',
+                                required=False,
+                                help='list of non-standard atomtypes in 2-column format',
+                                metavar='[.txt/.dat]')
+    batchqm_others.add_argument('-inp',
+                                required=False,
+                                help='CPMD template input script',
+                                metavar='[.inp]')
+    batchqm_others.add_argument('-start',
+                                type=int,
+                                default=0,
+                                help='index of the first frame of the trajectory',
+                                metavar='(0)')
+    batchqm_others.add_argument('-stop',
+                                type=int,
+                                default=None,
+                                help='index after the last frame of the trajectory',
+                                metavar='(all frames)')
+    batchqm_others.add_argument('-step',
+                                type=int,
+                                default=1,
+                                help='use every step-th frame of the trajectory',
+                                metavar='(1)')
+    batchqm_others.add_argument('-nproc',
+                                type=int,
+                                default=1,
+                                help='number of processes used to read itp files and write input scripts',
+                                metavar='(1)')
+    batchqm_others.add_argument('-cache',
+                                required=False,
+                                help='directory to cache the parsed topology, unchanged files are not parsed again',
+                                metavar='[dir]')
+    parser_batchqm.set_defaults(func=batchqm)
+    ##
+    #####
     parser_prepmm = subparsers.add_parser('prepmm',
                                           help='create/fix Gromacs MDP script for MiMiC run')
     prepmm_input = parser_prepmm.add_argument_group('options to specify input files')
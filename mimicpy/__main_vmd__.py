@@ -86,7 +86,7 @@ class MockVMDSelector(mimicpy.VMDSelector):
     def __init__(self, mpt_file, molid, tcl_vmd_params):
         self.molid = molid
         self.cmd = MockVMDModule(tcl_vmd_params)
-        self.mpt = mimicpy.Mpt.from_file(mpt_file)
+        self.mpt = mimicpy.Mpt.from_file(mpt_file, mode='w')
         
 def main():
     if len(sys.argv) < 19:
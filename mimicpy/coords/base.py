@@ -1,38 +1,176 @@
+import io
+import re
 from abc import ABC, abstractmethod
+from collections import namedtuple
+import logging
+from os.path import abspath, basename, dirname, getmtime, getsize, join
+import numpy as np
+import pandas as pd
 from ..topology.mpt import Mpt
 from ..utils.errors import MiMiCPyError, ParserError
-from ..utils.file_handler import Parser, write as write_string
+
+Frame = namedtuple('Frame', ['step', 'time', 'box', 'coords'])
+Frame.__doc__ = """frame of a trajectory, coords is an (N, 3) array of x, y and z coordinates in nm
+                   step and time are None if they are not in the file"""
+
+_OFFSETS_VERSION = 2  # version of the saved frame offsets, saved offsets of other versions are not used
+_STEP_REGEX = re.compile(rb'step\s*=\s*(\d+)')
+_TIME_REGEX = re.compile(rb't\s*=\s*([-+.\deE]+)')
+
+
+def title_step_time(title):
+    """Get step and time from title of a frame written by Gromacs, e.g. 'Protein t= 10.00000 step= 5000'"""
+    step, time = _STEP_REGEX.search(title), _TIME_REGEX.search(title)
+    try:
+        return int(step.group(1)) if step else None, float(time.group(1)) if time else None
+    except ValueError:
+        return None, None
+
+
+def box_from_matrix(matrix):
+    """Get box as in gro files from (3, 3) array of box vectors, the 3 box lengths if the box is rectangular,
+       else the 9 values v1(x) v2(y) v3(z) v1(y) v1(z) v2(x) v2(z) v3(x) v3(y)
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    box = [matrix[0, 0], matrix[1, 1], matrix[2, 2]]
+    off_diagonal = [matrix[0, 1], matrix[0, 2], matrix[1, 0], matrix[1, 2], matrix[2, 0], matrix[2, 1]]
+    if any(off_diagonal):
+        box += off_diagonal
+    return [float(b) for b in box]
+
+
+def has_contiguous_ids(coords):
+    """Check if coords (dataframe of coordinates) is indexed by the atom IDs 1..N in order"""
+    index = coords.index
+    if isinstance(index, pd.RangeIndex):
+        return index.start == 1 and index.step == 1
+    return index.name == 'id' and np.array_equal(index.to_numpy(), np.arange(1, len(index)+1))
+
+
+def join_coords(sele, coords, contiguous=None):
+    """Add the columns of coords to sele, both are dataframes of atoms indexed by atom ID
+       If coords has the atom IDs 1..N, its rows are gathered by position (ID - 1),
+       otherwise the dataframes are merged on id
+       contiguous is the result of has_contiguous_ids(coords), if it is already known
+    """
+    if contiguous is None:
+        contiguous = has_contiguous_ids(coords)
+    ids = sele.index.to_numpy()
+    if not contiguous or sele.index.name != 'id' or (len(ids) > 0 and (ids.min() < 1 or ids.max() > len(coords))):
+        return sele.merge(coords, left_on='id', right_on='id')
+    values = coords.to_numpy()[ids-1]
+    df = sele.copy()
+    for i, column in enumerate(coords.columns):
+        df[column] = values[:, i]
+    return df
+
 
 class BaseCoordsClass(ABC):
+    """buffer is ignored, files are read in blocks (see columns.iter_lines), it is only kept for compatibility"""
+
+    persist_frame_offsets = False  # if the frame index is saved next to the file, for long binary trajectories
+    has_box = True  # False after reading a frame whose box was not in the file but guessed from the coordinates
+
     def __init__(self, file_name, buffer=1000):
         self.file_name = file_name
         self.buffer = buffer
 
     def read(self):
-        self.file = Parser(self.file_name)
-        coords, box = self._read()
-        self.file.close()
-        return coords, box
+        return self._read()
 
     @abstractmethod
     def _read(self):
         pass
 
-    def write(self, sele, coords=None, box=None, as_str=False, title=''):
+    def frame_offsets(self):
+        """Array of the byte offsets of the start of every frame and of the end of the last frame,
+           built in one pass over the file
+           If persist_frame_offsets is set, the offsets are saved to a hidden file next to the file,
+           and reused as long as the size and modification time of the file are the same
+        """
+        if self.persist_frame_offsets:
+            offsets = self.__load_frame_offsets()
+            if offsets is not None:
+                return offsets
+        with open(self.file_name, 'rb') as f:
+            offsets = np.array(self._index_frames(f), dtype=np.int64)
+        if self.persist_frame_offsets:
+            self.__save_frame_offsets(offsets)
+        return offsets
+
+    def __offsets_file(self):
+        return join(dirname(abspath(self.file_name)), '.{}.offsets.npz'.format(basename(self.file_name)))
+
+    def __file_state(self):
+        return np.array([getsize(self.file_name), getmtime(self.file_name)])
+
+    def __load_frame_offsets(self):
+        try:
+            with np.load(self.__offsets_file()) as index:
+                if index['version'] == _OFFSETS_VERSION and np.array_equal(index['state'], self.__file_state()):
+                    return index['offsets']
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    def __save_frame_offsets(self, offsets):
+        try:
+            with open(self.__offsets_file(), 'wb') as f:
+                np.savez(f, offsets=offsets, state=self.__file_state(), version=_OFFSETS_VERSION)
+        except OSError:
+            logging.debug('Could not save frame offsets of %s', self.file_name)
+
+    def read_frame(self, file, start, stop, out=None):
+        """Read Frame between byte offsets start and stop of file (opened in binary mode),
+           coords are written into out if it is an array of the right shape
+        """
+        file.seek(start)
+        return self._parse_frame(file.read(stop - start), out)
+
+    def _index_frames(self, file):
+        """Byte offsets of frames and of the end of the last frame, files have one frame by default"""
+        return [0, getsize(self.file_name)]
+
+    def _parse_frame(self, data, out=None):
+        """Parse bytes of one frame into a Frame"""
+        raise MiMiCPyError('Reading frames of {} is not supported'.format(self.file_name))
+
+    def write(self, sele, coords=None, box=None, as_str=False, title='', ids=None):
+        """Write atoms in sele (dataframe or Mpt) with coordinates
+           If sele is an Mpt, only atoms with ids (IntervalSet or list of atom IDs) are written
+           Records are formatted in chunks and streamed to the file
+        """
         if isinstance(sele, Mpt):
-            sele = sele.select('all')
+            sele = sele.select('all') if ids is None else sele[ids]
         if coords is not None:
-            sele = sele.merge(coords, left_on='id', right_on='id')
-        s = self._write(sele.reset_index(), box, title)
+            sele = join_coords(sele, coords)
         if as_str:
-            return s
-        else:
-            write_string(s, self.file_name, 'w')
+            out = io.StringIO()
+            self._write(sele.reset_index(), box, title, out)
+            return out.getvalue()
+        with open(self.file_name, 'w') as out:
+            self._write(sele.reset_index(), box, title, out)
 
     @abstractmethod
-    def _write(self, mpt_coords, box, title):
+    def _write(self, mpt_coords, box, title, out):
         pass
-    
+
+    @staticmethod
+    def _chunks(mpt_coords, chunk_size=65536):
+        """Yield consecutive chunks of rows of mpt_coords"""
+        for i in range(0, len(mpt_coords), chunk_size):
+            yield mpt_coords.iloc[i:i+chunk_size]
+
+    @staticmethod
+    def _str_column(column, n):
+        """Vectorized str_checker of a column"""
+        return column.astype(str).str[:n]
+
+    @staticmethod
+    def _int_column(column, n):
+        """Vectorized int_checker of a column"""
+        return column.astype(str).str[:n].astype(int)
+
     def str_checker(self, s, n):
         if len(s) > n:
             s = s[:n]
@@ -46,6 +184,7 @@ class CoordsIO:
     def __init__(self, file_name, mode='r', buffer=1000, ext=None):
         if isinstance(file_name, BaseCoordsClass):
             self.__coords_obj = file_name
+            file_name = file_name.file_name
         else:
             if ext is None:
                 ext = file_name.split('.')[-1]
@@ -56,12 +195,23 @@ class CoordsIO:
             elif ext == 'pdb':
                 from .pdb import Pdb
                 self.__coords_obj = Pdb(file_name, buffer)
+            elif ext == 'trr':
+                from .trr import Trr
+                self.__coords_obj = Trr(file_name, buffer)
+            elif ext == 'xtc':
+                from .xtc import Xtc
+                self.__coords_obj = Xtc(file_name, buffer)
             else:
                 raise ParserError('Unknown coordinate format')
 
+        self.file_name = file_name
         self.mode = mode
         self._coords = None
         self._box = None
+        self._positions = None
+        self._contiguous = None
+        self._has_box = None
+        self._frame_offsets = None
 
         if mode == 'r':
             self.__read()
@@ -80,14 +230,84 @@ class CoordsIO:
         if self.mode != 'r': self.__read()
         return self._box
 
+    @property
+    def positions(self):
+        """(N, 3) array of x, y and z coordinates, in the order of the atoms in the file"""
+        if self.mode != 'r': self.__read()
+        return self._positions
+
+    @property
+    def has_box(self):
+        """If the box was read from the file, otherwise it is the extent of the coordinates and not periodic"""
+        if self.mode != 'r': self.__read()
+        return self._has_box
+
+    @property
+    def frame_offsets(self):
+        """Byte offsets of the frames in the file, see BaseCoordsClass.frame_offsets
+           The index is built on first use and reused for random access
+        """
+        if self._frame_offsets is None:
+            self._frame_offsets = self.__coords_obj.frame_offsets()
+        return self._frame_offsets
+
+    def __len__(self):
+        return len(self.frame_offsets) - 1
+
+    def __getitem__(self, frame):
+        """Get Frame by its index, negative indices count from the last frame"""
+        number_of_frames = len(self)
+        if not -number_of_frames <= frame < number_of_frames:
+            raise IndexError('Frame {} does not exist, {} has {} frames'.format(frame, self.file_name, number_of_frames))
+        frame %= number_of_frames
+        return self.read_frame(self.frame_offsets[frame], self.frame_offsets[frame+1])
+
+    def read_frame(self, start, stop):
+        """Get Frame between the byte offsets start and stop, as given by frame_offsets,
+           the file is not indexed, e.g. to read frames of an already indexed file in another process
+        """
+        with open(self.file_name, 'rb') as f:
+            return self.__coords_obj.read_frame(f, start, stop)
+
+    def frames(self, start=0, stop=None, step=1):
+        """Iterate over Frames in the range start, stop, step with constant memory
+           The coords array of a frame is reused for the next frame, so it has to be copied to be kept
+        """
+        out = None
+        with open(self.file_name, 'rb') as f:
+            for i in range(*slice(start, stop, step).indices(len(self))):
+                frame = self.__coords_obj.read_frame(f, self.frame_offsets[i], self.frame_offsets[i+1], out)
+                out = frame.coords
+                yield frame
+
+    def seek(self, frame):
+        """Use frame (index of a frame) as the coords, box and positions"""
+        frame = self[frame]
+        self.mode = 'r'
+        self._positions = frame.coords
+        self._coords = pd.DataFrame(frame.coords, columns=['x', 'y', 'z'],
+                                    index=pd.RangeIndex(1, len(frame.coords)+1, name='id'))
+        self._contiguous = True
+        if frame.box is not None:
+            self._box = frame.box
+            self._has_box = self.__coords_obj.has_box
+
+    def join(self, sele):
+        """Add coordinates to sele (dataframe of atoms indexed by atom ID), see join_coords"""
+        if self.mode != 'r': self.__read()
+        return join_coords(sele, self._coords, self._contiguous)
+
     def __read(self):
         self.mode = 'r'
         self._coords, self._box = self.__coords_obj.read()
+        self._has_box = self.__coords_obj.has_box
+        self._positions = self._coords[['x', 'y', 'z']].to_numpy()
+        self._contiguous = has_contiguous_ids(self._coords)
 
-    def write(self, sele, coords=None, box=None, as_str=False, title=''):
+    def write(self, sele, coords=None, box=None, as_str=False, title='', ids=None):
         if self.mode != 'w':
             self.mode = 'w'
-        return self.__coords_obj.write(sele, coords, box, as_str, title)
+        return self.__coords_obj.write(sele, coords, box, as_str, title, ids)
     
     def __enter__(self):
         return self
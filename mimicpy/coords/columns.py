@@ -0,0 +1,102 @@
+"""Module for parsing fixed-width columns of coordinate files in bulk"""
+
+import numpy as np
+
+CHUNK_SIZE = 65536  # lines parsed at a time
+
+_NEWLINE, _CARRIAGE_RETURN, _SPACE, _MINUS, _POINT = (ord(c) for c in '\n\r -.')
+
+
+def line_offsets(buffer):
+    """Get arrays of the start and end offsets of all lines of buffer (NumPy array of bytes),
+       the end offsets exclude line breaks
+    """
+    ends = np.flatnonzero(buffer == _NEWLINE)
+    if len(buffer) > 0 and buffer[-1] != _NEWLINE:
+        ends = np.append(ends, len(buffer))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    if len(ends) > 0:
+        ends = ends - (buffer[np.maximum(ends-1, 0)] == _CARRIAGE_RETURN)
+    return starts, ends
+
+
+def get_columns(buffer, starts, ends, first, width):
+    """Get (N, width) array of the characters from column first to first+width of the lines starting at starts
+       Characters after the end of a line are spaces
+    """
+    strides = np.diff(starts)
+    if len(starts) > 1 and np.all(strides == strides[0]) and starts[0] + len(starts)*strides[0] <= len(buffer) \
+            and first + width <= strides[0] and np.all(ends - starts >= first + width):
+        # lines have the same length, so they are rows of a 2D view of the buffer
+        rows = buffer[starts[0]:starts[0] + len(starts)*strides[0]].reshape(len(starts), -1)
+        return rows[:, first:first+width]
+    offsets = np.arange(first, first+width)
+    chunk = buffer[np.minimum(starts[:, None] + offsets, max(len(buffer)-1, 0))]
+    chunk[offsets >= (ends - starts)[:, None]] = _SPACE
+    return chunk
+
+
+def parse_floats(chunk, number_of_columns, width):
+    """Convert (N, number_of_columns*width) array of characters to (N, number_of_columns) array of floats
+       Numbers with the decimal point at the same position in every column are added up digit by digit,
+       which is much faster than converting each string, other numbers are converted as strings
+       Raises ValueError if a column is not a number
+    """
+    chunk = chunk.reshape(len(chunk), number_of_columns, width)
+    if len(chunk) == 0:
+        return np.empty((0, number_of_columns))
+    point = width - 1 - int(np.argmax(chunk[0, 0, ::-1] == _POINT))
+    digits = chunk - np.uint8(ord('0'))  # characters other than digits wrap around to values > 9
+    is_valid = ((digits <= 9) | (chunk == _SPACE) | (chunk == _MINUS) | (chunk == _POINT)).all()
+    if not (is_valid and (chunk[:, :, point] == _POINT).all() and (digits[:, :, -1] <= 9).all()):
+        return np.ascontiguousarray(chunk).view('S{}'.format(width)).astype(float).reshape(len(chunk), -1)
+
+    # the mantissa is an integer, so dividing by a power of 10 gives the same value as float(string)
+    mantissa = np.zeros(chunk.shape[:2])
+    for i in range(width):
+        if i != point:
+            exponent = width - 2 - i if i < point else width - 1 - i
+            mantissa += np.where(digits[:, :, i] <= 9, digits[:, :, i], 0) * 10.0**exponent
+    values = mantissa / 10.0**(width - 1 - point)
+    np.negative(values, out=values, where=(chunk == _MINUS).any(axis=2))
+    return values
+
+
+def read_floats(buffer, starts, ends, first, number_of_columns, width, out=None):
+    """Get (N, number_of_columns) array of the fixed-width float columns starting at column first of the lines
+       Lines are parsed in chunks of CHUNK_SIZE, raises ValueError if a column is not a number
+       If out is an array of the same shape, values are written into it
+    """
+    if out is not None and out.shape == (len(starts), number_of_columns):
+        values = out
+    else:
+        values = np.empty((len(starts), number_of_columns))
+    for i in range(0, len(starts), CHUNK_SIZE):
+        chunk = get_columns(buffer, starts[i:i+CHUNK_SIZE], ends[i:i+CHUNK_SIZE], first, number_of_columns*width)
+        values[i:i+CHUNK_SIZE] = parse_floats(chunk, number_of_columns, width)
+    return values
+
+
+def iter_lines(file, block_size=1 << 24):
+    """Read file (opened in binary mode) in blocks and yield (offset, buffer, starts, ends) for the complete lines
+       of each block, offset is the position of buffer in the file and starts, ends are as in line_offsets
+       A line that does not fit in a block is carried over to the next one
+    """
+    offset = file.tell()
+    remainder = b''
+    while True:
+        block = file.read(block_size)
+        data = remainder + block
+        if not block:
+            if data:
+                buffer = np.frombuffer(data, dtype=np.uint8)
+                yield (offset, buffer) + line_offsets(buffer)
+            return
+        last_newline = data.rfind(b'\n')
+        if last_newline == -1:
+            remainder = data
+            continue
+        buffer = np.frombuffer(data[:last_newline+1], dtype=np.uint8)
+        yield (offset, buffer) + line_offsets(buffer)
+        offset += last_newline + 1
+        remainder = data[last_newline+1:]
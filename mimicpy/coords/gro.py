@@ -3,78 +3,134 @@
 import numpy as np
 import pandas as pd
 from ..utils.errors import ParserError
-from .base import BaseCoordsClass
+from .base import BaseCoordsClass, Frame, title_step_time
+from .columns import iter_lines, line_offsets, read_floats
+
+_FIRST_COLUMN = 20  # atom lines start with resid, resname, name and id in 4 columns of width 5
 
 class Gro(BaseCoordsClass):
     """reads gro files"""
 
     def _read(self):
-        """Read atom coordinates and box dimensions"""
-
-        def mapped(value):
-            if value.isnumeric():
-                return np.nan
-            try:
-                return float(value)
-            except ValueError:
-                return np.nan
-
-        def string_to_array(string):
-            return np.array(list(map(mapped, string.split())))
-
-        self.file.readline()
-        number_of_atoms = int(self.file.readline())
-        first_atom_line = self.file.readline()
-        self.file.buffer = len(first_atom_line) * self.buffer
-
-        number_of_rows = len(first_atom_line.split()) - 3
-        if number_of_rows == 3:
+        """Read atom coordinates and box dimensions of the first frame
+           The fixed-width columns of all atom lines are parsed in bulk from one buffer of the frame,
+           the width of the columns is the distance between the decimal points of the first atom line
+        """
+        with open(self.file_name, 'rb') as f:
+            end = self._index_frames(f, 1)[1]
+            f.seek(0)
+            _, values, box = self.__parse(f.read(end))
+
+        if values.shape[1] == 3:
             cols = ['x', 'y', 'z']
-        elif number_of_rows == 6:
-            cols = ['x', 'y', 'z', 'v_x', 'v_y', 'v_z']
-        else:
-            raise ParserError(self.file_name, details='Gro file is not formatted properly.')
-
-        values = string_to_array(first_atom_line)
-        for string in self.file:
-            values = np.append(values, string_to_array(string))
-        values = values[~np.isnan(values)]
-
-        expected_len = number_of_atoms * number_of_rows
-        if len(values) == expected_len:
-            coords = values
-            box = self.file.readline().split()
-        elif len(values) == expected_len + 3:
-            coords = values[:-3]
-            box = values[-3:]
         else:
-            raise ParserError(self.file_name, details='Gro file is not formatted properly.')
+            cols = ['x', 'y', 'z', 'v_x', 'v_y', 'v_z']
+        coords = pd.DataFrame(values, columns=cols, index=pd.RangeIndex(1, len(values)+1, name='id'))
+        return coords, box
+
+    def _parse_frame(self, data, out=None):
+        title, values, box = self.__parse(data, out)
+        positions = values[:, :3]
+        if out is not None and out.shape == positions.shape and positions.base is not out:
+            out[:] = positions
+            positions = out
+        return Frame(*title_step_time(title), box, positions)
+
+    def _index_frames(self, file, max_frames=None):
+        """Byte offsets of the first max_frames frames and of the end of the last one
+           Each frame has a title, the number of atoms, one line per atom and the box, so only the lines
+           with the number of atoms are read and the atom lines are skipped
+        """
+        offsets = []
+        title_line = 0  # line number of the title of the next frame
+        is_indexed = False  # if the offset of the frame at title_line is in offsets
+        line = 0  # line number of the first line of the block
+        end = 0
+        for offset, buffer, starts, ends in iter_lines(file):
+            end = offset + len(buffer)
+            while True:
+                if not is_indexed and title_line < line + len(starts):
+                    if max_frames is not None and len(offsets) == max_frames:
+                        return offsets + [offset + starts[title_line - line]]
+                    offsets.append(offset + starts[title_line - line])
+                    is_indexed = True
+                count_line = title_line + 1 - line
+                if not is_indexed or count_line >= len(starts):
+                    break
+                try:
+                    number_of_atoms = int(bytes(buffer[starts[count_line]:ends[count_line]]))
+                except ValueError:  # text after the last frame
+                    return Gro.__end_offsets(offsets[:-1], offsets[-1], self.__error())
+                title_line += number_of_atoms + 3
+                is_indexed = False
+            line += len(starts)
+
+        if is_indexed or title_line > line:  # last frame is incomplete
+            return Gro.__end_offsets(offsets[:-1], offsets[-1] if offsets else end, self.__error())
+        return offsets + [end]
 
-        coords = pd.DataFrame(coords.reshape(number_of_atoms, number_of_rows), columns=cols)
-        coords['id'] = coords.index.to_numpy()+1
+    @staticmethod
+    def __end_offsets(offsets, end, error):
+        if not offsets:
+            raise error
+        return offsets + [end]
 
-        return coords.set_index(['id']), box.tolist()
+    def __error(self):
+        return ParserError(self.file_name, details='Gro file is not formatted properly.')
 
-    def _write(self, mpt_coords, box, title):
-        int_checker = lambda i: self.int_checker(i, 5)
-        str_checker = lambda i: self.str_checker(i, 5)
-        
+    def __parse(self, data, out=None):
+        """Get title, (N, 3) or (N, 6) array of values and box of the frame in data"""
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        line_starts, line_ends = line_offsets(buffer)
+        get_line = lambda i: data[line_starts[i]:line_ends[i]]
+
+        try:
+            number_of_atoms = int(get_line(1))
+        except (IndexError, ValueError):
+            raise self.__error()
+        if number_of_atoms < 1 or len(line_starts) < number_of_atoms + 3:
+            raise self.__error()
+
+        first_atom_line = get_line(2)
+        number_of_columns = len(first_atom_line[_FIRST_COLUMN:].split())
+        decimal_points = [i for i, c in enumerate(first_atom_line[_FIRST_COLUMN:]) if c == ord('.')]
+        if number_of_columns not in [3, 6] or len(decimal_points) < number_of_columns:
+            raise self.__error()
+        width = decimal_points[1] - decimal_points[0]
+
+        starts = line_starts[2:number_of_atoms+2]
+        ends = line_ends[2:number_of_atoms+2]
+        if np.any(ends - starts < _FIRST_COLUMN + (number_of_columns-1)*width + 1):
+            raise self.__error()
+        try:
+            values = read_floats(buffer, starts, ends, _FIRST_COLUMN, number_of_columns, width, out)
+        except ValueError:
+            raise self.__error()
+
+        box = get_line(number_of_atoms+2).split()
+        if len(box) not in [3, 9]:
+            raise self.__error()
+        try:
+            box = [float(b) for b in box]
+        except ValueError:
+            raise self.__error()
+        return get_line(0), values, box
+
+    def _write(self, mpt_coords, box, title, out):
         if title:
             title = title + ', '
-        
-        gro_str = '{}Generated by MiMiCPy\n{}\n'.format(title, len(mpt_coords))
-        for i, r in mpt_coords.iterrows():
-            gro_str += '{:5d}{:<5}{:>5}{:5d}{:8.3f}{:8.3f}{:8.3f}\n'.format(int_checker(r['resid']),\
-                                                                     str_checker(r['resname']),\
-                                                                     str_checker(r['name']),\
-                                                                     int_checker(r['id']),\
-                                                                 r['x'], r['y'], r['z'])
+
+        out.write('{}Generated by MiMiCPy\n{}\n'.format(title, len(mpt_coords)))
+        line = '{:5d}{:<5}{:>5}{:5d}{:8.3f}{:8.3f}{:8.3f}\n'.format
+        for chunk in self._chunks(mpt_coords):
+            columns = [self._int_column(chunk['resid'], 5), self._str_column(chunk['resname'], 5),
+                       self._str_column(chunk['name'], 5), self._int_column(chunk['id'], 5),
+                       chunk['x'], chunk['y'], chunk['z']]
+            out.write(''.join(map(line, *[c.tolist() for c in columns])))
 
         if box is None:
             box = [0, 0, 0]
             for i, c in enumerate(['x', 'y', 'z']):
-                box[i] = abs(max(mpt_coords[c]) - min(mpt_coords[c])) # find box size
-
-        gro_str += '   {:.5f}   {:.5f}   {:.5f}\n'.format(box[0], box[1], box[2])
+                box[i] = abs(mpt_coords[c].max() - mpt_coords[c].min()) # find box size
 
-        return gro_str
\ No newline at end of file
+        out.write('   {:.5f}   {:.5f}   {:.5f}\n'.format(box[0], box[1], box[2]))
@@ -1,7 +1,10 @@
 """Module for pdb files"""
 
+import numpy as np
 import pandas as pd
-from .base import BaseCoordsClass
+from ..utils.errors import ParserError
+from .base import BaseCoordsClass, Frame, title_step_time
+from .columns import get_columns, iter_lines, line_offsets, read_floats
 
 class Pdb(BaseCoordsClass):
     """Reads  and writes PDB files
@@ -9,58 +12,97 @@ class Pdb(BaseCoordsClass):
            https://www.wwpdb.org/documentation/file-format-content/format33/v3.3.html
     """
 
-    def __read_line(line):
-        vals = {}
-        vals['record'] = line[:6].strip()
+    _header = None  # records before the first model, read once when the file is indexed or a frame is parsed
 
-        if vals['record'] != 'HETATM' and vals['record'] != 'ATOM':
-            vals['content'] = line[6:]
-            return vals
+    def _read(self):
+        """Read coordinates of ATOM and HETATM records of the first model and box dimensions from CRYST1,
+           the fixed columns of all records are parsed in bulk from one buffer of the model
+        """
+        with open(self.file_name, 'rb') as f:
+            end = self._index_frames(f, 1)[1]
+            f.seek(0)
+            frame = self._parse_frame(f.read(end))
+        coords = pd.DataFrame(frame.coords, columns=['x', 'y', 'z'],
+                              index=pd.RangeIndex(1, len(frame.coords)+1, name='id'))
+        return coords, frame.box
 
-        vals['id'] = line[6:11].strip()
-        vals['name'] = line[12:16].strip()
-        vals['altLoc'] = line[16]
-        vals['resname'] = line[17:20].strip()
-        vals['chainID'] = line[21]
-        vals['resSeq'] = line[22:26].strip()
-        vals['iCode'] = line[26]
-        vals['x'] = line[30:38].strip()
-        vals['y'] = line[38:46].strip()
-        vals['z'] = line[46:54].strip()
-        vals['occupancy'] = line[54:60].strip()
-        vals['tempFactor'] = line[60:66].strip()
-        vals['element'] = line[76:78].strip()
-        vals['charge'] = line[78:80].strip()
+    def _index_frames(self, file, max_frames=None):
+        """Byte offsets of the first max_frames models and of the end of the last one
+           Models end with an ENDMDL record, files without ENDMDL records have one model
+        """
+        self._header = self.__read_header(file)
+        file.seek(0)
+        offsets = [0]
+        end = 0
+        for offset, buffer, starts, ends in iter_lines(file):
+            end = offset + len(buffer)
+            records = get_columns(buffer, starts, ends, 0, 6).copy().view('S6').ravel()
+            # models end at the start of the line after ENDMDL
+            next_starts = np.append(starts[1:], len(buffer))
+            offsets.extend((offset + next_starts[records == b'ENDMDL']).tolist())
+            if max_frames is not None and len(offsets) > max_frames:
+                return offsets[:max_frames+1]
+        if len(offsets) == 1:
+            offsets.append(end)
+        return offsets
 
-        return vals
+    @staticmethod
+    def __crystal_box(line):
+        """Box lengths in nm of a CRYST1 record"""
+        return [float(line[6:15])/10, float(line[15:24])/10, float(line[24:33])/10]
 
-    def _read(self):
-        # ATOM/HETATM line is always 78 bytes/chars
-        self.file.buffer = 78*self.buffer
+    def __read_header(self, file):
+        """Get dictionary of the records before the first MODEL, ATOM or HETATM record of file
+           The box of a CRYST1 record in the header applies to all models without a CRYST1 record of their own
+        """
+        header = {'box': None}
+        file.seek(0)
+        for _, buffer, starts, ends in iter_lines(file, 1 << 16):
+            records = get_columns(buffer, starts, ends, 0, 6).copy().view('S6').ravel()
+            first_model = np.flatnonzero((records == b'MODEL ') | (records == b'ATOM  ') | (records == b'HETATM'))
+            end_of_header = first_model[0] if len(first_model) > 0 else len(records)
+            crystal = np.flatnonzero(records[:end_of_header] == b'CRYST1')
+            if len(crystal) > 0:
+                header['box'] = self.__crystal_box(buffer[starts[crystal[0]]:ends[crystal[0]]].tobytes())
+            if len(first_model) > 0:
+                break
+        return header
 
-        pdb_lst = []
+    def _parse_frame(self, data, out=None):
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        starts, ends = line_offsets(buffer)
 
-        for chunk in self.file:
+        records = get_columns(buffer, starts, ends, 0, 6).copy().view('S6').ravel()
+        end_of_model = np.flatnonzero(records == b'ENDMDL')
+        if len(end_of_model) > 0:
+            starts, ends, records = starts[:end_of_model[0]], ends[:end_of_model[0]], records[:end_of_model[0]]
 
-            for line in chunk.splitlines():
-                try:
-                    vals = self.__read_line(line)
-                except: # if only part of line was read
-                    self.file.f.seek(-len(line), 1) # push back the file pointer to start of line
+        is_atom = (records == b'ATOM  ') | (records == b'HETATM')
+        if not np.any(is_atom):
+            raise ParserError(self.file_name, details='No ATOM or HETATM records found')
+        try:
+            values = read_floats(buffer, starts[is_atom], ends[is_atom], 30, 3, 8, out)
+        except ValueError:
+            raise ParserError(self.file_name, details='Pdb file is not formatted properly.')
+        values /= 10  # convert ang to nm
 
-                if vals['record'] == 'ATOM' or vals['record'] == 'HETATM':
-                    pdb_lst.append(vals)
+        crystal = np.flatnonzero(records == b'CRYST1')
+        if len(crystal) > 0:
+            dims = self.__crystal_box(data[starts[crystal[0]]:ends[crystal[0]]])
+        else:
+            if self._header is None:  # frames read by offset, without indexing the file
+                with open(self.file_name, 'rb') as f:
+                    self._header = self.__read_header(f)
+            dims = self._header['box']
+        self.has_box = dims is not None
+        if not self.has_box:
+            dims = (values.max(axis=0) - values.min(axis=0)).tolist() # find box size
 
-        coords = pd.DataFrame(pdb_lst)
+        title = np.flatnonzero(records == b'TITLE ')
+        step, time = title_step_time(data[starts[title[0]]:ends[title[0]]]) if len(title) > 0 else (None, None)
+        return Frame(step, time, dims, values)
 
-        dims = [0, 0, 0]
-        for i, r in enumerate(['x', 'y', 'z']):
-            coords[r] /= 10 # convert ang to nm
-            dims[i] = abs(max(self._coords[r]) - min(coords[r])) # find box size
-        
-        return coords, dims
-
-    def _write(self, mpt_coords, box, title):
+    def _write(self, mpt_coords, box, title, out):
         def guess_chain(s):
             """Guess chain ID from molecule name
                It is not very accurate
@@ -90,40 +132,36 @@ class Pdb(BaseCoordsClass):
                 return "{}-".format(-i)
             else:
                 return "  "
+
+        def map_unique(column, function):
+            """Apply function once to every unique value of column"""
+            uniques = column.unique()
+            return column.map(dict(zip(uniques, map(function, uniques))))
         
         std_res = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'HID', 'ILE', 'LEU', 'LYS',
                    'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
         
-        pdb_str = ''
-        for i, r in mpt_coords.iterrows():
-            resname = r['resname'].upper()
-            if resname in std_res:
-                record = 'ATOM'
-            else:
-                record = 'HETATM'
-            
-            pdb_str += '{:<6}{:>5d} {} {:>3} {:1}{:>4d}    {:>8.3f}{:>8.3f}{:>8.3f}  0.00  0.00          {:>2}{}\n'.format(record,\
-                                                                        self.int_checker(r['id'], 5),\
-                                                                        name_checker(r['name']),\
-                                                                        self.str_checker(resname, 3),\
-                                                                        guess_chain(r['mol']),\
-                                                                        self.int_checker(r['resid'], 4),\
-                                                                        r['x']*10,\
-                                                                        r['y']*10,\
-                                                                        r['z']*10,\
-                                                                        self.str_checker(r['element'], 2),\
-                                                                        charge_checker(r['charge'])
-                                                                       )
-        pdb_str += "TER   \n"
-        
         if box is None:
             box = [0, 0, 0]
             for i, c in enumerate(['x', 'y', 'z']):
-                box[i] = abs(max(mpt_coords[c]*10) - min(mpt_coords[c]*10)) # find box size
+                box[i] = abs((mpt_coords[c]*10).max() - (mpt_coords[c]*10).min()) # find box size
         
         if title:
             title = "TITLE     {}\n".format(title.upper())
-        header = ("{}REMARK    GENERATED BY MIMICPY\n"
+        out.write("{}REMARK    GENERATED BY MIMICPY\n"
                   "CRYST1{:9.3f}{:9.3f}{:9.3f}{:7.3f}{:7.3f}{:7.3f} P 1           1\n".format(title, box[0], box[1], box[2], 90, 90, 90))
-        
-        return header+pdb_str
+
+        line = '{:<6}{:>5d} {} {:>3} {:1}{:>4d}    {:>8.3f}{:>8.3f}{:>8.3f}  0.00  0.00          {:>2}{}\n'.format
+        for chunk in self._chunks(mpt_coords):
+            resname = chunk['resname'].str.upper()
+            columns = [resname.isin(std_res).map({True: 'ATOM', False: 'HETATM'}),
+                       self._int_column(chunk['id'], 5),
+                       map_unique(chunk['name'], name_checker),
+                       self._str_column(resname, 3),
+                       map_unique(chunk['mol'], guess_chain),
+                       self._int_column(chunk['resid'], 4),
+                       chunk['x']*10, chunk['y']*10, chunk['z']*10,
+                       self._str_column(chunk['element'], 2),
+                       map_unique(chunk['charge'], charge_checker)]
+            out.write(''.join(map(line, *[c.tolist() for c in columns])))
+        out.write("TER   \n")
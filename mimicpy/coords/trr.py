@@ -0,0 +1,105 @@
+"""Module for trr files"""
+
+import struct
+import numpy as np
+import pandas as pd
+from ..utils.errors import MiMiCPyError, ParserError
+from .base import BaseCoordsClass, Frame, box_from_matrix
+
+_MAGIC = 1993
+# sizes in bytes of the data blocks of a frame: ir, e, box, vir, pres, top, sym, x, v, f
+_SIZE_FIELDS = ['ir_size', 'e_size', 'box_size', 'vir_size', 'pres_size', 'top_size', 'sym_size',
+                'x_size', 'v_size', 'f_size']
+
+
+class Trr(BaseCoordsClass):
+    """reads Gromacs trr trajectories, frames are XDR encoded headers followed by arrays of reals
+       in single or double precision
+    """
+
+    persist_frame_offsets = True
+
+    def __error(self, details='Trr file is not formatted properly.'):
+        return ParserError(self.file_name, details=details)
+
+    def __header(self, data):
+        """Get dictionary of the header at the start of data, with the size of the header in bytes"""
+        if len(data) < 12 or struct.unpack('>i', data[:4])[0] != _MAGIC:
+            raise self.__error()
+        version_length = struct.unpack('>i', data[8:12])[0]
+        start = 12 + (version_length + 3) // 4 * 4  # version string is padded to 4 bytes
+        if len(data) < start + 52:
+            raise self.__error()
+        values = struct.unpack('>13i', data[start:start+52])
+        header = dict(zip(_SIZE_FIELDS + ['natoms', 'step', 'nre'], values))
+        if header['box_size']:
+            real_size = header['box_size'] // 9
+        elif header['x_size'] or header['v_size'] or header['f_size']:
+            real_size = (header['x_size'] or header['v_size'] or header['f_size']) // (3 * header['natoms'])
+        else:
+            raise self.__error()
+        if real_size not in [4, 8]:
+            raise self.__error()
+        header['real'] = '>f{}'.format(real_size)
+        header['time'] = struct.unpack('>' + 'fd'[real_size == 8], data[start+52:start+52+real_size])[0]
+        header['size'] = start + 52 + 2*real_size
+        return header
+
+    def _index_frames(self, file, max_frames=None):
+        """Byte offsets of the first max_frames frames with coordinates and of the end of the last one
+           Frames with only velocities or forces are skipped, their bytes are part of the frame before them
+        """
+        offsets = []
+        position = 0
+        while max_frames is None or len(offsets) < max_frames:
+            file.seek(position)
+            data = file.read(128)
+            if not data:
+                break
+            try:
+                header = self.__header(data)
+            except ParserError:
+                if not offsets:
+                    raise
+                break  # incomplete last frame
+            frame_size = header['size'] + sum(header[field] for field in _SIZE_FIELDS)
+            file.seek(position + frame_size - 1)
+            if len(file.read(1)) < 1:
+                break
+            if header['x_size']:
+                offsets.append(position)
+            position += frame_size
+        if not offsets:
+            raise self.__error('No frame has coordinates' if position > 0 else 'Trr file is not formatted properly.')
+        return offsets + [position]
+
+    def _parse_frame(self, data, out=None):
+        header = self.__header(data)
+        position = header['size']
+        box = None
+        if header['box_size']:
+            box = box_from_matrix(np.frombuffer(data, header['real'], 9, position).reshape(3, 3))
+        position += header['box_size'] + header['vir_size'] + header['pres_size']
+        if header['x_size'] == 0:
+            raise self.__error('Frame at step {} has no coordinates'.format(header['step']))
+        coords = np.frombuffer(data, header['real'], 3*header['natoms'], position).reshape(-1, 3)
+        if out is not None and out.shape == coords.shape:
+            out[:] = coords
+            coords = out
+        else:
+            coords = coords.astype(float)
+        return Frame(header['step'], header['time'], box, coords)
+
+    def _read(self):
+        """Read atom coordinates and box dimensions of the first frame"""
+        with open(self.file_name, 'rb') as f:
+            frame = self.read_frame(f, *self._index_frames(f, 1))
+        coords = pd.DataFrame(frame.coords, columns=['x', 'y', 'z'],
+                              index=pd.RangeIndex(1, len(frame.coords)+1, name='id'))
+        return coords, frame.box
+
+    def write(self, *args, **kwargs):
+        raise MiMiCPyError('Writing trr files is not supported')
+
+    def _write(self, mpt_coords, box, title, out):
+        self.write()
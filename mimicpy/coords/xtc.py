@@ -0,0 +1,244 @@
+"""Module for xtc files"""
+
+import struct
+import numpy as np
+import pandas as pd
+from ..utils.errors import MiMiCPyError, ParserError
+from .base import BaseCoordsClass, Frame, box_from_matrix
+
+_MAGIC = 1995
+_HEADER_SIZE = 92  # header, box and parameters of the compressed coordinates of a frame
+_FIRST_INDEX = 9
+# sizes of the small integers of coordinates compressed as differences, indexed by the number of bits
+_MAGIC_INTS = [0, 0, 0, 0, 0, 0, 0, 0, 0, 8, 10, 12, 16, 20, 25, 32, 40, 50, 64, 80, 101, 128, 161, 203, 256, 322, 406,
+               512, 645, 812, 1024, 1290, 1625, 2048, 2580, 3250, 4096, 5060, 6501, 8192, 10321, 13003, 16384, 20642,
+               26007, 32768, 41285, 52015, 65536, 82570, 104031, 131072, 165140, 208063, 262144, 330280, 416127,
+               524287, 660561, 832255, 1048576, 1321122, 1664510, 2097152, 2642245, 3329021, 4194304, 5284491,
+               6658042, 8388607, 10568983, 13316085, 16777216]
+
+
+def _read_bits(data, positions, number_of_bits):
+    """Get the unsigned integers of number_of_bits (at most 64) bits starting at each bit position of data
+       data has to be padded with at least 9 bytes past the last bit read
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    # big endian 64 bit words starting at every byte of data
+    words = np.ndarray((len(buffer) - 7,), dtype='>u8', buffer=buffer, strides=(1,))
+    starts = positions >> 3
+    shifts = (positions & 7).astype(np.uint64)
+    chunks = (words[starts].astype(np.uint64) << shifts) | (buffer[starts + 8].astype(np.uint64) >> (8 - shifts))
+    return chunks >> (64 - np.asarray(number_of_bits, dtype=np.uint64))
+
+
+def _receive_wide_ints(data, position, number_of_bits, sizes):
+    """Get the three integers of sizes combined into more than 64 bits at a bit position of data"""
+    start, shift = position >> 3, position & 7
+    number_of_bytes = (shift + number_of_bits + 7) >> 3
+    chunk = int.from_bytes(data[start:start+number_of_bytes], 'big')
+    bits = (chunk >> (8*number_of_bytes - shift - number_of_bits)) & ((1 << number_of_bits) - 1)
+    full_bytes = (number_of_bits - 1) // 8
+    last_bits = number_of_bits - 8*full_bytes
+    number = int.from_bytes((bits >> last_bits).to_bytes(full_bytes, 'big'), 'little')
+    number |= (bits & ((1 << last_bits) - 1)) << (8*full_bytes)
+    number, z = divmod(number, sizes[2])
+    x, y = divmod(number, sizes[1])
+    return x, y, z
+
+
+def _receive_ints(data, positions, number_of_bits, sizes):
+    """Get (N, 3) array of the three integers of sizes combined into number_of_bits bits at each bit position of data
+       Bytes of the combined integer are stored least significant first, the last one can have less than 8 bits
+    """
+    number_of_bits = np.broadcast_to(np.asarray(number_of_bits, dtype=np.uint64), positions.shape)
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=np.uint64), positions.shape + (3,))
+    bits = _read_bits(data, positions, np.minimum(number_of_bits, 64))
+    full_bytes = (number_of_bits - 1) // 8
+    last_bits = number_of_bits - 8*full_bytes
+    number = (bits & ((np.uint64(1) << last_bits) - 1)) << (8*full_bytes)
+    for j in range(min(int(full_bytes.max(initial=0)), 7)):
+        has_byte = full_bytes > j
+        shift = np.where(has_byte, number_of_bits - 8*(j+1), np.uint64(0))
+        number |= np.where(has_byte, ((bits >> shift) & np.uint64(0xff)) << np.uint64(8*j), np.uint64(0))
+    number, z = np.divmod(number, sizes[:, 2])
+    x, y = np.divmod(number, sizes[:, 1])
+    ints = np.stack([x, y, z], axis=1).astype(np.int64)
+
+    # combined integers of more than 64 bits are only used for very large ranges of coordinates
+    for k in np.flatnonzero(number_of_bits > 64):
+        ints[k] = _receive_wide_ints(data, int(positions[k]), int(number_of_bits[k]), sizes[k].tolist())
+    return ints
+
+
+def _decompress(data, number_of_atoms, minint, maxint, smallidx):
+    """Get (N, 3) array of integer coordinates from the compressed bytes of an xtc frame
+       Follows xdrfile_decompress_coord_float of the xdrfile library: atoms are stored as integers
+       relative to minint, followed by runs of atoms stored as small differences to the previous atom
+       The size of each run and of its differences depends on the previous runs, so only the run headers
+       are read one at a time, and the integers are then read and summed for all atoms at once
+    """
+    total_bits = 8*len(data)
+    data = data + bytes(16)  # integers are read in whole 64 bit words past the end
+
+    sizeint = [maxint[i] - minint[i] + 1 for i in range(3)]
+    if any(size > 0xffffff for size in sizeint):
+        bitsizeint = [size.bit_length() for size in sizeint]
+        bitsize = 0
+        large_bits = sum(bitsizeint)
+    else:
+        bitsize = (sizeint[0] * sizeint[1] * sizeint[2]).bit_length()
+        large_bits = bitsize
+    if not _FIRST_INDEX <= smallidx < len(_MAGIC_INTS):
+        return np.empty((0, 3), dtype=np.int64)
+
+    # run header at every bit position: a flag bit, set if the run changes, followed by 5 bits of the new run
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    headers = np.zeros(len(bits) - 5, dtype=np.uint8)
+    for k in range(6):
+        headers |= bits[k:len(bits)-5+k] << (5 - k)
+    header_bytes = headers.tobytes()
+
+    # bit position of each atom stored as a large integer, and the changes of the run of small differences
+    # that follows it: atom the change is read at, number of differences, and their size in bits at the atom
+    # and for the following atoms
+    large_positions = []
+    changes = [-1, 0, smallidx, smallidx]
+    position = 0
+    i = 0
+    count = 0
+    while i < number_of_atoms and position < total_bits:
+        large_positions.append(position)
+        position += large_bits
+        header = header_bytes[position]
+        if header & 32:
+            run = header & 31
+            count = run // 3
+            changes += (len(large_positions) - 1, count, smallidx, smallidx + run % 3 - 1)
+            position += 6 + count*smallidx
+            smallidx += run % 3 - 1
+            if not _FIRST_INDEX <= smallidx < len(_MAGIC_INTS):
+                return np.empty((0, 3), dtype=np.int64)
+        else:
+            position += 1 + count*smallidx
+        i += 1 + count
+    if position > total_bits:
+        return np.empty((0, 3), dtype=np.int64)
+
+    large_positions = np.array(large_positions, dtype=np.int64)
+    if bitsize == 0:
+        offsets = [0, bitsizeint[0], bitsizeint[0] + bitsizeint[1]]
+        large = np.stack([_read_bits(data, large_positions + offset, number_of_bits)\
+                          for offset, number_of_bits in zip(offsets, bitsizeint)], axis=1)
+    else:
+        large = _receive_ints(data, large_positions, bitsize, sizeint)
+    large = large.astype(np.int64) + np.array(minint, dtype=np.int64)
+
+    atoms, counts, small_bits, next_small_bits = np.array(changes, dtype=np.int64).reshape(-1, 4).T
+    records = np.arange(len(large_positions))
+    runs = np.searchsorted(atoms, records, side='right') - 1
+    counts = counts[runs]
+    small_bits = np.where(atoms[runs] == records, small_bits[runs], next_small_bits[runs])
+    small_positions = large_positions + large_bits + np.where(headers[large_positions + large_bits] & 32, 6, 1)
+
+    run_starts = np.cumsum(counts) - counts
+    small_bits = np.repeat(small_bits, counts)
+    positions = np.repeat(small_positions, counts) + (np.arange(len(small_bits)) - np.repeat(run_starts, counts))*small_bits
+    sizes = np.array(_MAGIC_INTS, dtype=np.int64)[small_bits]
+    # differences are stored relative to half their size, smallnum of xdrfile
+    small = _receive_ints(data, positions, small_bits, sizes[:, np.newaxis]) - (sizes // 2)[:, np.newaxis]
+
+    # atoms in the order they are stored, each large integer followed by the differences of its run
+    starts = run_starts + np.arange(len(counts))
+    is_large = np.zeros(len(large) + len(small), dtype=bool)
+    is_large[starts] = True
+    coords = np.empty((len(is_large), 3), dtype=np.int64)
+    coords[is_large] = large
+    coords[~is_large] = small
+    totals = np.cumsum(coords, axis=0)
+    coords = totals - np.repeat(totals[starts] - coords[starts], counts + 1, axis=0)
+
+    # the first two atoms of a run are interchanged for better compression of water molecules
+    starts = starts[counts > 0]
+    coords[starts], coords[starts + 1] = coords[starts + 1], coords[starts].copy()
+    return coords
+
+
+class Xtc(BaseCoordsClass):
+    """reads Gromacs xtc trajectories, frames are XDR encoded headers followed by coordinates
+       compressed with a fixed precision
+    """
+
+    persist_frame_offsets = True
+
+    def __error(self):
+        return ParserError(self.file_name, details='Xtc file is not formatted properly.')
+
+    def __frame_size(self, header):
+        """Size in bytes of the frame starting with header"""
+        if len(header) < 56 or struct.unpack('>i', header[:4])[0] != _MAGIC:
+            raise self.__error()
+        number_of_atoms = struct.unpack('>i', header[4:8])[0]
+        if number_of_atoms <= 9:  # coordinates of small systems are not compressed
+            return 56 + 12*number_of_atoms
+        if len(header) < _HEADER_SIZE:
+            raise self.__error()
+        number_of_bytes = struct.unpack('>i', header[88:92])[0]
+        return _HEADER_SIZE + (number_of_bytes + 3) // 4 * 4
+
+    def _index_frames(self, file, max_frames=None):
+        offsets = []
+        position = 0
+        while max_frames is None or len(offsets) < max_frames:
+            file.seek(position)
+            header = file.read(_HEADER_SIZE)
+            if not header:
+                break
+            try:
+                frame_size = self.__frame_size(header)
+            except ParserError:
+                if not offsets:
+                    raise
+                break  # incomplete last frame
+            file.seek(position + frame_size - 1)
+            if len(file.read(1)) < 1:
+                break
+            offsets.append(position)
+            position += frame_size
+        if not offsets:
+            raise self.__error()
+        return offsets + [position]
+
+    def _parse_frame(self, data, out=None):
+        self.__frame_size(data)
+        number_of_atoms, step, time = struct.unpack('>iif', data[4:16])
+        box = box_from_matrix(np.frombuffer(data, '>f4', 9, 16).reshape(3, 3))
+        if number_of_atoms <= 9:
+            coords = np.frombuffer(data, '>f4', 3*number_of_atoms, 56).reshape(-1, 3)
+        else:
+            precision = struct.unpack('>f', data[56:60])[0]
+            minint, maxint = struct.unpack('>3i', data[60:72]), struct.unpack('>3i', data[72:84])
+            smallidx, number_of_bytes = struct.unpack('>2i', data[84:92])
+            ints = _decompress(data[92:92+number_of_bytes], number_of_atoms, minint, maxint, smallidx)
+            if len(ints) != number_of_atoms:
+                raise self.__error()
+            # xdrfile multiplies by the inverse precision in single precision
+            coords = ints.astype(np.float32) * np.float32(1.0 / precision)
+        if out is not None and out.shape == coords.shape:
+            out[:] = coords
+            coords = out
+        else:
+            coords = coords.astype(float)
+        return Frame(step, time, box, coords)
+
+    def _read(self):
+        """Read atom coordinates and box dimensions of the first frame"""
+        with open(self.file_name, 'rb') as f:
+            frame = self.read_frame(f, *self._index_frames(f, 1))
+        coords = pd.DataFrame(frame.coords, columns=['x', 'y', 'z'],
+                              index=pd.RangeIndex(1, len(frame.coords)+1, name='id'))
+        return coords, frame.box
+
+    def write(self, *args, **kwargs):
+        raise MiMiCPyError('Writing xtc files is not supported')
+
+    def _write(self, mpt_coords, box, title, out):
+        self.write()
@@ -1,20 +1,95 @@
+import copy
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+import numpy as np
 import pandas as pd
+from ..coords.base import CoordsIO
 from ..topology.mpt import Mpt
 from ..scripts.mdp import Mdp
 from ..scripts.ndx import Ndx
 from ..scripts.cpmd import CpmdScript, Pseudopotential
-from ..utils.errors import SelectionError
+from ..utils.errors import MiMiCPyError, SelectionError
 from ..utils.constants import BOHR_RADIUS
 from ..utils.file_handler import write
+from ..utils.intervals import IntervalSet
+
+
+def _set_qm_coords(cpmd, sorted_qm_atoms, coords, mm_box):
+    """Set the coordinates of the QM atoms in the ATOMS, MIMIC and SYSTEM sections of cpmd
+       coords is the (N, 3) array of coordinates in nm of sorted_qm_atoms
+    """
+
+    def qm_cell():
+        dims = (np.abs(coords.max(axis=0) - coords.min(axis=0)) + 0.7)/BOHR_RADIUS
+        a, b, c = dims
+        cell = ' '.join((str(round(a, 1)), str(round(b/a, 1)), str(round(c/a, 1)), '0 0 0'))
+        return cell
+
+    cpmd.atoms.clear_parameters()
+
+    # Get overlaps and atoms
+    overlaps = '{}'.format(len(sorted_qm_atoms))
+    atoms = zip(sorted_qm_atoms['id'], sorted_qm_atoms['element'], sorted_qm_atoms['is_link'],
+                (coords/BOHR_RADIUS).tolist())
+    for i, (gromacs_id, element, is_link, atom_coords) in enumerate(atoms):
+        cpmd_id = i + 1
+        overlaps += '\n2 {} 1 {}'.format(gromacs_id, cpmd_id)
+        element = str(element).lower()
+        if is_link:
+            element += '_link'
+        if cpmd.atoms.has_parameter(element):
+            pp_block = getattr(cpmd.atoms, element)
+            pp_block.coords.append(atom_coords)
+        else:
+            setattr(cpmd.atoms, element, Pseudopotential(atom_coords))
+
+    cpmd.mimic.overlaps = overlaps
+    cpmd.mimic.box = ' '.join([str(s/BOHR_RADIUS) for s in mm_box[:3]])  # diagonal of triclinic boxes
+    cpmd.system.cell = qm_cell()
+
+
+class _FrameInputWriter:
+    """writes the CPMD input script of one frame, the same script is used for all frames
+       Picklable, so that frames can be written in a process pool
+    """
+
+    def __init__(self, cpmd, sorted_qm_atoms, mm_box, number_of_atoms=None):
+        self.cpmd = cpmd
+        self.sorted_qm_atoms = sorted_qm_atoms
+        self.mm_box = mm_box
+        self.number_of_atoms = number_of_atoms
+
+    def __call__(self, task):
+        """task is the tuple (coordinate file, byte offsets of the frame or None for the whole file, output file)"""
+        coords_file, offsets, inp_out = task
+        if offsets is None:
+            reader = CoordsIO(coords_file)
+            positions, box = reader.positions, reader.box
+        else:
+            frame = CoordsIO(coords_file, mode='w').read_frame(*offsets)
+            positions, box = frame.coords, frame.box
+        if self.number_of_atoms is not None and len(positions) != self.number_of_atoms:
+            raise MiMiCPyError('Number of atoms in topology and coordinates of {} do not match ({} vs {})'
+                               .format(inp_out, self.number_of_atoms, len(positions)))
+        # atom IDs of coordinate files are their positions
+        coords = positions[self.sorted_qm_atoms['id'].to_numpy() - 1]
+        cpmd = copy.deepcopy(self.cpmd)
+        _set_qm_coords(cpmd, self.sorted_qm_atoms, coords, box if box is not None else self.mm_box)
+        write(str(cpmd), inp_out, 'w')
+        return inp_out
 
 
 class Preparation:
+    """QM region of a system, selected with selector
+       The QM region and link atoms are boolean masks indexed by atom ID, so adding and deleting atoms
+       only touches the IDs of the selected atoms, the qm_atoms dataframe is only built when it is needed
+    """
 
     def __init__(self, selector):
-        self.__qm_atoms = pd.DataFrame()
         self.selector = selector
+        self.clear()
 
     @staticmethod
     def __clean_qdf(qdf):
@@ -24,52 +99,106 @@ class Preparation:
         qdf.index = qdf.index.set_names(['id'])
         return qdf.drop(columns_to_drop, axis=1)
 
+    def __resize(self, max_id):
+        """Grow the masks to include atom max_id"""
+        if max_id < len(self.__is_qm):
+            return
+        size = max(max_id + 1, 2*len(self.__is_qm))
+        self.__is_qm = np.concatenate([self.__is_qm, np.zeros(size - len(self.__is_qm), dtype=bool)])
+        self.__is_link = np.concatenate([self.__is_link, np.zeros(size - len(self.__is_link), dtype=bool)])
+
+    def __select_ids(self, selection):
+        """Array of the atom IDs in selection, without reading their coordinates if the selector can do so"""
+        if hasattr(self.selector, 'select_ids'):
+            return np.asarray(self.selector.select_ids(selection), dtype=np.int64)
+        return self.selector.select(selection).index.to_numpy(dtype=np.int64)
+
     def add(self, selection=None, is_link=False):
-        qdf = Preparation.__clean_qdf(self.selector.select(selection))
-        qdf.insert(2, 'is_link', [int(is_link)]*len(qdf))
-        self.__qm_atoms = self.__qm_atoms.append(qdf)
+        """Add atoms to the QM region, selection can be a selection language expression or an IntervalSet of atom IDs"""
+        ids = self.__select_ids(selection)
+        if len(ids) == 0:
+            raise SelectionError('The selection did not return any atoms')
+        mpt = getattr(self.selector, 'mpt', None)
+        if ids.min() < 1 or (mpt is not None and ids.max() > mpt.number_of_atoms):
+            raise SelectionError('The selection has atom IDs that are not in the topology')
+        self.__resize(ids.max())
+        self.__is_qm[ids] = True
+        self.__is_link[ids] = is_link
+        self.__qm_atoms = None
 
     def delete(self, selection=None):
-        qdf = Preparation.__clean_qdf(self.selector.select(selection))
-        self.__qm_atoms = self.__qm_atoms.drop(qdf.index, errors='ignore')
+        ids = self.__select_ids(selection)
+        ids = ids[ids < len(self.__is_qm)]
+        self.__is_qm[ids] = False
+        self.__is_link[ids] = False
+        self.__qm_atoms = None
 
     def clear(self):
-        self.__qm_atoms = pd.DataFrame()
+        mpt = getattr(self.selector, 'mpt', None)
+        size = mpt.number_of_atoms + 1 if mpt is not None else 0
+        self.__is_qm = np.zeros(size, dtype=bool)
+        self.__is_link = np.zeros(size, dtype=bool)
+        self.__qm_atoms = None
+
+    @property
+    def qm_ids(self):
+        """Sorted array of the IDs of QM atoms"""
+        return np.flatnonzero(self.__is_qm)
 
     @property
     def qm_atoms(self):
+        """Dataframe of QM atoms indexed by ID, with coordinates and is_link column"""
+        if self.__qm_atoms is None:
+            qm_ids = self.qm_ids
+            if len(qm_ids) == 0:
+                self.__qm_atoms = pd.DataFrame()
+                return self.__qm_atoms
+            atoms = Preparation.__clean_qdf(self.selector.select(IntervalSet.from_ids(qm_ids)))
+            qm_atoms = atoms.loc[qm_ids].copy()
+            qm_atoms.insert(2, 'is_link', self.__is_link[qm_ids].astype(int))
+            self.__qm_atoms = qm_atoms
         return self.__qm_atoms
 
-    def get_mimic_input(self, inp_tmp=None, ndx_out=None, inp_out=None):
-        """Args:
-            inp_tmp: cpmd input file, used as template
-            mdp_inp: gromacs input file, checked for errors
-            ndx_out: gromacs index file, output
-            inp_out: mimic cpmd input file, output
-        """
+    @property
+    def boundary_bonds(self):
+        """(N, 2) array of bonds between QM atoms and MM atoms, as pairs of QM atom ID and MM atom ID"""
+        mpt = getattr(self.selector, 'mpt', None)
+        qm_ids = self.qm_ids
+        if len(qm_ids) == 0 or mpt is None:
+            return np.empty((0, 2), dtype=np.int64)
+        return mpt.crossing_bonds(qm_ids)
 
-        def qm_cell():
-            dims = [0, 0, 0]
-            for i, r in enumerate(['x', 'y', 'z']):
-                dims[i] = (abs(max(self.__qm_atoms[r]) - min(self.__qm_atoms[r])) + 0.7)/BOHR_RADIUS
-            a, b, c = dims
-            cell = ' '.join((str(round(a, 1)), str(round(b/a, 1)), str(round(c/a, 1)), '0 0 0'))
-            return cell
+    @property
+    def boundary_atoms(self):
+        """IDs of QM atoms with a bond to an MM atom"""
+        return np.unique(self.boundary_bonds[:, 0])
 
-        # Check for obvious errors in selection
-        if self.__qm_atoms.empty:
+    def __check_qm_atoms(self):
+        """Check for obvious errors in selection"""
+        if not self.__is_qm.any():
             raise SelectionError('No atoms have been selected for the QM partition')
-            
-        # Create an index group in GROMACS format (and write it to a file)
+
+        boundary_bonds = self.boundary_bonds
+        if len(boundary_bonds) == 0:
+            return
+        boundary_atoms = np.unique(boundary_bonds[:, 0])
+        logging.info('%s bonds cross the boundary of the QM region at QM atoms %s',
+                     len(boundary_bonds), ', '.join(map(str, boundary_atoms)))
+        unlinked = np.setdiff1d(boundary_atoms, np.flatnonzero(self.__is_link))
+        if len(unlinked) > 0:
+            logging.warning('QM atoms %s are bonded to MM atoms but are not link atoms', ', '.join(map(str, unlinked)))
+
+    def __write_ndx(self, ndx_out):
+        """Create an index group in GROMACS format (and write it to a file)"""
         qm_ndx_group = Ndx('qmatoms') # use default name
-        qm_ndx_group.qmatoms = self.__qm_atoms.index.to_list()
+        qm_ndx_group.qmatoms = self.qm_ids.tolist()
         if ndx_out:
             write(str(qm_ndx_group), ndx_out, 'w')
             logging.info('Wrote Gromacs index file to %s', ndx_out)
+        return qm_ndx_group
 
-        # Create CPMD input script
-        sorted_qm_atoms = self.__qm_atoms.sort_values(by=['is_link', 'element']).reset_index()
-
+    def __cpmd_template(self, inp_tmp):
+        """CPMD input script with the parameters that do not depend on the coordinates of the QM atoms"""
         if inp_tmp is None:
             cpmd = CpmdScript('Cpmd', 'System', 'Mimic', 'Atoms')
         elif isinstance(inp_tmp, str):
@@ -79,30 +208,13 @@ class Preparation:
         
         cpmd.atoms.clear_parameters() # clear atoms from inp_temp
 
-        # Get overlaps and atoms
-        overlaps = '{}'.format(len(sorted_qm_atoms))
-        for i, atom in sorted_qm_atoms.iterrows():
-            gromacs_id = atom['id']
-            cpmd_id = i + 1
-            overlaps += '\n2 {} 1 {}'.format(gromacs_id, cpmd_id)
-            element = str(atom['element']).lower()
-            coords = [atom['x']/BOHR_RADIUS, atom['y']/BOHR_RADIUS, atom['z']/BOHR_RADIUS]
-            if atom['is_link']:
-                element += '_link'
-            if cpmd.atoms.has_parameter(element):
-                pp_block = getattr(cpmd.atoms, element)
-                pp_block.coords.append(coords)
-            else:
-                setattr(cpmd.atoms, element, Pseudopotential(coords))
-
         if not cpmd.mimic.has_parameter('paths'):
             cpmd.mimic.paths = '1\n' + str(os.getcwd())
 
-        cpmd.mimic.overlaps = overlaps
-        cpmd.mimic.box = ' '.join([str(s/BOHR_RADIUS) for s in self.selector.mm_box])
-        cpmd.system.cell = qm_cell()
+        if not cpmd.system.has_parameter('cell'):
+            cpmd.system.cell = None  # set from the coordinates of the QM atoms, keeps the order of the parameters
 
-        total_charge = sum(self.__qm_atoms['charge'])
+        total_charge = sum(self.qm_atoms['charge'])
         if not round(total_charge, 2).is_integer():
             logging.warning('Total charge of QM region is %s, Rounding to integer', total_charge)
         cpmd.system.charge = round(total_charge)
@@ -112,6 +224,28 @@ class Preparation:
         
         if not cpmd.cpmd.has_parameter('timestep'):
             cpmd.cpmd.timestep = 5.0
+        return cpmd
+
+    def __sorted_qm_atoms(self):
+        """QM atoms in the order of the CPMD input, link atoms last
+           The sort is stable, so atoms of the same element stay in the order of their IDs
+        """
+        return self.qm_atoms.sort_values(by=['is_link', 'element'], kind='stable').reset_index()
+
+    def get_mimic_input(self, inp_tmp=None, ndx_out=None, inp_out=None):
+        """Args:
+            inp_tmp: cpmd input file, used as template
+            mdp_inp: gromacs input file, checked for errors
+            ndx_out: gromacs index file, output
+            inp_out: mimic cpmd input file, output
+        """
+        self.__check_qm_atoms()
+        qm_ndx_group = self.__write_ndx(ndx_out)
+
+        # Create CPMD input script
+        sorted_qm_atoms = self.__sorted_qm_atoms()
+        cpmd = self.__cpmd_template(inp_tmp)
+        _set_qm_coords(cpmd, sorted_qm_atoms, sorted_qm_atoms[['x', 'y', 'z']].to_numpy(), self.selector.mm_box)
 
         if inp_out is None:
             logging.info('Created new CPMD input script for MiMiC run')
@@ -120,7 +254,48 @@ class Preparation:
             logging.info('Wrote new CPMD input script to %s', inp_out)
 
         return qm_ndx_group, cpmd
-    
+
+    def get_mimic_inputs(self, coords, inp_tmp=None, ndx_out=None, inp_out='cpmd_{}.inp', start=0, stop=None, step=1,
+                         workers=1):
+        """Write a MiMiC CPMD input script for every frame of coords, the QM atoms are the same for all frames
+           Args:
+            coords: trajectory file, directory of gro files or list of coordinate files
+            inp_tmp: cpmd input file, used as template
+            ndx_out: gromacs index file, output
+            inp_out: mimic cpmd input files, output, formatted with the index of the frame in a trajectory,
+                     or the name of the coordinate file without extension
+            start, stop, step: range of frames of a trajectory
+            workers: number of processes used to write the input scripts
+           Returns list of the written input scripts
+        """
+        self.__check_qm_atoms()
+        self.__write_ndx(ndx_out)
+
+        if isinstance(coords, str) and os.path.isdir(coords):
+            gro_files = sorted(glob(os.path.join(coords, '*.gro')))
+            if not gro_files:
+                raise MiMiCPyError('No gro files found in {}'.format(coords))
+            coords = gro_files
+        if isinstance(coords, str):
+            offsets = CoordsIO(coords, mode='w').frame_offsets  # frames are read by offset, without indexing again
+            frames = range(len(offsets) - 1)[start:stop:step]
+            tasks = [(coords, (offsets[i], offsets[i+1]), inp_out.format(i)) for i in frames]
+        else:
+            tasks = [(file, None, inp_out.format(os.path.splitext(os.path.basename(file))[0])) for file in coords]
+
+        mpt = getattr(self.selector, 'mpt', None)
+        sorted_qm_atoms = self.__sorted_qm_atoms()
+        writer = _FrameInputWriter(self.__cpmd_template(inp_tmp), sorted_qm_atoms.drop(['x', 'y', 'z'], axis=1),
+                                   self.selector.mm_box, mpt.number_of_atoms if mpt is not None else None)
+        if workers > 1 and len(tasks) > 1:
+            workers = min(workers, len(tasks))
+            with ProcessPoolExecutor(workers) as executor:
+                inp_files = list(executor.map(writer, tasks, chunksize=max(1, len(tasks) // (4*workers))))
+        else:
+            inp_files = [writer(task) for task in tasks]
+        logging.info('Wrote %s CPMD input scripts for MiMiC runs', len(inp_files))
+        return inp_files
+
     @staticmethod
     def get_gmx_input(inp=None, qmatoms=None, out=None):
         
@@ -5,28 +5,44 @@ import xmlrpc.client as xmlrpclib
 import pandas as pd
 from ..topology.mpt import Mpt
 from ..coords.base import CoordsIO
+from .spatial import CellList
 from ..utils.errors import MiMiCPyError, SelectionError
+from ..utils.intervals import IntervalSet
 from ..utils.strings import print_table
 
 class DefaultSelector:
 
-    def __init__(self, mpt_file, coord_file, buffer=1000, nonstandard_atomtypes=None, gmxdata=None, file_ext=None):
+    def __init__(self, mpt_file, coord_file, buffer=1000, nonstandard_atomtypes=None, gmxdata=None, file_ext=None,
+                 frame=None):
         self.mpt = Mpt.from_file(mpt_file, buffer=buffer, nonstandard_atomtypes=nonstandard_atomtypes,\
                                  gmxdata=gmxdata, file_ext=file_ext)
         self.coords_reader = CoordsIO(coord_file, buffer=buffer)
+        if frame is not None:  # use a frame of a trajectory instead of the first one
+            self.coords_reader.seek(frame)
         n_mpt = self.mpt.number_of_atoms
         n_coords = len(self.coords_reader.coords)
         if n_mpt != n_coords:
             raise MiMiCPyError('Number of atoms in topology and coordinates do not match ({} vs {})'.format(n_mpt, n_coords))
+        # built on the first distance based selection, and reused for all later ones
+        coords = self.coords_reader.coords
+        # boxes guessed from the extent of the coordinates are not periodic
+        box = self.mm_box if self.coords_reader.has_box else None
+        self.spatial_index = CellList(self.coords_reader.positions, box, ids=coords.index.to_numpy())
 
     @property
     def mm_box(self):
         return self.coords_reader.box
 
+    def select_ids(self, selection):
+        """Get IntervalSet of atom IDs in selection"""
+        return self.mpt.select_ids(selection, self.spatial_index)
+
     def select(self, selection):
-        """Select MPT atoms and merge with GRO"""
-        sele = self.mpt.select(selection)
-        df = sele.merge(self.coords_reader.coords, left_on='id', right_on='id')
+        """Select MPT atoms and merge with GRO
+           selection can be a selection language expression or an IntervalSet of atom IDs
+        """
+        sele = self.mpt.select(selection, self.spatial_index)
+        df = self.coords_reader.join(sele)
 
         if df.empty:
             raise SelectionError('The atoms selected from topology were not found in the coordinates file')
@@ -39,15 +55,30 @@ class VisPackage(ABC, DefaultSelector):
     ##
     def __init__(self, mpt_file, coord_file, cmd, buffer, nonstandard_atomtypes, gmxdata, file_ext):
         self.cmd = cmd
-        self.mpt = Mpt.from_file(mpt_file, buffer=buffer, nonstandard_atomtypes=nonstandard_atomtypes,\
+        # atoms are only looked up by ID, so the topology is not expanded
+        self.mpt = Mpt.from_file(mpt_file, mode='w', buffer=buffer, nonstandard_atomtypes=nonstandard_atomtypes,\
                                  gmxdata=gmxdata, file_ext=file_ext)
         if coord_file:
             self._vis_pack_load(coord_file)
 
+    def select_ids(self, selection=None):
+        if isinstance(selection, IntervalSet):
+            return selection
+        return IntervalSet.from_ids(self._sele2df(selection)['id'])
+
     def select(self, selection=None):
+        """Select atoms with a selection of the Visualization Package or an IntervalSet of atom IDs"""
+        if isinstance(selection, IntervalSet):
+            selection = self._ids_selection(selection)
         sele = self._sele2df(selection)
         mpt_sele = self.mpt[sele['id']]
-        df = mpt_sele.merge(sele, left_on='id', right_on='id').set_index(['id'])
+        if sele['id'].is_unique:
+            # rows of mpt_sele are in the order of the IDs in sele
+            df = mpt_sele.copy()
+            for column in sele.columns.drop('id'):
+                df[column] = sele[column].to_numpy()
+        else:
+            df = mpt_sele.merge(sele, left_on='id', right_on='id').set_index(['id'])
         
         if df.empty:
             raise MiMiCPyError('The atoms IDs in selection do not exist in {}'.format(self.mpt))
@@ -92,6 +123,13 @@ class VisPackage(ABC, DefaultSelector):
         Should be implemented in the respecitve VisPack Class
         """
         pass
+
+    @abstractmethod
+    def _ids_selection(self, ids):
+        """
+        Selection of the Visualization Package for the atoms with IDs in ids (IntervalSet)
+        """
+        pass
     ##
     #######
 
@@ -131,6 +169,11 @@ class PyMOLSelector(VisPackage):
         return [b/10 for b in box[:3]]
 
 
+    def _ids_selection(self, ids):
+        ranges = ['{}-{}'.format(start, stop-1) if stop-1 > start else str(start)
+                  for start, stop in zip(ids.starts, ids.stops)]
+        return 'id ' + '+'.join(ranges)
+
     def _sele2df(self, selection):
         if selection is None:
             selection = 'sele'
@@ -186,6 +229,12 @@ class VMDSelector(VisPackage):
         # convert from ang to nm
         return [box[k]/10 for k in ['a', 'b', 'c']]
 
+    def _ids_selection(self, ids):
+        # vmd uses 0 based index
+        ranges = ['{} to {}'.format(start-1, stop-2) if stop-1 > start else str(start-1)
+                  for start, stop in zip(ids.starts, ids.stops)]
+        return 'index ' + ' '.join(ranges)
+
     def _sele2df(self, selection):
         if selection is None:
             selection = 'atomselect0'
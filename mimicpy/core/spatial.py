@@ -0,0 +1,104 @@
+"""Module for distance-based atom searches"""
+
+import logging
+import numpy as np
+from ..utils.intervals import IntervalSet
+
+
+class CellList:
+    """Cell list over atom coordinates for neighbour searches
+       Periodic boundaries are applied if box is given, cells are only built on the first search
+    """
+
+    def __init__(self, coords, box=None, ids=None, cell_size=0.5):
+        self.coords = coords
+        # atom IDs are only needed if they are not positions+1
+        if ids is not None and np.array_equal(ids, np.arange(1, len(ids)+1)):
+            ids = None
+        self.ids = ids
+        self.cell_size = cell_size
+        self.box = self.__get_box(box)
+        self._cell_atoms = None
+
+    @staticmethod
+    def __get_box(box):
+        if box is None:
+            return None
+        box = np.asarray(box, dtype=float)
+        if len(box) == 9 and np.any(box[3:] != 0):
+            logging.warning('Triclinic box found, distance searches only use its diagonal')
+        box = box[:3]
+        if np.any(box <= 0):
+            return None
+        return box
+
+    def __build(self):
+        coords = np.asarray(self.coords, dtype=float)
+        if self.box is None:
+            origin = coords.min(axis=0) if len(coords) else np.zeros(3)
+            extent = (coords.max(axis=0) - origin) if len(coords) else np.zeros(3)
+            self._n_cells = np.maximum(np.floor(extent / self.cell_size).astype(int), 1)
+            self._cell_length = np.maximum(extent, self.cell_size) / self._n_cells
+            scaled = (coords - origin) / self._cell_length
+        else:
+            self._n_cells = np.maximum(np.floor(self.box / self.cell_size).astype(int), 1)
+            self._cell_length = self.box / self._n_cells
+            scaled = np.mod(coords, self.box) / self._cell_length
+        cell_xyz = np.minimum(scaled.astype(int), self._n_cells - 1)
+        cells = np.ravel_multi_index(cell_xyz.T, self._n_cells)
+
+        # atoms sorted by cell, with the start of each cell in the sorted array (CSR layout)
+        self._cell_atoms = np.argsort(cells, kind='stable')
+        self._cell_starts = np.searchsorted(cells[self._cell_atoms], np.arange(np.prod(self._n_cells)+1))
+        self._cell_xyz = cell_xyz
+        self._coords = coords
+
+    @staticmethod
+    def __cell_offsets(reach):
+        offsets = np.arange(-reach, reach+1)
+        return np.stack(np.meshgrid(offsets, offsets, offsets, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    def __neighbour_cells(self, cell_xyz, offsets):
+        neighbours = cell_xyz + offsets
+        if self.box is None:
+            inside = np.all((neighbours >= 0) & (neighbours < self._n_cells), axis=1)
+            neighbours = neighbours[inside]
+        else:
+            neighbours = np.mod(neighbours, self._n_cells)
+        return np.unique(np.ravel_multi_index(neighbours.T, self._n_cells))
+
+    def __atoms_in_cells(self, cells):
+        starts, stops = self._cell_starts[cells], self._cell_starts[cells+1]
+        return self._cell_atoms[IntervalSet(starts, stops).to_array()]
+
+    def within(self, distance, ids):
+        """Get IntervalSet of atom IDs within distance of any atom in ids (IntervalSet)"""
+        if self._cell_atoms is None:
+            self.__build()
+        positions = np.asarray(ids, dtype=np.int64) - 1 if self.ids is None else\
+                    np.flatnonzero(np.isin(self.ids, np.asarray(ids)))
+        if positions.size == 0:
+            return IntervalSet()
+
+        offsets = self.__cell_offsets(int(np.ceil(distance / self._cell_length.min())))
+        query_cells = np.ravel_multi_index(self._cell_xyz[positions].T, self._n_cells)
+        order = np.argsort(query_cells, kind='stable')
+        unique_cells, first = np.unique(query_cells[order], return_index=True)
+
+        hits = np.zeros(len(self._coords), dtype=bool)
+        hits[positions] = True
+        for cell, start, stop in zip(unique_cells, first, np.append(first[1:], len(order))):
+            query = self._coords[positions[order[start:stop]]]
+            cell_xyz = np.array(np.unravel_index(cell, self._n_cells))
+            candidates = self.__atoms_in_cells(self.__neighbour_cells(cell_xyz, offsets))
+            candidates = candidates[~hits[candidates]]
+            if candidates.size == 0:
+                continue
+            delta = self._coords[candidates][:, np.newaxis, :] - query[np.newaxis, :, :]
+            if self.box is not None:
+                delta -= self.box * np.round(delta / self.box)
+            close = np.any(np.einsum('ijk,ijk->ij', delta, delta) <= distance**2, axis=1)
+            hits[candidates[close]] = True
+
+        hit_positions = np.flatnonzero(hits)
+        return IntervalSet.from_ids(hit_positions + 1 if self.ids is None else self.ids[hit_positions])
@@ -1,5 +1,7 @@
+import numpy as np
 from .script import Script
 from ..utils.errors import ScriptError
+from ..utils.intervals import IntervalSet
 
 class Ndx(Script):
     def __init__(self, *groups):
@@ -14,20 +16,18 @@ class Ndx(Script):
     def __get_indx(self, group):
         indx = getattr(self, group)
         
-        if not isinstance(indx, list):
+        if not isinstance(indx, (list, IntervalSet)):
             raise ScriptError(indx)
         
         return indx
     
     def __str_one_group(self, group):
-        indices = self.__get_indx(group)
-        max_len = len(str(max(indices))) + 1
+        indices = np.asarray(self.__get_indx(group), dtype=np.int64)
+        max_len = len(str(indices.max())) + 1
         spaces = self._space_len if max_len <= self._space_len else max_len
         ndx_group = '[ '+group+' ]'
-        for i, idx in enumerate(indices):
-            if i%self._col_len == 0:
-                ndx_group += '\n'
-            ndx_group += "{:{}}".format(idx, spaces)
+        for i in range(0, len(indices), self._col_len):
+            ndx_group += '\n' + ''.join(["{:{}}".format(idx, spaces) for idx in indices[i:i+self._col_len].tolist()])
         ndx_group += '\n'
         return ndx_group
             
@@ -30,7 +30,11 @@ class Script(ABC):
     def __getattr__(self, key):
         key = key.lower()
         if key.startswith('_') or key == 'has_parameter' or key == 'parameters' or key == 'clear_parameters':
-            return self.__getattribute__('__dict__')[key]
+            try:
+                return self.__getattribute__('__dict__')[key]
+            except KeyError:
+                # AttributeError is expected for missing special methods, e.g. when scripts are copied or pickled
+                raise AttributeError(key)
         try:
             return self.__getattribute__('__orddict__')[key]
         except KeyError:
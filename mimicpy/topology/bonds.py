@@ -0,0 +1,59 @@
+"""Module for bonds of molecule type templates"""
+
+import numpy as np
+
+
+class Bonds:
+    """bonds of a molecule type template in compressed sparse row (CSR) format
+       Rows are 0-based atom positions in the template, every bond is stored in both directions,
+       so the bonded atoms of row i are indices[indptr[i]:indptr[i+1]]
+    """
+
+    def __init__(self, indptr, indices):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    @classmethod
+    def from_pairs(cls, first, second, number_of_atoms):
+        """Create from arrays of bonded rows, duplicate bonds are removed"""
+        first, second = np.asarray(first, dtype=np.int64), np.asarray(second, dtype=np.int64)
+        rows = np.concatenate([first, second])
+        columns = np.concatenate([second, first])
+        keys = np.unique(rows*max(number_of_atoms, 1) + columns)
+        rows, columns = np.divmod(keys, max(number_of_atoms, 1))
+        indptr = np.searchsorted(rows, np.arange(number_of_atoms+1))
+        return cls(indptr, columns)
+
+    @classmethod
+    def empty(cls, number_of_atoms):
+        return cls(np.zeros(number_of_atoms+1, dtype=np.int64), [])
+
+    @property
+    def number_of_atoms(self):
+        return len(self.indptr) - 1
+
+    def pairs(self):
+        """Arrays of first and second rows of every bond, with first < second"""
+        rows = np.repeat(np.arange(self.number_of_atoms, dtype=np.int64), np.diff(self.indptr))
+        keep = rows < self.indices
+        return rows[keep], self.indices[keep]
+
+    def neighbors(self, rows):
+        """Get positions in rows and bonded rows of all bonds of rows, both arrays have one entry per bond"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, counts = self.indptr[rows], self.indptr[rows+1] - self.indptr[rows]
+        positions = np.repeat(np.arange(len(rows), dtype=np.int64), counts)
+        # index into indices of every bond, counting up from the start of its row
+        offsets = np.arange(counts.sum(), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+        return positions, self.indices[offsets]
+
+    def __len__(self):
+        return len(self.indices) // 2
+
+    def __eq__(self, other):
+        if not isinstance(other, Bonds):
+            return NotImplemented
+        return np.array_equal(self.indptr, other.indptr) and np.array_equal(self.indices, other.indices)
+
+    def __repr__(self):
+        return 'Bonds({} atoms, {} bonds)'.format(self.number_of_atoms, len(self))
@@ -0,0 +1,72 @@
+"""Module for resolving and reading #include files of topologies"""
+
+import re
+from collections import Counter
+from os.path import abspath, dirname, isfile, join
+from .sections import index_molecules
+from ..utils.strings import clean
+
+_INCLUDE_REGEX = re.compile(r"#include\s+[\"\'](.+)\s*[\"\']", re.MULTILINE)
+
+
+class IncludeResolver:
+    """resolves #include paths against the including file's directory and gmxdata,
+       and keeps the text of every file in memory, so that each file is only read once from disk
+       read_counts and request_counts record how many times each file was read from disk and requested
+    """
+
+    def __init__(self, gmxdata='', texts=None):
+        self.gmxdata = gmxdata
+        self.__texts = {abspath(file): text for file, text in (texts or {}).items()}
+        self.__includes = {}
+        self.__molecule_indices = {}
+        self.read_counts = Counter()
+        self.request_counts = Counter()
+
+    def read(self, file):
+        """Get text of file, raises OSError if it cannot be found"""
+        path = abspath(file)
+        self.request_counts[path] += 1
+        if path not in self.__texts:
+            with open(path, 'r') as f:
+                self.__texts[path] = f.read()
+            self.read_counts[path] += 1
+        return self.__texts[path]
+
+    def molecule_index(self, file):
+        """Offsets of the sections of each molecule type in file, see sections.index_molecules"""
+        path = abspath(file)
+        if path not in self.__molecule_indices:
+            self.__molecule_indices[path] = index_molecules(self.read(file))
+        return self.__molecule_indices[path]
+
+    def resolve(self, include, including_file):
+        """Path of include, looked up next to including_file first and then in gmxdata"""
+        local = join(dirname(including_file), include)
+        if self.gmxdata is None or isfile(local):
+            return local
+        return join(self.gmxdata, include)
+
+    def includes(self, file, text=None):
+        """Paths of files included in file, text can be passed if it is not the text of file on disk"""
+        if text is not None:
+            return [self.resolve(include, file) for include in _INCLUDE_REGEX.findall(clean(text, ';'))]
+        path = abspath(file)
+        if path not in self.__includes:
+            self.__includes[path] = self.includes(file, self.read(file))
+        return self.__includes[path]
+
+    def include_graph(self, file):
+        """Absolute paths of file and all files it includes recursively, missing files are also listed"""
+        files = []
+        pending = [file]
+        while pending:
+            current = pending.pop(0)
+            if abspath(current) in files:
+                continue
+            files.append(abspath(current))
+            try:
+                pending += self.includes(current)
+            except OSError:
+                continue
+        return files
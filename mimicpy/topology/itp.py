@@ -1,21 +1,36 @@
 """Module for itp files"""
 
-from os.path import dirname, isfile, join
-import re
+import io
 import logging
+import re
+import numpy as np
 import pandas as pd
-from ..utils.file_handler import Parser
-from ..utils.strings import clean
+from .bonds import Bonds
+from .includes import IncludeResolver
+from .sections import tokenize
 from ..utils.elements import ELEMENTS
 from ..utils.errors import MiMiCPyError, ParserError
 
+_MAX_ATOM_FIELDS = 11  # [ atoms ] lines can also have typeB, chargeB and massB
+_DIRECTIVE_REGEX = re.compile(r"^[ \t]*#.*$", re.MULTILINE)
+_BOND_REGEX = re.compile(r"^[ \t]*(\d+)[ \t]+(\d+)", re.MULTILINE)  # first two atoms of [ bonds ] lines
+_ELEMENT_SYMBOLS = set(ELEMENTS.values())
+# element guessed from the integer mass, for masses up to 35 (H to Cl)
+_ELEMENTS_BY_MASS = np.array([None, 'H'] + [ELEMENTS[mass//2] for mass in range(2, 36)], dtype=object)
+
+
 class Itp:
-    """reads itp files"""
+    """reads itp files
+       Files are read through resolver (see includes), which can be shared to read each file only once
+       buffer is ignored, sections are parsed in bulk, it is only kept for compatibility
+    """
 
     columns = ['number', 'type', 'resid', 'resname', 'name', 'charge', 'element', 'mass']
 
-    def __init__(self, file, requested_molecules=None, atom_types=None, buffer=1000, mode='r', guess_elements=True, gmxdata=''):
+    def __init__(self, file, requested_molecules=None, atom_types=None, buffer=1000, mode='r', guess_elements=True, gmxdata='',
+                 resolver=None):
         self.file = file
+        self.resolver = IncludeResolver(gmxdata) if resolver is None else resolver
         self.requested_molecules = requested_molecules
         self.atom_types_dict = atom_types
         self.buffer = buffer
@@ -23,6 +38,7 @@ class Itp:
         self.guess_elements = guess_elements
         self.gmxdata = gmxdata
         self._topol = None
+        self._bonds = None
         self._topology_files = None
         self._molecules = None
         self._molecule_types = None
@@ -45,6 +61,15 @@ class Itp:
         self.__read()
         return self._topol
 
+    @property
+    def bonds(self):
+        """Dictionary of Bonds of each molecule in topol"""
+        if self.mode == 'r':
+            return self._bonds
+        self.mode = 'r'
+        self.__read()
+        return self._bonds
+
     @property
     def molecules(self):
         if self.mode == 't':
@@ -76,99 +101,31 @@ class Itp:
     @staticmethod
     def __get_molecules(topology):
         molecules = []
-        for line in topology.splitlines()[::-1]:
-            if Itp.__section_is_in_string('molecules', line):
-                break
-            if line.strip() == '' or line.startswith(';'):
-                continue
-            molecule_name, number_of_molecules = line.split()
+        for _, _, fields in tokenize(topology, ['molecules']):
+            molecule_name, number_of_molecules = fields
             molecules += [(molecule_name, int(number_of_molecules))]
-        return molecules[::-1]
-
-    @staticmethod
-    def __section_is_in_string(section, string):
-        return bool('[' in string and ']' in string and section in string)
-
-    @staticmethod
-    def __get_section(section, string):
-        # Clean string - or not?
-        # Find text b/w [ section ] and either [ or # or EOF
-        # Look for [ section ] / look for lines / look for optional spaces and [ or #
-        # string = clean(string, comments)
-        section_regex = re.compile(r"\[\s*"+str(section)+"\s*\]\n((?:.+\n)+?)\s*(?:$|\[|#)", re.MULTILINE)
-        section_list = section_regex.findall(string)
-        return section_list
-
-    @staticmethod
-    def __parse_block_till_section(itp, *sections):
-
-        def get_section_headers(string):
-            section_header_regex = re.compile(r"\[\s*(.*?)\s*\]", re.MULTILINE)
-            section_headers = section_header_regex.findall(string)
-            return section_headers
-
-        part_of_itp = ''
-        read_sections = []
-        for chunk in itp:
-            part_of_itp += chunk
-            sections_in_chunk = get_section_headers(chunk)
-            read_sections += sections_in_chunk
-            # All wanted section headers have been passed and last section has been read completely
-            if set(sections).issubset(read_sections) and read_sections[-1] != sections[-1]:
-                break
-        return part_of_itp
-
-    def __load_molecules_and_atoms(self):
-        itp_file = Parser(self.file, self.buffer)
-        itp_text = ''
-        while not itp_file.is_closed:
-            block = Itp.__parse_block_till_section(itp_file, 'moleculetype', 'atoms')
-            if any([Itp.__section_is_in_string(section, block) for section in ['moleculetype', 'atoms']]):
-                itp_text += block
-        return itp_text
-
-    def __get_included_topology_files(self, string, comments=';'):
-        string = clean(string, comments)
-        include_file_regex = re.compile(r"#include\s+[\"\'](.+)\s*[\"\']", re.MULTILINE)
-        included_itps = include_file_regex.findall(string)
-
-        if self.gmxdata is None:
-            included_itps = [join(dirname(self.file), itp) for itp in included_itps]
-        else:
-            included_itps = [join(dirname(self.file), itp) if isfile(join(dirname(self.file), itp)) \
-                         else join(self.gmxdata, itp) for itp in included_itps]
-        return included_itps
-
-    def __get_all_atomtypes_sections(self):
-        itp_file = Parser(self.file, self.buffer)
-        itp_text = Itp.__parse_block_till_section(itp_file, 'atomtypes')
-        clean_itp_text = clean(itp_text, comments=';')
-        atomtypes_section = "\n".join(Itp.__get_section('atomtypes', clean_itp_text))
-        if atomtypes_section == "":
-            included_itps = self.__get_included_topology_files(clean_itp_text)
-            for included_itp in included_itps:
-                try:
-                    itp = Itp(included_itp, mode='w')
-                    atom_types = itp.__get_all_atomtypes_sections()
-                    if atom_types is not None:
-                        atomtypes_section += atom_types
-                except OSError:
-                    logging.warning('Could not find %s. Skipping.', included_itp)
-            return atomtypes_section
-        else:
-           return atomtypes_section
-
+        return molecules
+
+    def __get_all_atomtypes(self):
+        """Fields of all lines in [ atomtypes ] sections of the file, or of its included files if it has none"""
+        atomtypes = [fields for _, _, fields in tokenize(self.resolver.read(self.file), ['atomtypes'])]
+        if atomtypes:
+            return atomtypes
+        for included_itp in self.resolver.includes(self.file):
+            try:
+                atomtypes += Itp(included_itp, mode='w', resolver=self.resolver).__get_all_atomtypes()
+            except OSError:
+                logging.warning('Could not find %s. Skipping.', included_itp)
+        return atomtypes
 
     def __read_atomtypes(self):
-        atomtypes_section = self.__get_all_atomtypes_sections()
         cols = ['type', 'X', 'mass', 'charge', 'ptype', 'sigma', 'epsilon']
         float_cols = [cols[i] for i in range(7) if i in [2,3,5,6]]
         atm_types_section_dct = {k:[] for k in cols}
-        for line in atomtypes_section.splitlines():
-            line_split = line.split()
+        for line_split in self.__get_all_atomtypes():
             if len(line_split) not in [6, 7]:
-                raise ParserError(self.file, 'topology',
-                        details='following line in [ atomtypes ] section not formatted properly: {}'.format(line))
+                raise ParserError(self.file, 'topology', details='following line in [ atomtypes ] section'
+                                  ' not formatted properly: {}'.format(' '.join(line_split)))
             else:
                 if len(line_split) == 6:
                     line_split.insert(1, 'X')
@@ -186,91 +143,124 @@ class Itp:
         df = df.set_index(cols[0])
         return df[elem_col].to_dict()
 
-    def __read(self):
-
-        def guess_element_from(mass, name, atom_type):
-            mass_int = int(round(mass))
-
-            if mass_int == 1:  # Guess H from mass
-                element = 'H'
-            elif mass_int < 36 and mass_int > 1:  # Guess He to Cl from mass
-                element = ELEMENTS[mass_int//2]
-            # for mass > 36 of mass <= 0
-            elif name.title() in ELEMENTS.values():  # Guess from atom name
-                element = name.title()
-            elif atom_type.title() in ELEMENTS.values():  # Guess from atom type
-                element = atom_type.title()
-            else:
-                element = 'H'
-                logging.error('Atomic number for atom with type {} and name {} cannot'
-                              ' be guessed. A default value of H was assigned'.format(atom_type, name))
-
-            self.guessed_elems_history[atom_type] = element
-
-            return element
-
-        def read_atoms(atom_section):
-            cols = self.columns
-            atom_info = {k:[] for k in cols}
-            number_of_bad_lines = 0
-            for i, line in enumerate(atom_section.splitlines()):
-                line = line.split()
-                if len(line) == 8:
-                    number, atom_type, resid, resname, name, _, charge, mass = line[:8]
-                elif len(line) == 7:
-                    number, atom_type, resid, resname, name, _, charge = line[:7]
-                    mass = 0
+    def __guess_elements(self, masses, names, atom_types):
+        """Guess elements from the mass, or else from the atom name or type,
+           each distinct (mass, name, type) is only guessed once
+        """
+        mass_ints = np.rint(masses).astype(np.int64)
+        elements = np.empty(len(masses), dtype=object)
+        by_mass = (mass_ints >= 1) & (mass_ints < len(_ELEMENTS_BY_MASS))  # Guess H to Cl from mass
+        elements[by_mass] = _ELEMENTS_BY_MASS[mass_ints[by_mass]]
+
+        # for mass > 36 or mass <= 0
+        guesses = {}
+        for i in np.flatnonzero(~by_mass):
+            name, atom_type = names[i], atom_types[i]
+            if (name, atom_type) not in guesses:
+                if name.title() in _ELEMENT_SYMBOLS:  # Guess from atom name
+                    guesses[name, atom_type] = name.title()
+                elif atom_type.title() in _ELEMENT_SYMBOLS:  # Guess from atom type
+                    guesses[name, atom_type] = atom_type.title()
                 else:
-                    if number_of_bad_lines > 5:
-                        raise ParserError(self.file, 'topology',
-                                          details='Too many bad lines in [ atoms ] section.')
-                    logging.error('Atom %s in [ atoms ] section is not formatted properly. Skipping...', i)
-                    number_of_bad_lines += 1
-                    continue
-                number = int(number)
-                resid = int(resid)
-                charge = float(charge)
-                mass = float(mass)
-                if self.atom_types_dict is not None and atom_type in self.atom_types_dict:
-                    element = self.atom_types_dict[atom_type]
-                elif self.guess_elements:
-                    element = guess_element_from(mass, name, atom_type)
-                else:
-                    raise ParserError(self.file, 'topology', details=('No atomic number information'
-                                     ' for atom with name {} and type {} in residue {}'.format(name, atom_type, resname)))
-                atom_info[cols[0]].append(number)
-                atom_info[cols[1]].append(atom_type)
-                atom_info[cols[2]].append(resid)
-                atom_info[cols[3]].append(resname)
-                atom_info[cols[4]].append(name)
-                atom_info[cols[5]].append(charge)
-                atom_info[cols[6]].append(element)
-                atom_info[cols[7]].append(mass)
-            atoms = pd.DataFrame(atom_info).set_index(cols[0])
-            return atoms
+                    guesses[name, atom_type] = 'H'
+                    logging.error('Atomic number for atom with type {} and name {} cannot'
+                                  ' be guessed. A default value of H was assigned'.format(atom_type, name))
+            elements[i] = guesses[name, atom_type]
+
+        self.guessed_elems_history.update(zip(atom_types, elements))
+        return elements
+
+    def __get_elements(self, atom_types, names, resnames, masses):
+        """Elements from the atomtype map, atoms of other types are guessed if guess_elements is set"""
+        atom_types_dict = self.atom_types_dict if self.atom_types_dict is not None else {}
+        elements = pd.Series(atom_types).map(atom_types_dict).to_numpy(dtype=object)
+        unknown = np.flatnonzero(pd.isnull(elements))
+        if unknown.size == 0:
+            return elements
+        if not self.guess_elements:
+            i = unknown[0]
+            raise ParserError(self.file, 'topology', details=('No atomic number information'
+                             ' for atom with name {} and type {} in residue {}'.format(names[i], atom_types[i], resnames[i])))
+        elements[unknown] = self.__guess_elements(masses[unknown], names[unknown], atom_types[unknown])
+        return elements
+
+    def __read_atoms(self, atom_section):
+        """Parse text of an [ atoms ] section in bulk, lines have 8 fields or 7 fields without mass"""
+        if '#' in atom_section:
+            atom_section = _DIRECTIVE_REGEX.sub('', atom_section)
+        def read_table(text):
+            # names like NA are not missing values, and types and names are always strings
+            return pd.read_csv(io.StringIO(text), sep=r'\s+', comment=';', header=None,
+                               names=range(_MAX_ATOM_FIELDS), dtype={1: str, 3: str, 4: str},
+                               skip_blank_lines=True, keep_default_na=False, na_values=[''])
+
+        try:
+            table = read_table(atom_section)
+        except pd.errors.EmptyDataError:
+            table = pd.DataFrame(columns=range(_MAX_ATOM_FIELDS), dtype=str)
+        except pd.errors.ParserError:
+            # lines with too many fields are replaced by a single field, so that they are skipped as bad lines below
+            lines = [line if len(line.split(';', 1)[0].split()) <= _MAX_ATOM_FIELDS else '0'
+                     for line in atom_section.splitlines()]
+            try:
+                table = read_table('\n'.join(lines))
+            except pd.errors.ParserError as e:
+                raise ParserError(self.file, 'topology', details='[ atoms ] section not formatted properly, {}'.format(e))
+
+        number_of_fields = table.notnull().sum(axis=1).to_numpy()
+        bad_lines = np.flatnonzero((number_of_fields != 7) & (number_of_fields != 8))
+        for i, line in enumerate(bad_lines):
+            if i > 5:
+                raise ParserError(self.file, 'topology', details='Too many bad lines in [ atoms ] section.')
+            logging.error('Atom %s in [ atoms ] section is not formatted properly. Skipping...', line)
+        table = table[(number_of_fields == 7) | (number_of_fields == 8)]
+
+        try:
+            numbers, resids = (table[i].to_numpy(dtype=np.int64) for i in [0, 2])
+            charges, masses = (table[i].to_numpy(dtype=np.float64, na_value=0) for i in [6, 7])
+        except ValueError as e:
+            raise ParserError(self.file, 'topology', details='[ atoms ] section has a bad value, {}'.format(e))
+        atom_types, resnames, names = (table[i].to_numpy(dtype=object) for i in [1, 3, 4])
+
+        cols = self.columns
+        atoms = pd.DataFrame({cols[0]: numbers, cols[1]: atom_types, cols[2]: resids, cols[3]: resnames, cols[4]: names,
+                              cols[5]: charges, cols[6]: self.__get_elements(atom_types, names, resnames, masses),
+                              cols[7]: masses})
+        return atoms.set_index(cols[0])
+
+    def __read_bonds(self, bond_section, numbers):
+        """Parse text of a [ bonds ] section into Bonds, atom numbers are converted to rows of [ atoms ]"""
+        pairs = np.array(_BOND_REGEX.findall(bond_section), dtype=np.int64).reshape(-1, 2)
+        # atoms in #ifdef branches can repeat numbers, bonds are mapped to the first atom with a number
+        numbers = pd.Index(numbers)
+        first_rows = np.flatnonzero(~numbers.duplicated())
+        rows = numbers[first_rows].get_indexer(pairs.ravel())
+        rows = np.where(rows < 0, -1, first_rows[rows]).reshape(-1, 2)
+        unknown = np.any(rows < 0, axis=1)
+        if np.any(unknown):
+            logging.warning('Skipping %s bonds in %s with atoms that are not in [ atoms ]', np.sum(unknown), self.file)
+            rows = rows[~unknown]
+        return Bonds.from_pairs(rows[:, 0], rows[:, 1], len(numbers))
 
-        itp_text = self.__load_molecules_and_atoms()
-        clean_itp_text = clean(itp_text,  comments=[';', '#'])
-        molecule_section = Itp.__get_section('moleculetype', clean_itp_text)
-        atom_section = Itp.__get_section('atoms', clean_itp_text)
-        if molecule_section == [] and atom_section == []:
+    def __read(self):
+        # only the sections of the requested molecules are parsed
+        text = self.resolver.read(self.file)
+        index = self.resolver.molecule_index(self.file)
+        if not index:
             return None
-        molecules = []
-        atom_infos = []
-
-        for molecule, atoms in zip(molecule_section, atom_section):
-            mol = molecule.split()[0]
-            if self.requested_molecules is not None and mol not in self.requested_molecules:
+        get_text = lambda sections, name: ''.join(text[start:stop] for start, stop in sections.get(name, []))
+        self._topol = {}
+        self._bonds = {}
+        for mol, sections in index.items():
+            if 'atoms' not in sections or (self.requested_molecules is not None and mol not in self.requested_molecules):
                 continue
-            molecules.append(mol)
-            atom_infos.append(read_atoms(atoms))
-        self._topol = dict(zip(molecules, atom_infos))
+            self._topol[mol] = self.__read_atoms(get_text(sections, 'atoms'))
+            self._bonds[mol] = self.__read_bonds(get_text(sections, 'bonds'), self._topol[mol].index)
 
     def __read_as_topol(self):
-        top_parser = Parser(self.file)
-        topology = ''.join(top_parser)
+        topology = self.resolver.read(self.file)
         self._molecules = Itp.__get_molecules(topology)
         self._molecule_types = [m[0] for m in self._molecules]
-        self._topology_files = self.__get_included_topology_files(topology)
+        self._topology_files = self.resolver.includes(self.file)[:]
         self._topology_files.append(self.file)
         self.requested_molecules = self._molecule_types
@@ -1,15 +1,28 @@
 """Module for MiMiCPy-specific topology"""
 
-import xdrlib
 import numpy as np
 import pandas as pd
 from .top import Top
 from .itp import Itp
 from .topol_dict import TopolDict
-from ..utils.errors import SelectionError, MiMiCPyError
+from .bonds import Bonds
+from .selection import Columns, EncodedColumn, compile_selection
+from ..utils import xdr
+from ..utils.intervals import IntervalSet
+from ..utils.errors import SelectionError, MiMiCPyError, ParserError
 from ..utils.file_handler import read, write
+from ..utils.table_file import is_table_file, read_tables, write_tables, encode_strings, pack_strings, unpack_strings
 
 ENCODER = 'utf-8'
+MPT_VERSION = 2  # version 1 is the XDR format
+STRING_COLUMNS = ['type', 'resname', 'name', 'element']
+ENCODED_COLUMNS = STRING_COLUMNS + ['mol']  # stored as integer codes into a vocabulary per column
+RESIDUE_COLUMNS = ['rescharge', 'resmass']  # charge and mass sums of the residue of each atom
+COLUMN_DTYPES = {'type': object, 'resid': np.int64, 'resname': object, 'name': object,
+                 'charge': np.float64, 'element': object, 'mass': np.float64, 'mol': object}
+
+def _code_dtype(vocabulary_size):
+    return np.int16 if vocabulary_size <= np.iinfo(np.int16).max else np.int32
 
 def _get_itp_columns():
     columns = Itp.columns.copy()
@@ -23,34 +36,75 @@ def _get_mpt_columns():
 
 
 class Mpt:
-    """provides static methods for topology-specific xdr packing/unpacking,
+    """provides static methods for topology-specific packing/unpacking,
        class methods to create new Mpt objects from top or mpt files,
        public methods for atom selection, writing and closing mpt files
     """
     columns = _get_mpt_columns()
 
     def __init__(self, molecules, topol_dict, mode='r'):
+        """Only the atom offsets of the molecules are built here, so opening a topology does not depend on its size
+           String encodings, the residue table and, in r mode, the expanded atom columns are built on first use
+           In w mode the atom columns are never expanded and atoms are looked up from the templates
+        """
+        if mode not in ['r', 'w']:
+            raise MiMiCPyError('{} is not a mode. Only r or w can be used'.format(mode))
         self.molecules = molecules
         self.topol_dict = topol_dict
         self.mode = mode
-        self._expanded_data = None
+        self.__expanded = None
+        self.__encodings = None
+        self.__residue_tables = None
         self._number_of_atoms = None
+        self.__build_offsets()
 
-        if mode == 'r':
+    @property
+    def _expanded_data(self):
+        """Atom columns of the whole system, expanded on first access in r mode and None in w mode"""
+        if self.__expanded is None and self.mode == 'r':
             self.__expand_data()
-        elif mode == 'w':
-            pass
-        else:
-            raise MiMiCPyError('{} is not a mode. Only r or w can be used'.format(mode))
+        return self.__expanded
+
+    @property
+    def _vocabularies(self):
+        return self.__get_encodings()[0]
+
+    @property
+    def _template_codes(self):
+        return self.__get_encodings()[1]
+
+    @property
+    def _mol_codes(self):
+        return self.__get_encodings()[2]
+
+    @property
+    def _template_residues(self):
+        return self.__get_residue_tables()[0]
+
+    @property
+    def _residues(self):
+        return self.__get_residue_tables()[1]
 
     @property
     def number_of_atoms(self):
-        if self.mode == 'r':
-            return self._number_of_atoms
-        self.mode = 'r'
-        self.__expand_data()
         return self._number_of_atoms
 
+    @property
+    def number_of_residues(self):
+        return len(self._residues['start'])
+
+    @property
+    def residues(self):
+        """DataFrame of all residues, with the range of atom IDs [start_id, stop_id) of each residue"""
+        residues = self._residues
+        df = pd.DataFrame({'resid': residues['resid'],
+                           'resname': self.__decode('resname', residues['resname']),
+                           'molecule': residues['molecule'],
+                           'start_id': residues['start']+1, 'stop_id': residues['stop']+1,
+                           'charge': residues['charge'], 'mass': residues['mass']})
+        df.index.name = 'residue'
+        return df
+
     @staticmethod
     def __pack_strlist(packer, strlist):
         string = ','.join(strlist).encode(ENCODER)
@@ -92,11 +146,11 @@ class Mpt:
         charges = unpacker.unpack_list(unpacker.unpack_float)
         elements = Mpt.__unpack_strlist(unpacker)
         masses = unpacker.unpack_list(unpacker.unpack_float)
-        df = pd.DataFrame([atom_numbers, atom_types,
-                           residue_ids, residue_names,
-                           atom_names, charges,
-                           elements, masses]).T
-        df.columns = _get_itp_columns()
+        df = pd.DataFrame({'number': np.array(atom_numbers, dtype=np.int64),
+                           'type': atom_types, 'resid': np.array(residue_ids, dtype=np.int64),
+                           'resname': residue_names, 'name': atom_names,
+                           'charge': np.array(charges, dtype=np.float64), 'element': elements,
+                           'mass': np.array(masses, dtype=np.float64)}, columns=_get_itp_columns())
         return df.set_index(df.columns[0])
 
     @staticmethod
@@ -119,15 +173,92 @@ class Mpt:
         return TopolDict(dict_df, repeating)
 
     @classmethod
-    def __from_top(cls, top_file, mode='r', buffer=1000, nonstandard_atomtypes=None, gmxdata=None):
-        top = Top(top_file, mode=mode, buffer=buffer, nonstandard_atomtypes=nonstandard_atomtypes, gmxdata=gmxdata)
+    def __from_top(cls, top_file, mode='r', buffer=1000, nonstandard_atomtypes=None, gmxdata=None, workers=1,
+                   cache_dir=None):
+        top = Top(top_file, mode=mode, buffer=buffer, nonstandard_atomtypes=nonstandard_atomtypes, gmxdata=gmxdata,
+                  workers=workers, cache_dir=cache_dir)
         molecules = top.molecules
         topol_dict = top.topol_dict
         return cls(molecules, topol_dict, mode)
 
+    def __pack_tables(self):
+        """Convert molecules and TopolDict to arrays, string columns are stored with the same codes as in memory"""
+        repeating = self.topol_dict.repeating
+        molecule_names = [mol for mol, _ in self.molecules] + list(self.topol_dict.dict_df.keys())\
+                         + list(repeating.keys()) + list(repeating.values())
+        molecule_codes, molecule_vocabulary = encode_strings(molecule_names)
+        n_molecules, n_templates, n_repeating = len(self.molecules), len(self.topol_dict.dict_df), len(repeating)
+        tables = {'molecules.name': molecule_codes[:n_molecules],
+                  'molecules.count': np.array([n_mols for _, n_mols in self.molecules], dtype=np.int64),
+                  'templates.name': molecule_codes[n_molecules:n_molecules+n_templates],
+                  'repeating.key': molecule_codes[n_molecules+n_templates:n_molecules+n_templates+n_repeating],
+                  'repeating.value': molecule_codes[n_molecules+n_templates+n_repeating:]}
+
+        templates = self.topol_dict.dict_df
+        tables['templates.start'] = np.concatenate([[0], np.cumsum([len(df) for df in templates.values()])]).astype(np.int64)
+        vocabularies = {'mol': molecule_vocabulary}
+        for column in _get_itp_columns():
+            if column in STRING_COLUMNS:
+                arrays = [self._template_codes[mol][column] for mol in templates]
+                vocabularies[column] = self._vocabularies[column]
+            elif column == 'number':
+                arrays = [df.index.to_numpy(dtype=np.int64) for df in templates.values()]
+            else:
+                arrays = [df[column].to_numpy(dtype=COLUMN_DTYPES[column]) for df in templates.values()]
+            tables['atoms.'+column] = np.concatenate(arrays) if arrays else np.array([], dtype=np.int64)
+        for column, vocabulary in vocabularies.items():
+            tables['vocab.{}.data'.format(column)], tables['vocab.{}.offsets'.format(column)] = pack_strings(vocabulary)
+
+        bond_pairs = [self.topol_dict.get_bonds(mol).pairs() for mol in templates]
+        tables['templates.bond_start'] = np.concatenate([[0], np.cumsum([len(first) for first, _ in bond_pairs])])\
+            .astype(np.int64)
+        tables['bonds.first'] = np.concatenate([first for first, _ in bond_pairs] + [np.array([], dtype=np.int64)])
+        tables['bonds.second'] = np.concatenate([second for _, second in bond_pairs] + [np.array([], dtype=np.int64)])
+        return tables
+
+    @staticmethod
+    def __unpack_tables(tables):
+        """Inverse of __pack_tables"""
+        vocabulary = lambda column: unpack_strings(tables['vocab.{}.data'.format(column)],
+                                                   tables['vocab.{}.offsets'.format(column)])
+        molecule_vocabulary = vocabulary('mol')
+        molecules = list(zip(molecule_vocabulary[tables['molecules.name']].tolist(),
+                             tables['molecules.count'].tolist()))
+        repeating = dict(zip(molecule_vocabulary[tables['repeating.key']].tolist(),
+                             molecule_vocabulary[tables['repeating.value']].tolist()))
+
+        columns = {}
+        for column in _get_itp_columns():
+            if column in STRING_COLUMNS:
+                columns[column] = vocabulary(column)[tables['atoms.'+column]]
+            else:
+                columns[column] = tables['atoms.'+column]
+
+        dict_df = {}
+        bonds = {}
+        starts = tables['templates.start']
+        bond_starts = tables.get('templates.bond_start')  # bonds were added later to version 2
+        for i, (mol, start, stop) in enumerate(zip(molecule_vocabulary[tables['templates.name']], starts[:-1], starts[1:])):
+            df = pd.DataFrame({k: v[start:stop] for k, v in columns.items()}, columns=_get_itp_columns())
+            dict_df[mol] = df.set_index(df.columns[0])
+            if bond_starts is not None:
+                bond_slice = slice(bond_starts[i], bond_starts[i+1])
+                bonds[mol] = Bonds.from_pairs(tables['bonds.first'][bond_slice], tables['bonds.second'][bond_slice],
+                                              stop-start)
+        return molecules, TopolDict(dict_df, repeating, bonds)
+
     @classmethod
     def __from_mpt(cls, mpt_file, mode):
-        unpacker = xdrlib.Unpacker(read(mpt_file, 'rb'))
+        if is_table_file(mpt_file):
+            version, tables = read_tables(mpt_file)
+            if version > MPT_VERSION:
+                raise ParserError(mpt_file, 'mpt', details=('file was written in version {} of the format,'
+                                  ' only versions up to {} can be read'.format(version, MPT_VERSION)))
+            molecules, topol_dict = Mpt.__unpack_tables(tables)
+            return cls(molecules, topol_dict, mode)
+
+        # version 1 files are not versioned and are based on XDR
+        unpacker = xdr.Unpacker(read(mpt_file, 'rb'))
         molecule_names = Mpt.__unpack_strlist(unpacker)
         number_of_molecules = unpacker.unpack_list(unpacker.unpack_int)
         molecules = list(zip(molecule_names, number_of_molecules))
@@ -135,57 +266,249 @@ class Mpt:
         return cls(molecules, topol_dict, mode)
 
     @classmethod
-    def from_file(cls, file, mode='r', buffer=1000, nonstandard_atomtypes=None, gmxdata=None, file_ext=None):
+    def from_file(cls, file, mode='r', buffer=1000, nonstandard_atomtypes=None, gmxdata=None, file_ext=None, workers=1,
+                  cache_dir=None):
+        """Read top or mpt file, workers is the number of processes used to parse itp files of a top file
+           and cache_dir is the directory of the parse cache of top files
+           Version 2 mpt files are memory-mapped, and in both modes only the molecule type templates are read on opening
+           buffer is ignored and only kept for compatibility
+        """
         if not isinstance(file, str): # assume its mpt
             return file
         elif file_ext is None:
             file_ext = file.split('.')[-1]
 
         if file_ext == 'top':
-            return Mpt.__from_top(file, mode, buffer, nonstandard_atomtypes, gmxdata)
+            return Mpt.__from_top(file, mode, buffer, nonstandard_atomtypes, gmxdata, workers, cache_dir)
         elif file_ext == 'mpt':
             return Mpt.__from_mpt(file, mode)
         else:
             raise MiMiCPyError('File extension (top or mpt) not specified.')
 
+    def __build_offsets(self):
+        """Cumulative atom and residue offsets of each (molecule type, number of copies) entry in molecules
+           Used to map global atom IDs to template rows without expanding the whole system
+        """
+        self._mol_sizes = np.array([len(self.topol_dict[mol]) for mol, _ in self.molecules], dtype=np.int64)
+        self._mol_copies = np.array([n_mols for _, n_mols in self.molecules], dtype=np.int64)
+        self._resid_spans = np.array([self.__template_resids(mol)[-1] if size > 0 else 0\
+                                      for (mol, _), size in zip(self.molecules, self._mol_sizes)], dtype=np.int64)
+        self._mol_starts = np.concatenate([[0], np.cumsum(self._mol_sizes*self._mol_copies)])
+        self._resid_starts = np.concatenate([[0], np.cumsum(self._resid_spans*self._mol_copies)])
+        self._number_of_atoms = int(self._mol_starts[-1])
+
+    def __encode_columns(self):
+        """Dictionary-encode string columns into integer codes and a vocabulary per column
+           Codes of the atoms are taken from the molecule type templates
+        """
+        templates = self.topol_dict.dict_df
+        split_at = np.cumsum([len(df) for df in templates.values()])[:-1]
+        vocabularies = {}
+        template_codes = {mol: {} for mol in templates}
+        for column in STRING_COLUMNS:
+            values = [df[column].to_numpy(dtype=object) for df in templates.values()]
+            codes, vocabulary = encode_strings(np.concatenate(values) if values else [])
+            vocabularies[column] = vocabulary
+            for mol, codes_of_mol in zip(templates, np.split(codes.astype(_code_dtype(len(vocabulary))), split_at)):
+                template_codes[mol][column] = codes_of_mol
+        codes, vocabularies['mol'] = encode_strings([mol for mol, _ in self.molecules])
+        self.__encodings = (vocabularies, template_codes, codes.astype(_code_dtype(len(vocabularies['mol']))))
+
+    def __get_encodings(self):
+        if self.__encodings is None:
+            self.__encode_columns()
+        return self.__encodings
+
+    def __template_name(self, mol):
+        return mol if mol in self.topol_dict.dict_df else self.topol_dict.repeating[mol]
+
+    def __get_template_codes(self, mol, column):
+        return self._template_codes[self.__template_name(mol)][column]
+
+    def __build_residues(self):
+        """Residue table of the whole system, built from the residues of each molecule type template
+           _residues has the 0-based atom offsets [start, stop), resid, resname code,
+           molecule instance (0-based index of the molecule copy), and charge and mass sums of each residue
+        """
+        template_residues = {}
+        for mol, df in self.topol_dict.dict_df.items():
+            resids = self.__template_resids(mol)
+            starts = np.flatnonzero(np.diff(resids, prepend=resids[:1]-1) != 0) if len(resids) else resids
+            stops = np.append(starts[1:], len(resids)).astype(np.int64)
+            charge, mass = (df[column].to_numpy(dtype=np.float64) for column in ['charge', 'mass'])
+            template_residues[mol] = {
+                'start': starts, 'stop': stops, 'resid': resids[starts],
+                'resname': self._template_codes[mol]['resname'][starts],
+                'charge': np.add.reduceat(charge, starts) if len(starts) else charge,
+                'mass': np.add.reduceat(mass, starts) if len(starts) else mass}
+
+        molecule_starts = np.concatenate([[0], np.cumsum(self._mol_copies)])
+        blocks = {key: [np.array([], dtype=np.int64)] for key in ['start', 'stop', 'resid', 'molecule']}
+        blocks.update({'resname': [np.array([], dtype=np.int32)], 'charge': [], 'mass': []})
+        for block, (mol, n_mols) in enumerate(self.molecules):
+            residues = template_residues[self.__template_name(mol)]
+            n_residues = len(residues['start'])
+            copies = np.arange(n_mols, dtype=np.int64)
+            atom_offsets = self._mol_starts[block] + self._mol_sizes[block]*copies
+            resid_offsets = self._resid_starts[block] + self._resid_spans[block]*copies
+            blocks['start'].append((atom_offsets[:, np.newaxis] + residues['start']).ravel())
+            blocks['stop'].append((atom_offsets[:, np.newaxis] + residues['stop']).ravel())
+            blocks['resid'].append((resid_offsets[:, np.newaxis] + residues['resid']).ravel())
+            blocks['molecule'].append(np.repeat(molecule_starts[block] + copies, n_residues))
+            for key in ['resname', 'charge', 'mass']:
+                blocks[key].append(np.tile(residues[key], n_mols))
+        residues = {key: np.concatenate(arrays) if arrays else np.array([]) for key, arrays in blocks.items()}
+        self.__residue_tables = (template_residues, residues)
+
+    def __get_residue_tables(self):
+        if self.__residue_tables is None:
+            self.__build_residues()
+        return self.__residue_tables
+
+    def __residue_column(self, mol, column):
+        """Residue charge or mass sums of a molecule type template, repeated for every atom of the residue"""
+        residues = self._template_residues[self.__template_name(mol)]
+        return np.repeat(residues[column[3:]], residues['stop']-residues['start'])
+
+    def residue_of(self, ids):
+        """Get the residue (row of residues) of each atom ID"""
+        return np.searchsorted(self._residues['start'], np.asarray(ids, dtype=np.int64)-1, side='right') - 1
+
+    def residue_atoms(self, residue):
+        """Get IntervalSet of atom IDs of a residue (row of residues)"""
+        return IntervalSet.from_range(self._residues['start'][residue]+1, self._residues['stop'][residue]+1)
+
+    def __decode(self, column, array):
+        if column in ENCODED_COLUMNS:
+            return self._vocabularies[column][array]
+        return array
+
+    def __template_resids(self, mol):
+        """Residue IDs of a molecule type renumbered to start from 1"""
+        resids = self.topol_dict[mol]['resid'].to_numpy(dtype=np.int64)
+        if len(resids) == 0:
+            return resids
+        return resids - (resids[0] - 1)
+
     def __expand_data(self):
-        self._expanded_data = [self.__get_property(i) for i in self.columns]
-        self._number_of_atoms = len(self._expanded_data[0])
+        self.__expanded = {column: self.__get_property(column) for column in self.columns}
 
     def __select_by_id(self, ids):
-        if self._expanded_data is None:
-            self.__expand_data()
-        data_list = [[row[i-1] for row in self._expanded_data] for i in ids]
-        df = pd.DataFrame(data_list, columns=self.columns)
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size > 0 and (ids.min() < 1 or ids.max() > self._number_of_atoms):
+            raise SelectionError('Atom IDs should be between 1 and {}'.format(self._number_of_atoms))
+        if self.__expanded is None:
+            data = self.__lookup_by_id(ids)
+        else:
+            data = {column: self.__decode(column, self.__expanded[column][ids-1]) for column in self.columns}
+        df = pd.DataFrame(data, columns=self.columns)
         df['id'] = ids
         return df.set_index(['id'])
 
+    def __lookup_by_id(self, ids):
+        """Get atom properties of ids from the molecule type templates
+           Each ID is mapped to its (molecule type, copy) block by a binary search over the offsets
+        """
+        idx = ids - 1
+        blocks = np.searchsorted(self._mol_starts, idx, side='right') - 1
+        copies, rows = np.divmod(idx - self._mol_starts[blocks], np.maximum(self._mol_sizes[blocks], 1))
+
+        data = {column: np.empty(len(ids), dtype=np.int32 if column in ENCODED_COLUMNS else COLUMN_DTYPES[column])\
+                for column in self.columns}
+        order = np.argsort(blocks, kind='stable')
+        unique_blocks, first = np.unique(blocks[order], return_index=True)
+        for block, start, stop in zip(unique_blocks, first, np.append(first[1:], len(order))):
+            positions = order[start:stop]
+            block_rows = rows[positions]
+            mol = self.molecules[block][0]
+            template = self.topol_dict[mol]
+            for column in self.columns:
+                if column == 'mol':
+                    data[column][positions] = self._mol_codes[block]
+                elif column == 'resid':
+                    data[column][positions] = self.__template_resids(mol)[block_rows] + self._resid_starts[block]\
+                                               + copies[positions]*self._resid_spans[block]
+                elif column in STRING_COLUMNS:
+                    data[column][positions] = self.__get_template_codes(mol, column)[block_rows]
+                else:
+                    data[column][positions] = template[column].to_numpy(dtype=COLUMN_DTYPES[column])[block_rows]
+        return {column: self.__decode(column, array) for column, array in data.items()}
+
     def __get_property(self, prop):
-        if self._expanded_data is not None:
-            return self._expanded_data[self.columns.index(prop)]
+        if prop in RESIDUE_COLUMNS:
+            blocks = [np.tile(self.__residue_column(mol, prop), n_mols) for mol, n_mols in self.molecules]
+            return np.concatenate(blocks) if blocks else np.array([], dtype=np.float64)
+        if self.__expanded is not None:
+            return self.__expanded[prop]
         if prop == 'resid':
             return self.__get_residue_id()
-        prop_list = []
+        if prop not in COLUMN_DTYPES:
+            raise SelectionError('\'{}\' is not a valid atom property'.format(prop))
         if prop == 'mol':
-            for mol, n_mols in self.molecules:
-                prop_list += [mol]*len(self.topol_dict[mol]) * n_mols
+            return np.repeat(self._mol_codes, self._mol_sizes*self._mol_copies)
+        if prop in STRING_COLUMNS:
+            blocks = [np.tile(self.__get_template_codes(mol, prop), n_mols) for mol, n_mols in self.molecules]
+            dtype = _code_dtype(len(self._vocabularies[prop]))
         else:
-            for mol, n_mols in self.molecules:
-                prop_list += self.topol_dict[mol][prop].to_list() * n_mols
-        return prop_list
+            dtype = COLUMN_DTYPES[prop]
+            blocks = [np.tile(self.topol_dict[mol][prop].to_numpy(dtype=dtype), n_mols) for mol, n_mols in self.molecules]
+        return np.concatenate(blocks) if blocks else np.array([], dtype=dtype)
 
     def __get_residue_id(self):
-        resn_so_far = 0
-        resn_list = []
-        for mol, n_mols in self.molecules:
-            for _ in range(n_mols):
-                resn_np = self.topol_dict[mol]['resid'].to_numpy()
-                first_resid = resn_np[0]
-                resn_np -= first_resid - 1
-                lst = resn_np + resn_so_far
-                resn_list += lst.tolist()
-                resn_so_far = lst[-1]
-        return resn_list
+        """Residue ids of every molecule copy numbered consecutively, from the residue table"""
+        residues = self._residues
+        return np.repeat(residues['resid'], residues['stop']-residues['start'])
+
+    def __get_block_column(self, block, keyword, copies):
+        """Get atom property of the first copies of a (molecule type, number of copies) entry in molecules"""
+        mol = self.molecules[block][0]
+        size = self._mol_sizes[block]
+        if keyword == 'id':
+            return np.arange(self._mol_starts[block]+1, self._mol_starts[block]+1+size*copies)
+        if keyword == 'resid':
+            copy_offsets = self._resid_starts[block] + self._resid_spans[block]*np.arange(copies, dtype=np.int64)
+            return np.tile(self.__template_resids(mol), copies) + np.repeat(copy_offsets, size)
+        if keyword in RESIDUE_COLUMNS:
+            return np.tile(self.__residue_column(mol, keyword), copies)
+        if keyword == 'mol':
+            return EncodedColumn(np.full(size*copies, self._mol_codes[block]), self._vocabularies[keyword])
+        if keyword in STRING_COLUMNS:
+            return EncodedColumn(np.tile(self.__get_template_codes(mol, keyword), copies), self._vocabularies[keyword])
+        return np.tile(self.topol_dict[mol][keyword].to_numpy(dtype=COLUMN_DTYPES[keyword]), copies)
+
+    def __evaluate(self, tree, spatial_index=None, resolved=None):
+        """Get IntervalSet of atoms IDs selected by tree, one block of molecules at a time
+           If the tree only depends on the molecule type templates, it is evaluated once per template
+           and the hits are broadcast to all copies of the molecule
+           Global nodes (within, same residue as) are resolved first from the atoms selected by their child
+        """
+        resolved = {} if resolved is None else resolved
+        for node in tree.global_nodes():
+            if node not in resolved:
+                resolved[node] = node.resolve(self.__evaluate(node.child, spatial_index, resolved), self, spatial_index)
+        template_level = tree.is_template_level()
+        uses_mol = 'mol' in tree.keywords()
+        template_runs = {}
+        starts, stops = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+        for block, (mol, n_mols) in enumerate(self.molecules):
+            size = self._mol_sizes[block]
+            if size == 0 or n_mols == 0:
+                continue
+            get_column = lambda keyword, b=block, c=(1 if template_level else n_mols): self.__get_block_column(b, keyword, c)
+            first_id = self._mol_starts[block] + 1
+            if template_level:
+                key = (id(self.topol_dict[mol]), mol if uses_mol else None)
+                if key not in template_runs:
+                    template_runs[key] = IntervalSet.from_ids(np.flatnonzero(tree.evaluate(Columns(get_column, size, resolved))))
+                runs = template_runs[key]
+                copy_starts = first_id + size*np.arange(n_mols, dtype=np.int64)
+                starts.append((copy_starts[:, np.newaxis] + runs.starts).ravel())
+                stops.append((copy_starts[:, np.newaxis] + runs.stops).ravel())
+            else:
+                runs = IntervalSet.from_ids(np.flatnonzero(tree.evaluate(Columns(get_column, size*n_mols, resolved))))
+                starts.append(first_id + runs.starts)
+                stops.append(first_id + runs.stops)
+        return IntervalSet(np.concatenate(starts), np.concatenate(stops))
 
     def __getitem__(self, key):
         """Select an atom by passing the atom ID to key.
@@ -193,103 +516,104 @@ class Mpt:
            If a string is passed as key, then that property is returned.
         """
         if isinstance(key, str):
-            return self.__get_property(key)
-        if isinstance(key, int):
+            if self.mode == 'r' and self.__expanded is None:
+                self.__expand_data()
+            return self.__decode(key, self.__get_property(key)).tolist()
+        if isinstance(key, (int, np.integer)):
             key = [key]
         elif isinstance(key, slice):
-            key = list(range(key.stop)[key])
+            key = np.arange(key.stop)[key]
         return self.__select_by_id(key)
 
-    @staticmethod
-    def __translate(selection):  # Maybe use state pattern
-        """Tanslate selection langauge to numpy boolean.
-           Selection 'resname is SER and id < 5 and mol not Protein_chain_B'
-           will be translated to
-           np_vals['resname'] == 'SER' and np_vals['id'] < 5 and np_vals['mol'] != 'Protein_chain_B'
-         """
-        add_space = lambda string, a: string.replace(a, ' {} '.format(a))
-        selection = add_space(add_space(selection, '('), ')')
-
-        np_selection_expression = ''
-        word_position = 0
-        open_brackets = 0
-        selectors = []
-        for s in selection.split():
-            if word_position == 0:
-                if s in Mpt.columns or s == 'id':
-                    np_selection_expression += "(np_vals['{}']".format(s)
-                    selectors.append(s)
-                elif s == '(':
-                    np_selection_expression += s
-                    word_position = -1
-                    open_brackets += 1
-                else:
-                    raise SelectionError('\'{}\' is not a valid selection keyword'.format(s))
-            elif word_position == 1:
-                if s == 'is':
-                    np_selection_expression += '=='
-                elif s == 'not':
-                    np_selection_expression += '!='
-                elif s in ('>', '>=', '<', '<='):
-                    np_selection_expression += s
-                else:
-                    raise SelectionError('\'{}\' is not a valid logical operator'.format(s))
-            elif word_position == 2:
-                if s.isnumeric():
-                    np_selection_expression += '{})'.format(s)
-                else:
-                    np_selection_expression += "'{}')".format(s)
-            elif word_position == 3:
-                # If and' or 'or' encountered, reset word_position to -1
-                # if ) encountered, reset word_position to 2 to parse 'and' or 'or' again
-                if s == 'or':
-                    np_selection_expression += ' | '
-                    word_position = -1
-                elif s == 'and':
-                    np_selection_expression += ' & '
-                    word_position = -1
-                elif s == ')':
-                    np_selection_expression += ')'
-                    word_position = 2
-                    open_brackets -= 1
-                else:
-                    raise SelectionError('\'{}\' is not a valid boolean operator'.format(s))
-            word_position += 1
-
-        if open_brackets > 0:
-            raise SelectionError('Closing bracket is missing in selection')
-        if open_brackets < 0:
-            raise SelectionError('Open bracket is missing in selection')
-
-        return np_selection_expression, selectors
-
-    def select(self, selection):  # Maybe move to a new module
-        """Select atoms based on selection language expression"""
+    def __bonded_pairs(self, ids):
+        """Get arrays of atom IDs and bonded atom IDs, with one entry for every bond of the atoms in ids
+           Bonds are looked up in the bonds of the molecule type templates, using the offsets of each copy
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        idx = ids - 1
+        blocks = np.searchsorted(self._mol_starts, idx, side='right') - 1
+        copies, rows = np.divmod(idx - self._mol_starts[blocks], np.maximum(self._mol_sizes[blocks], 1))
+
+        firsts, seconds = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+        order = np.argsort(blocks, kind='stable')
+        unique_blocks, first = np.unique(blocks[order], return_index=True)
+        for block, start, stop in zip(unique_blocks, first, np.append(first[1:], len(order))):
+            positions = order[start:stop]
+            bonds = self.topol_dict.get_bonds(self.molecules[block][0])
+            bond_positions, bonded_rows = bonds.neighbors(rows[positions])
+            positions = positions[bond_positions]
+            firsts.append(ids[positions])
+            seconds.append(self._mol_starts[block] + copies[positions]*self._mol_sizes[block] + bonded_rows + 1)
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+    def bonded_to(self, ids):
+        """Get IntervalSet of atom IDs bonded to any atom in ids"""
+        return IntervalSet.from_ids(self.__bonded_pairs(ids)[1])
+
+    def within_bonds(self, ids, number_of_bonds):
+        """Get IntervalSet of atom IDs in ids and of all atoms up to number_of_bonds bonds away from them"""
+        ids = ids if isinstance(ids, IntervalSet) else IntervalSet.from_ids(ids)
+        shell = ids
+        for _ in range(number_of_bonds):
+            shell = self.bonded_to(shell).difference(ids)
+            if not shell:
+                break
+            ids = ids.union(shell)
+        return ids
+
+    def crossing_bonds(self, ids):
+        """Get (N, 2) array of bonds from atoms in ids to atoms outside ids, as pairs of atom IDs"""
+        ids = ids if isinstance(ids, IntervalSet) else IntervalSet.from_ids(ids)
+        firsts, seconds = self.__bonded_pairs(ids)
+        outside = ~ids.contains(seconds)
+        return np.column_stack([firsts[outside], seconds[outside]])
+
+    def same_residue_as(self, ids):
+        """Get IntervalSet of atom IDs of all residues that contain atoms in ids"""
+        residues = np.unique(self.residue_of(ids))
+        return IntervalSet(self._residues['start'][residues]+1, self._residues['stop'][residues]+1)
+
+    def select_ids(self, selection, spatial_index=None):
+        """Get IntervalSet of atom IDs selected by selection language expression,
+           see topology.selection for the grammar
+           spatial_index (core.spatial.CellList) is needed for distance based selections
+        """
+        if isinstance(selection, IntervalSet):
+            return selection
         if selection is None or selection.strip() == '':
             raise SelectionError('The selection cannot be empty')
-        if self._expanded_data is None:
-            self.__expand_data()
 
-        if selection == 'all':
-            ids = list(range(1, self._number_of_atoms+1))
+        if selection.strip() == 'all':
+            return IntervalSet.from_range(1, self._number_of_atoms+1)
+        ids = self.__evaluate(compile_selection(selection), spatial_index)
+        if not ids:
+            raise SelectionError("The selection did not return any atoms")
+        return ids
+
+    def select(self, selection, spatial_index=None):
+        """Select atoms based on selection language expression or IntervalSet of atom IDs"""
+        return self.__select_by_id(self.select_ids(selection, spatial_index))
+
+    def write(self, file_name, version=MPT_VERSION):
+        """Write mpt file in the given version of the format
+           Version 2 is a memory-mappable file of arrays (see utils.table_file), with the following arrays:
+            molecules.name, molecules.count:  self.molecules
+            templates.name, templates.start:  molecule name and first atom of each dataframe in TopolDict
+            repeating.key, repeating.value:   repeating dictionary of TopolDict
+            atoms.<column>:                   columns of all dataframes in TopolDict
+            templates.bond_start:             first bond of each dataframe in TopolDict
+            bonds.first, bonds.second:        rows of the bonded atoms in their dataframe, each bond once
+            vocab.<column>.data/offsets:      string table of each dictionary-encoded string column
+           Version 1 is based on XDR, see __write_xdr
+        """
+        if version == 2:
+            write_tables(file_name, self.__pack_tables(), version)
+        elif version == 1:
+            self.__write_xdr(file_name)
         else:
-            np_str, vals = Mpt.__translate(selection)
-            np_vals = {}
-
-            for i in vals:
-                if i == 'id':
-                    arr = np.array(list(range(self._number_of_atoms)))+1
-                else:
-                    arr = np.array(self.__get_property(i))
-                np_vals[i] = arr
-
-            ids = (np.where(eval(np_str))[0]+1).tolist()
-            if ids == []:
-                raise SelectionError("The selection did not return any atoms")
-
-        return self.__select_by_id(ids)
+            raise MiMiCPyError('{} is not a valid mpt version. Only 1 or 2 can be used'.format(version))
 
-    def write(self, file_name):
+    def __write_xdr(self, file_name):
         """ Write mpt file based on XDR. Format given below:
         ##Header
          molecule names from self.molecules
@@ -305,7 +629,7 @@ class Mpt:
          .... continue for all entries in dict_df
         ##End
         """
-        packer = xdrlib.Packer()
+        packer = xdr.Packer()
         molecule_names, number_of_molecules = list(zip(*self.molecules))
 
         Mpt.__pack_strlist(packer, molecule_names)
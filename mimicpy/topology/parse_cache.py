@@ -0,0 +1,97 @@
+"""Module for the on-disk cache of parsed topologies"""
+
+import hashlib
+import logging
+import os
+import pickle
+from os.path import abspath, getmtime, isfile, join
+
+CACHE_VERSION = 2  # increase if the format of the parsed objects changes
+
+
+def _content_hash(file):
+    with open(file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _key(*parts):
+    return hashlib.sha256(repr((CACHE_VERSION,) + parts).encode()).hexdigest()
+
+
+class ParseCache:
+    """stores parsed topology objects as pickle files in directory
+       Entries record the path, modification time and content hash of the files they were parsed from,
+       and are only returned if none of these files have changed
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, key):
+        return join(self.directory, key + '.pkl')
+
+    @staticmethod
+    def __file_states(files):
+        return {file: (getmtime(file), _content_hash(file)) if isfile(file) else None for file in files}
+
+    @staticmethod
+    def __current_states(file_states):
+        """Get file_states with the current modification times, or None if any of the files changed"""
+        current_states = {}
+        for file, state in file_states.items():
+            if (state is None) != (not isfile(file)):  # file was created or deleted
+                return None
+            if state is None:
+                current_states[file] = None
+                continue
+            # the content is only hashed again if the modification time has changed
+            mtime, content_hash = state
+            current_mtime = getmtime(file)
+            if current_mtime != mtime and _content_hash(file) != content_hash:
+                return None
+            current_states[file] = (current_mtime, content_hash)
+        return current_states
+
+    def __write(self, path, file_states, value):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((file_states, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, key):
+        """Return cached value of key, or None if it is not cached or any of its files changed
+           If only the modification times of the files changed, the entry is stored again with the new times,
+           so that the files are not hashed again by the next load
+        """
+        path = self.__path(key)
+        if not isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                file_states, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            logging.debug('Ignoring unreadable cache entry %s', path)
+            return None
+        current_states = ParseCache.__current_states(file_states)
+        if current_states is None:
+            return None
+        if current_states != file_states:
+            try:
+                self.__write(path, current_states, value)
+            except OSError:
+                logging.debug('Could not update cache entry %s', path)
+        return value
+
+    def store(self, key, value, files):
+        """Cache value of key, which was parsed from files"""
+        self.__write(self.__path(key), ParseCache.__file_states(files), value)
+
+    @staticmethod
+    def topology_key(file, *settings):
+        return _key('top', abspath(file), settings)
+
+    @staticmethod
+    def itp_key(file, text, *settings):
+        """Key of an itp file with the given text, text is None if the file does not exist"""
+        text_hash = hashlib.sha256(text.encode()).hexdigest() if text is not None else None
+        return _key('itp', abspath(file), text_hash, settings)
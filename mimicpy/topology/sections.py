@@ -0,0 +1,72 @@
+"""Module for tokenizing sections of Gromacs topology files"""
+
+import io
+import re
+
+# [ section ] headers, only those at the start of a line are used
+_HEADER_REGEX = re.compile(r"\[[ \t]*([^\]\n]*?)[ \t]*\]")
+
+
+def section_spans(text):
+    """Yield (section, start, stop) offsets of the body of every section of text in one scan of the headers
+       The body is the raw text after the header line, text before the first header has section None
+    """
+    section, start = None, 0
+    for header in _HEADER_REGEX.finditer(text):
+        line_start = text.rfind('\n', 0, header.start()) + 1
+        if line_start < start or text[line_start:header.start()].strip():
+            continue
+        yield section, start, line_start
+        line_end = text.find('\n', header.end())
+        section, start = header.group(1), len(text) if line_end == -1 else line_end + 1
+    yield section, start, len(text)
+
+
+def split_sections(text):
+    """Yield (section, line_no, body) for every section of text,
+       line_no is the line number of the first line of body
+    """
+    line_no, previous_stop = 1, 0
+    for section, start, stop in section_spans(text):
+        line_no += text.count('\n', previous_stop, start)
+        yield section, line_no, text[start:stop]
+        previous_stop = start
+
+
+def index_molecules(text):
+    """Map each [ moleculetype ] in text, in the order of the file, to a dictionary of the sections
+       following it (e.g. atoms, bonds) and the list of (start, stop) offsets of their bodies
+       Only the small [ moleculetype ] bodies are read to get the names
+       If a name is defined more than once, the last definition is used
+    """
+    index = {}
+    sections = None
+    for section, start, stop in section_spans(text):
+        if section == 'moleculetype':
+            mol = next((fields[0] for _, fields in data_lines(text[start:stop])), None)
+            sections = None
+            if mol is not None:
+                sections = index[mol] = {}  # a repeated name keeps only its last definition
+        elif sections is not None:
+            sections.setdefault(section, []).append((start, stop))
+    return index
+
+
+def data_lines(body, first_line_no=1):
+    """Yield (line_no, fields) of the data lines in body of a section
+       Comments after ; and preprocessor directives (lines starting with #) are skipped
+    """
+    for line_no, line in enumerate(io.StringIO(body), first_line_no):
+        line = line.split(';', 1)[0].strip()
+        if line and line[0] != '#':
+            yield line_no, line.split()
+
+
+def tokenize(text, sections=None):
+    """Yield (section, line_no, fields) for every data line of text, line_no starts from 1
+       If sections is given, only lines in these sections are split into fields
+    """
+    for section, first_line_no, body in split_sections(text):
+        if sections is None or section in sections:
+            for line_no, fields in data_lines(body, first_line_no):
+                yield section, line_no, fields
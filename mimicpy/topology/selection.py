@@ -0,0 +1,425 @@
+"""Module for the atom selection language
+   Selections are tokenized and parsed into a tree of nodes, which is evaluated
+   as NumPy boolean masks. Compiled selections are cached by their normalized expression.
+
+   Grammar:
+    expression := term ('or' term)*
+    term       := factor ('and' factor)*
+    factor     := 'not' factor | '(' expression ')' | 'all' | predicate
+                | 'within' distance 'of' factor   e.g. within 0.5 of resname LIG (distance in nm)
+                | 'same' 'residue' 'as' factor | 'byres' factor
+                | 'bonded' 'to' factor            atoms with a bond to an atom in factor
+    predicate  := keyword operator value         e.g. resname is SER, mass > 12, name is C*
+                | keyword 'in' '[' value+ ']'    e.g. resname in [SER THR]
+                | keyword value 'to' value       e.g. id 10 to 200
+    operator   := 'is' | 'not' | '>' | '>=' | '<' | '<='
+   String values can contain the wildcards * and ?
+   rescharge and resmass are the charge and mass sums of the residue of each atom
+   within, same residue as, byres and bonded to depend on the whole system, they are resolved to sets of atom IDs
+   before the rest of the tree is evaluated (see Node.global_nodes)
+"""
+
+import re
+from fnmatch import fnmatchcase
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from ..utils.errors import SelectionError
+
+STRING_KEYWORDS = ['type', 'resname', 'name', 'element', 'mol']
+NUMERIC_KEYWORDS = ['resid', 'charge', 'mass', 'id', 'rescharge', 'resmass']
+KEYWORDS = STRING_KEYWORDS + NUMERIC_KEYWORDS
+# Keywords that only depend on the molecule type template and not on the copy of the molecule
+TEMPLATE_KEYWORDS = ['type', 'resname', 'name', 'element', 'charge', 'mass', 'mol', 'rescharge', 'resmass']
+OPERATORS = {'is': np.equal, 'not': np.not_equal,
+             '>': np.greater, '>=': np.greater_equal,
+             '<': np.less, '<=': np.less_equal}
+_TOKEN_REGEX = re.compile(r"[()\[\]]|[^\s()\[\]]+")
+
+
+def _has_wildcard(value):
+    return '*' in value or '?' in value
+
+
+def _isin(array, values):
+    """Boolean mask of elements of array in values, values can contain wildcards"""
+    patterns = [v for v in values if _has_wildcard(v)]
+    values = [v for v in values if not _has_wildcard(v)]
+    if patterns:
+        values += [u for u in pd.unique(array) if any(fnmatchcase(str(u), p) for p in patterns)]
+    if len(values) == 1:
+        return array == values[0]
+    return np.isin(array, np.array(values, dtype=object))
+
+
+class EncodedColumn:
+    """dictionary-encoded column of atom properties, with integer codes indexing a vocabulary"""
+
+    def __init__(self, codes, vocabulary):
+        self.codes = codes
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self):
+        return self.vocabulary[self.codes]
+
+
+def _apply(array, predicate):
+    """Evaluate predicate on array, or only on the vocabulary if array is dictionary-encoded"""
+    if isinstance(array, EncodedColumn):
+        return predicate(array.vocabulary)[array.codes]
+    return predicate(array)
+
+
+class Columns(dict):
+    """dictionary of atom properties of size atoms, which are fetched from getter when first needed
+       resolved maps global nodes of the tree to their IntervalSet of atom IDs
+    """
+
+    def __init__(self, getter, size, resolved=None):
+        super().__init__()
+        self.getter = getter
+        self.size = size
+        self.resolved = {} if resolved is None else resolved
+
+    def __missing__(self, keyword):
+        array = self[keyword] = self.getter(keyword)
+        return array
+
+
+class Node:
+    """node of the selection tree"""
+
+    def evaluate(self, columns):
+        """Return boolean mask, columns[keyword] should return an array of the atom property"""
+        raise NotImplementedError
+
+    def keywords(self):
+        """Keywords used in the tree starting from this node"""
+        return set()
+
+    def is_template_level(self):
+        """True if the tree can be evaluated once per molecule type template"""
+        return self.keywords().issubset(TEMPLATE_KEYWORDS)
+
+    def global_nodes(self):
+        """Outermost nodes in the tree that need the whole system to be evaluated"""
+        return []
+
+
+class All(Node):
+
+    def evaluate(self, columns):
+        return np.ones(columns.size, dtype=bool)
+
+    def __repr__(self):
+        return 'all'
+
+
+class Comparison(Node):
+
+    def __init__(self, keyword, operator, value):
+        self.keyword = keyword
+        self.operator = operator
+        self.value = value
+
+    def evaluate(self, columns):
+        return _apply(columns[self.keyword], self.__compare)
+
+    def __compare(self, array):
+        if isinstance(self.value, str) and _has_wildcard(self.value):
+            mask = _isin(array, [self.value])
+            return mask if self.operator == 'is' else ~mask
+        return OPERATORS[self.operator](array, self.value)
+
+    def keywords(self):
+        return {self.keyword}
+
+    def __repr__(self):
+        return '{} {} {}'.format(self.keyword, self.operator, self.value)
+
+
+class Membership(Node):
+
+    def __init__(self, keyword, values):
+        self.keyword = keyword
+        self.values = values
+
+    def evaluate(self, columns):
+        return _apply(columns[self.keyword], self.__isin)
+
+    def __isin(self, array):
+        if self.keyword in NUMERIC_KEYWORDS:
+            return np.isin(array, self.values)
+        return _isin(array, self.values)
+
+    def keywords(self):
+        return {self.keyword}
+
+    def __repr__(self):
+        return '{} in [{}]'.format(self.keyword, ' '.join(str(v) for v in self.values))
+
+
+class Range(Node):
+
+    def __init__(self, keyword, low, high):
+        self.keyword = keyword
+        self.low = low
+        self.high = high
+
+    def evaluate(self, columns):
+        array = columns[self.keyword]
+        return (array >= self.low) & (array <= self.high)
+
+    def keywords(self):
+        return {self.keyword}
+
+    def __repr__(self):
+        return '{} {} to {}'.format(self.keyword, self.low, self.high)
+
+
+class Not(Node):
+
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, columns):
+        return ~self.child.evaluate(columns)
+
+    def keywords(self):
+        return self.child.keywords()
+
+    def global_nodes(self):
+        return self.child.global_nodes()
+
+    def __repr__(self):
+        return 'not ({})'.format(self.child)
+
+
+class And(Node):
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, columns):
+        return self.left.evaluate(columns) & self.right.evaluate(columns)
+
+    def keywords(self):
+        return self.left.keywords() | self.right.keywords()
+
+    def global_nodes(self):
+        return self.left.global_nodes() + self.right.global_nodes()
+
+    def __repr__(self):
+        return '({}) and ({})'.format(self.left, self.right)
+
+
+class Or(Node):
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, columns):
+        return self.left.evaluate(columns) | self.right.evaluate(columns)
+
+    def keywords(self):
+        return self.left.keywords() | self.right.keywords()
+
+    def global_nodes(self):
+        return self.left.global_nodes() + self.right.global_nodes()
+
+    def __repr__(self):
+        return '({}) or ({})'.format(self.left, self.right)
+
+
+class GlobalNode(Node):
+    """node that is resolved over the whole system to a set of atom IDs,
+       before the tree is evaluated one block of molecules at a time
+    """
+
+    def __init__(self, child):
+        self.child = child
+
+    def resolve(self, ids, mpt, spatial_index):
+        """Return IntervalSet of atom IDs, given the IntervalSet of atom IDs selected by child"""
+        raise NotImplementedError
+
+    def evaluate(self, columns):
+        return columns.resolved[self].contains(columns['id'])
+
+    def keywords(self):
+        return {'id'}
+
+    def global_nodes(self):
+        return [self]
+
+
+class Within(GlobalNode):
+
+    def __init__(self, distance, child):
+        super().__init__(child)
+        self.distance = distance
+
+    def resolve(self, ids, mpt, spatial_index):
+        if spatial_index is None:
+            raise SelectionError('Coordinates are needed for \'within\' selections')
+        return spatial_index.within(self.distance, ids)
+
+    def __repr__(self):
+        return 'within {} of ({})'.format(self.distance, self.child)
+
+
+class SameResidue(GlobalNode):
+
+    def resolve(self, ids, mpt, spatial_index):
+        return mpt.same_residue_as(ids)
+
+    def __repr__(self):
+        return 'same residue as ({})'.format(self.child)
+
+
+class BondedTo(GlobalNode):
+
+    def resolve(self, ids, mpt, spatial_index):
+        return mpt.bonded_to(ids)
+
+    def __repr__(self):
+        return 'bonded to ({})'.format(self.child)
+
+
+class Parser:
+    """recursive descent parser of tokenized selections"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, ahead=0):
+        position = self.position + ahead
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, expected):
+        token = self.next()
+        if token != expected:
+            raise SelectionError('Expected \'{}\' but found \'{}\' in selection'.format(expected, token))
+
+    def parse(self):
+        tree = self.expression()
+        token = self.peek()
+        if token == ')':
+            raise SelectionError('Open bracket is missing in selection')
+        if token is not None:
+            raise SelectionError('\'{}\' is not a valid boolean operator'.format(token))
+        return tree
+
+    def expression(self):
+        tree = self.term()
+        while self.peek() == 'or':
+            self.next()
+            tree = Or(tree, self.term())
+        return tree
+
+    def term(self):
+        tree = self.factor()
+        while self.peek() == 'and':
+            self.next()
+            tree = And(tree, self.factor())
+        return tree
+
+    def factor(self):
+        token = self.next()
+        if token is None:
+            raise SelectionError('Selection ended unexpectedly')
+        if token == 'not':
+            return Not(self.factor())
+        if token == '(':
+            tree = self.expression()
+            if self.peek() is None:
+                raise SelectionError('Closing bracket is missing in selection')
+            if self.peek() != ')':
+                raise SelectionError('\'{}\' is not a valid boolean operator'.format(self.peek()))
+            self.next()
+            return tree
+        if token == 'all':
+            return All()
+        if token == 'within':
+            distance = self.next()
+            try:
+                distance = float(distance)
+            except (TypeError, ValueError):
+                raise SelectionError('\'{}\' is not a valid distance for within'.format(distance))
+            self.expect('of')
+            return Within(distance, self.factor())
+        if token == 'same':
+            self.expect('residue')
+            self.expect('as')
+            return SameResidue(self.factor())
+        if token == 'byres':
+            return SameResidue(self.factor())
+        if token == 'bonded':
+            self.expect('to')
+            return BondedTo(self.factor())
+        if token in KEYWORDS:
+            return self.predicate(token)
+        raise SelectionError('\'{}\' is not a valid selection keyword'.format(token))
+
+    def predicate(self, keyword):
+        token = self.next()
+        if token in OPERATORS:
+            return Comparison(keyword, token, self.value(keyword))
+        if token == 'in':
+            if self.next() != '[':
+                raise SelectionError('List of values after \'in\' should be enclosed in []')
+            values = []
+            while self.peek() not in [']', None]:
+                values.append(self.value(keyword))
+            if self.next() is None:
+                raise SelectionError('Closing square bracket is missing in selection')
+            if not values:
+                raise SelectionError('List of values after \'in\' cannot be empty')
+            return Membership(keyword, values)
+        if token is not None and self.peek() == 'to':
+            if keyword not in NUMERIC_KEYWORDS:
+                raise SelectionError('Ranges can only be used with numeric keywords')
+            self.position -= 1
+            low = self.value(keyword)
+            self.next()
+            return Range(keyword, low, self.value(keyword))
+        if token is None:
+            raise SelectionError('Logical operator is missing after \'{}\''.format(keyword))
+        raise SelectionError('\'{}\' is not a valid logical operator'.format(token))
+
+    def value(self, keyword):
+        token = self.next()
+        if token is None or token in ['(', ')', '[', ']']:
+            raise SelectionError('Value is missing after \'{}\''.format(keyword))
+        if keyword not in NUMERIC_KEYWORDS:
+            return token
+        try:
+            value = float(token)
+        except ValueError:
+            raise SelectionError('\'{}\' is not a valid value for {}'.format(token, keyword))
+        return int(value) if value.is_integer() and keyword in ['resid', 'id'] else value
+
+
+def tokenize(selection):
+    return _TOKEN_REGEX.findall(selection)
+
+
+@lru_cache(maxsize=256)
+def _compile(normalized_selection):
+    return Parser(normalized_selection.split()).parse()
+
+
+def compile_selection(selection):
+    """Compile selection to a tree of nodes, cached by the normalized expression"""
+    return _compile(' '.join(tokenize(selection)))
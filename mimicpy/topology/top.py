@@ -1,9 +1,12 @@
 """Module for top files"""
 
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from os import environ
 from os.path import basename, join
 from .itp import Itp
+from .includes import IncludeResolver
+from .parse_cache import ParseCache
 from .topol_dict import TopolDict
 from ..utils.errors import MiMiCPyError
 from ..utils.strings import print_dict
@@ -11,15 +14,35 @@ from ..utils.atomic_numbers import atomic_numbers
 from ..utils.file_handler import write
 
 
-class Top:
-    """reads top files"""
+def _read_itp(itp_file, text, molecule_types, atom_types, buffer, guess_elements, gmxdata, resolver=None):
+    """Read atoms of one itp file from its text, returns None if the file cannot be found (text is None)
+       Module-level function so that it can be run in a process pool, where resolver is not passed
+       and a resolver holding only the text of itp_file is used
+    """
+    if text is None:
+        return None
+    if resolver is None:
+        resolver = IncludeResolver(gmxdata, {itp_file: text})
+    itp = Itp(itp_file, molecule_types, atom_types, buffer, 'r', guess_elements, gmxdata, resolver)
+    return itp.topol, itp.guessed_elems_history, itp.bonds
+
 
-    def __init__(self, file, mode='r', buffer=1000, nonstandard_atomtypes=None, guess_elements=True, gmxdata=None):
+class Top:
+    """reads top files
+       itp files are parsed in a pool of workers processes if workers > 1
+       parsed files are cached in cache_dir (see parse_cache) if it is given
+       buffer is ignored, files are parsed in bulk, it is only kept for compatibility
+    """
+
+    def __init__(self, file, mode='r', buffer=1000, nonstandard_atomtypes=None, guess_elements=True, gmxdata=None,
+                 workers=1, cache_dir=None):
         self.file = file
         self.mode = mode
         self.buffer = buffer
         self.nonstandard_atomtypes = nonstandard_atomtypes
         self.guess_elements = guess_elements
+        self.workers = workers
+        self.cache_dir = cache_dir
 
         if gmxdata is None:
             if 'GMXDATA' in environ:
@@ -38,6 +61,8 @@ class Top:
 
         self._molecules = None
         self._topol_dict = None
+        # every file of the topology is read once and shared by all Itp objects
+        self.resolver = IncludeResolver(self.gmxdata)
 
         if mode == 'r':
             self.__read()
@@ -63,9 +88,23 @@ class Top:
         return self._topol_dict
 
     def __read(self, get_atomtypes=False):
-        """Read molecule and atom information"""
-
-        top = Itp(self.file, mode='t', gmxdata=self.gmxdata)
+        """Read molecule and atom information
+           If cache_dir is set, the parsed topology is loaded from the cache if none of the files
+           in the include graph have changed, otherwise only the changed itp files are parsed again
+        """
+        cache = ParseCache(self.cache_dir) if self.cache_dir else None
+        if cache is not None:
+            nonstandard_atomtypes = sorted(self.nonstandard_atomtypes.items()) if self.nonstandard_atomtypes else None
+            top_key = ParseCache.topology_key(self.file, nonstandard_atomtypes, self.guess_elements,
+                                              self.gmxdata, get_atomtypes)
+            cached = cache.load(top_key)
+            if cached is not None:
+                logging.debug('Loaded %s from cache in %s.', basename(self.file), self.cache_dir)
+                self._molecules, self._topol_dict, self.atomtypes, guessed_elems_history = cached
+                Top.__log_guessed_elements(guessed_elems_history)
+                return
+
+        top = Itp(self.file, mode='t', gmxdata=self.gmxdata, resolver=self.resolver)
         atom_types = top.atom_types
         if get_atomtypes:
             self.atomtypes = top.atom_types_df
@@ -77,25 +116,69 @@ class Top:
             atom_types.update(self.nonstandard_atomtypes)
 
         atoms = {}
+        bonds = {}
         guessed_elems_history = {}
 
-        for itp_file in top.topology_files:
+        itp_files = top.topology_files
+        args = (molecule_types, atom_types, self.buffer, self.guess_elements, self.gmxdata)
+        texts = [self.__read_text(itp_file) for itp_file in itp_files]
+        results = [None]*len(itp_files)
+        to_read = list(range(len(itp_files)))
+        if cache is not None:
+            itp_keys = [ParseCache.itp_key(itp_file, text, molecule_types, sorted(atom_types.items()),
+                                           self.guess_elements) for itp_file, text in zip(itp_files, texts)]
+            results = [cache.load(key) for key in itp_keys]
+            to_read = [i for i, result in enumerate(results) if result is None]
+
+        if self.workers > 1 and len(to_read) > 1:
+            with ProcessPoolExecutor(min(self.workers, len(to_read))) as executor:
+                futures = {i: executor.submit(_read_itp, itp_files[i], texts[i], *args) for i in to_read}
+                for i, future in futures.items():
+                    results[i] = future.result()
+        else:
+            for i in to_read:
+                results[i] = _read_itp(itp_files[i], texts[i], *args, self.resolver)
+
+        if cache is not None:
+            for i in to_read:
+                if results[i] is not None:
+                    cache.store(itp_keys[i], results[i], [itp_files[i]])
+
+        # merge in include order, so that the result is the same as reading the files one by one
+        for itp_file, result in zip(itp_files, results):
             itp_file_name = basename(itp_file) # print only file name, and not full path
-            try:
-                itp = Itp(itp_file, molecule_types, atom_types, self.buffer, 'r', self.guess_elements, self.gmxdata)
-                if itp.topol is not None:
-                    atoms.update(itp.topol)
-                    guessed_elems_history.update(itp.guessed_elems_history)
-                    logging.debug('Read atoms from %s.', itp_file_name)
-                else:
-                    logging.debug('No atoms found in %s.', itp_file_name)
-            except OSError:
+            if result is None:
                 logging.warning('Could not find %s in local or Gromacs data directory. Skipping...', itp_file_name)
-        topol_dict = TopolDict.from_dict(atoms)
+                continue
+            topol, guessed_elems, itp_bonds = result
+            if topol is not None:
+                atoms.update(topol)
+                bonds.update(itp_bonds)
+                guessed_elems_history.update(guessed_elems)
+                logging.debug('Read atoms from %s.', itp_file_name)
+            else:
+                logging.debug('No atoms found in %s.', itp_file_name)
+        topol_dict = TopolDict.from_dict(atoms, bonds)
 
         self._molecules = top.molecules
         self._topol_dict = topol_dict
 
+        if cache is not None:
+            cache.store(top_key, (self._molecules, self._topol_dict, self.atomtypes, guessed_elems_history),
+                        self.resolver.include_graph(self.file))
+
+        Top.__log_guessed_elements(guessed_elems_history)
+        logging.debug('Read %s files of the topology %s times from disk, for %s requests.', len(self.resolver.read_counts),
+                      sum(self.resolver.read_counts.values()), sum(self.resolver.request_counts.values()))
+
+    def __read_text(self, file):
+        try:
+            return self.resolver.read(file)
+        except OSError:
+            return None
+
+    @staticmethod
+    def __log_guessed_elements(guessed_elems_history):
         if guessed_elems_history:
             logging.warning('\nSome atom types had no atom number infomation.\nThey were guessed as follows:\n')
             print_dict(guessed_elems_history, "Atom Type", "Element", logging.warning)
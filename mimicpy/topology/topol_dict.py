@@ -1,28 +1,61 @@
 """Module for MiMiCPy-specific molecule:topology dictionary"""
 
+import hashlib
+import pandas as pd
+from .bonds import Bonds
+
+
+def _content_hash(df, bonds=None):
+    """Stable hash of the column names, the column values and the bonds of a dataframe
+       The index and the dtypes are not part of the hash, it only groups candidates for DataFrame.equals,
+       which decides if two dataframes are equal
+    """
+    digest = hashlib.sha256(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    if bonds is not None:
+        digest.update(bonds.indptr.tobytes() + bonds.indices.tobytes())
+    return digest.hexdigest()
+
 
 class TopolDict:
     """provides a dictionary with non-repeating topology information"""
 
     @classmethod
-    def from_dict(cls, dict_df):
-        keys = list(dict_df.keys())
+    def from_dict(cls, dict_df, bonds=None):
+        """Remove repeating dataframes from dict_df, each is mapped to the first equal dataframe in repeating
+           Dataframes are grouped by a hash of their column names, column values and bonds,
+           and only compared with DataFrame.equals when their hashes are equal
+           bonds is an optional dictionary of Bonds, molecules are only repeating if their bonds are also equal
+        """
+        bonds = {} if bonds is None else dict(bonds)
         repeating = {}
-        i = 0
-        while i < len(keys):
-            key_i = keys[i]
-            for j in range(i+1, len(keys)):
-                key_j = keys[j]
-                if dict_df[key_i].equals(dict_df[key_j]):
-                    repeating[key_j] = key_i
-                    del dict_df[key_j]
-            i += 1
-            keys = list(dict_df.keys())
-        return cls(dict_df, repeating)
-
-    def __init__(self, dict_df, repeating):
+        unique_keys = {}
+        order = {key: i for i, key in enumerate(dict_df)}
+        is_equal = lambda k1, k2: dict_df[k1].equals(dict_df[k2]) and bonds.get(k1) == bonds.get(k2)
+        for key in list(dict_df.keys()):
+            candidates = unique_keys.setdefault(_content_hash(dict_df[key], bonds.get(key)), [])
+            first = next((k for k in candidates if is_equal(k, key)), None)
+            if first is None:
+                candidates.append(key)
+            else:
+                repeating[key] = first
+                del dict_df[key]
+                bonds.pop(key, None)
+        # ordered by the position of the first dataframe and then of the repeating one
+        repeating = dict(sorted(repeating.items(), key=lambda item: (order[item[1]], order[item[0]])))
+        return cls(dict_df, repeating, bonds)
+
+    def __init__(self, dict_df, repeating, bonds=None):
         self.dict_df = dict_df
         self.repeating = repeating
+        self.bonds = {} if bonds is None else bonds
+
+    def get_bonds(self, key):
+        """Bonds of a molecule, molecules without bond information have no bonds"""
+        template = self.repeating.get(key, key)
+        if template not in self.bonds:
+            return Bonds.empty(len(self[key]))
+        return self.bonds[template]
 
     def __getitem__(self, key):
         if key in self.dict_df:
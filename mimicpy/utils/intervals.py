@@ -0,0 +1,120 @@
+"""Module for compact sets of atom IDs"""
+
+import numpy as np
+
+
+class IntervalSet:
+    """stores a set of integers as sorted, non-overlapping half-open intervals [start, stop)
+       Iterating or converting to a NumPy array gives the integers in ascending order
+    """
+
+    def __init__(self, starts=(), stops=()):
+        starts = np.asarray(starts, dtype=np.int64).ravel()
+        stops = np.asarray(stops, dtype=np.int64).ravel()
+        if len(starts) != len(stops):
+            raise ValueError('Number of interval starts and stops do not match')
+        keep = stops > starts
+        starts, stops = starts[keep], stops[keep]
+        if len(starts) > 1 and not (np.all(starts[1:] > stops[:-1])):
+            order = np.argsort(starts, kind='stable')
+            starts, stops = starts[order], np.maximum.accumulate(stops[order])
+            # start a new interval only where there is a gap to all previous intervals
+            new = np.concatenate([[True], starts[1:] > stops[:-1]])
+            stop_positions = np.append(np.flatnonzero(new)[1:], len(starts)) - 1
+            starts, stops = starts[new], stops[stop_positions]
+        self.starts = starts
+        self.stops = stops
+
+    @classmethod
+    def from_ids(cls, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if ids.size == 0:
+            return cls()
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        starts = ids[np.concatenate([[0], breaks])]
+        stops = ids[np.append(breaks, len(ids)) - 1] + 1
+        return cls(starts, stops)
+
+    @classmethod
+    def from_range(cls, start, stop):
+        return cls([start], [stop])
+
+    @property
+    def lengths(self):
+        return self.stops - self.starts
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def __bool__(self):
+        return len(self.starts) > 0
+
+    def to_array(self):
+        lengths = self.lengths
+        total = int(lengths.sum())
+        if total == 0:
+            return np.array([], dtype=np.int64)
+        # position of every integer inside its interval, added to the interval start
+        first = np.cumsum(lengths) - lengths
+        return np.arange(total, dtype=np.int64) - np.repeat(first - self.starts, lengths)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+    def __iter__(self):
+        for start, stop in zip(self.starts.tolist(), self.stops.tolist()):
+            yield from range(start, stop)
+
+    def tolist(self):
+        return self.to_array().tolist()
+
+    def min(self):
+        return int(self.starts[0])
+
+    def max(self):
+        return int(self.stops[-1]) - 1
+
+    def contains(self, values):
+        """Boolean mask of values that are in the set"""
+        values = np.asarray(values, dtype=np.int64)
+        if len(self.starts) == 0:
+            return np.zeros(values.shape, dtype=bool)
+        i = np.searchsorted(self.starts, values, side='right') - 1
+        return (i >= 0) & (values < self.stops[np.maximum(i, 0)])
+
+    def __contains__(self, value):
+        return bool(self.contains([value])[0])
+
+    def __combine(self, other, operator):
+        if not isinstance(other, IntervalSet):
+            other = IntervalSet.from_ids(other)
+        bounds = np.unique(np.concatenate([self.starts, self.stops, other.starts, other.stops]))
+        if len(bounds) < 2:
+            return IntervalSet()
+        lefts, rights = bounds[:-1], bounds[1:]
+        keep = operator(self.contains(lefts), other.contains(lefts))
+        return IntervalSet(lefts[keep], rights[keep])
+
+    def union(self, other):
+        return self.__combine(other, np.logical_or)
+
+    def intersection(self, other):
+        return self.__combine(other, np.logical_and)
+
+    def difference(self, other):
+        return self.__combine(other, lambda a, b: a & ~b)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.stops, other.stops)
+
+    def __repr__(self):
+        intervals = ', '.join('{}-{}'.format(start, stop-1) if stop-start > 1 else str(start)\
+                              for start, stop in zip(self.starts.tolist(), self.stops.tolist()))
+        return 'IntervalSet({})'.format(intervals)
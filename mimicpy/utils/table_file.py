@@ -0,0 +1,92 @@
+"""Module for versioned binary files of named NumPy arrays
+   File format (little endian):
+   ##Header
+    magic bytes, version (uint32), number of arrays (uint32)
+   ##Table of contents, one entry per array
+    name (32 bytes, null padded), dtype (8 bytes, null padded), offset (uint64), number of items (uint64)
+   ##Data
+    raw arrays, each aligned to 8 bytes
+"""
+
+import mmap
+import struct
+import numpy as np
+import pandas as pd
+from .errors import ParserError
+
+MAGIC = b'\x89MPT\r\n\x1a\n'
+ENCODER = 'utf-8'
+_HEADER = struct.Struct('<8sLL')
+_ENTRY = struct.Struct('<32s8sQQ')
+_ALIGN = 8
+
+
+def is_table_file(file):
+    with open(file, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_tables(file, tables, version):
+    """Write dict of 1D NumPy arrays to file"""
+    tables = {name: np.ascontiguousarray(array) for name, array in tables.items()}
+    offset = _HEADER.size + _ENTRY.size*len(tables)
+    toc = []
+    for name, array in tables.items():
+        offset += -offset % _ALIGN
+        dtype = array.dtype.newbyteorder('<').str
+        toc.append(_ENTRY.pack(name.encode(ENCODER), dtype.encode(ENCODER), offset, len(array)))
+        offset += array.nbytes
+
+    with open(file, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, version, len(tables)))
+        f.write(b''.join(toc))
+        for array in tables.values():
+            f.write(b'\0'*(-f.tell() % _ALIGN))
+            f.write(array.astype(array.dtype.newbyteorder('<'), copy=False).tobytes())
+
+
+def read_tables(file):
+    """Memory map file and return version and dict of read-only 1D NumPy arrays
+       Arrays are views of the mapped file, so only the table of contents is read here
+    """
+    with open(file, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file cannot be mapped
+            buffer = b''
+
+    if len(buffer) < _HEADER.size:
+        raise ParserError(file, 'mpt', details='file is too short')
+    magic, version, number_of_tables = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ParserError(file, 'mpt', details='unknown file format')
+
+    tables = {}
+    for i in range(number_of_tables):
+        name, dtype, offset, count = _ENTRY.unpack_from(buffer, _HEADER.size + i*_ENTRY.size)
+        name = name.rstrip(b'\0').decode(ENCODER)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode(ENCODER))
+        if offset + dtype.itemsize*count > len(buffer):
+            raise ParserError(file, 'mpt', details='array {} is truncated'.format(name))
+        tables[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+    return version, tables
+
+
+def encode_strings(values):
+    """Dictionary-encode list of strings into integer codes and a vocabulary"""
+    codes, vocabulary = pd.factorize(np.asarray(values, dtype=object))
+    return codes.astype(np.int32), np.asarray(vocabulary, dtype=object)
+
+
+def pack_strings(strings):
+    """Pack list of strings into an array of utf-8 bytes and an array of offsets"""
+    encoded = [s.encode(ENCODER) for s in strings]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(data, offsets):
+    """Inverse of pack_strings"""
+    blob = data.tobytes()
+    return np.array([blob[i:j].decode(ENCODER) for i, j in zip(offsets[:-1], offsets[1:])], dtype=object)
@@ -0,0 +1,104 @@
+"""Module for packing and unpacking XDR data
+   Replaces the xdrlib module, which was removed from the standard library in Python 3.13
+"""
+
+import struct
+
+
+class ConversionError(Exception):
+    """raised for data that is not valid XDR, as xdrlib.ConversionError"""
+
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+class Packer:
+    """packs data in XDR format, follows the interface of xdrlib.Packer"""
+
+    def __init__(self):
+        self.__buffer = []
+
+    def get_buffer(self):
+        return b''.join(self.__buffer)
+
+    def pack_uint(self, x):
+        self.__buffer.append(struct.pack('>L', x))
+
+    def pack_int(self, x):
+        self.__buffer.append(struct.pack('>l', x))
+
+    def pack_float(self, x):
+        self.__buffer.append(struct.pack('>f', x))
+
+    def pack_double(self, x):
+        self.__buffer.append(struct.pack('>d', x))
+
+    def pack_string(self, s):
+        n = len(s)
+        self.pack_uint(n)
+        self.__buffer.append(s + b'\0'*((4 - n % 4) % 4))
+
+    def pack_list(self, lst, pack_item):
+        for item in lst:
+            self.pack_uint(1)
+            pack_item(item)
+        self.pack_uint(0)
+
+
+class Unpacker:
+    """unpacks data in XDR format, follows the interface of xdrlib.Unpacker"""
+
+    def __init__(self, data):
+        self.__buffer = data
+        self.__position = 0
+
+    def get_position(self):
+        return self.__position
+
+    def set_position(self, position):
+        self.__position = position
+
+    def done(self):
+        return self.__position >= len(self.__buffer)
+
+    def __unpack(self, fmt, size):
+        start = self.__position
+        self.__position = stop = start + size
+        data = self.__buffer[start:stop]
+        if len(data) < size:
+            raise EOFError
+        return struct.unpack(fmt, data)[0]
+
+    def unpack_uint(self):
+        return self.__unpack('>L', 4)
+
+    def unpack_int(self):
+        return self.__unpack('>l', 4)
+
+    def unpack_float(self):
+        return self.__unpack('>f', 4)
+
+    def unpack_double(self):
+        return self.__unpack('>d', 8)
+
+    def unpack_string(self):
+        n = self.unpack_uint()
+        start = self.__position
+        stop = start + n
+        data = self.__buffer[start:stop]
+        if len(data) < n:
+            raise EOFError
+        self.__position = start + n + (4 - n % 4) % 4
+        return bytes(data)
+
+    def unpack_list(self, unpack_item):
+        lst = []
+        while True:
+            flag = self.unpack_uint()
+            if flag == 0:
+                break
+            if flag != 1:
+                raise ConversionError('0 or 1 expected, got {!r}'.format(flag))
+            lst.append(unpack_item())
+        return lst
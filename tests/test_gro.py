@@ -83,3 +83,86 @@ def test_bad_gro2():
     with pytest.raises(ParserError) as error:
         assert gro_to_check.read()
     assert 'Error parsing gro_files/bad_gro2.gro: Gro file is not formatted properly' in str(error.value) 
+
+def test_gro_columns(tmp_path):
+    gro_file = str(tmp_path / 'columns.gro')
+    with open(gro_file, 'w') as f:
+        f.write("Triclinic\n"
+                " 3\n"
+                "    1SOL     OW    1   1.000  -2.500   0.125\n"
+                "    1SOL    HW1    2  10.5    -0.0     2\n"
+                "    1SOL    HW2    3   0.100   0.200   0.3\n"
+                "   1.0 2.0 3.0 0.0 0.0 0.5 0.0 0.5 0.0\n")
+
+    coords, box = Gro(gro_file).read()
+    assert coords.index.to_list() == [1, 2, 3]
+    assert coords.to_numpy().tolist() == [[1.0, -2.5, 0.125], [10.5, -0.0, 2.0], [0.1, 0.2, 0.3]]
+    assert box == [1.0, 2.0, 3.0, 0.0, 0.0, 0.5, 0.0, 0.5, 0.0]
+
+    with open(gro_file, 'w') as f:
+        f.write("Too few atoms\n"
+                " 3\n"
+                "    1SOL     OW    1   1.000  -2.500   0.125\n"
+                "    1SOL    HW1    2   1.000  -2.500   0.125\n"
+                "   1.0 2.0 3.0\n")
+
+    with pytest.raises(ParserError):
+        Gro(gro_file).read()
+
+def test_write_gro(tmp_path):
+    import pandas as pd
+    sele = pd.DataFrame({'resid': [1, 1, 123456], 'resname': ['SOL', 'SOL', 'LONGNAME'],
+                         'name': ['OW', 'HW1', 'HW2'], 'x': [1.0, -2.5, 0.1234], 'y': [0.0, 1.0, 2.0],
+                         'z': [3.0, 2.0, 1.0]}, index=pd.Index([1, 2, 100001], name='id'))
+    gro_file = str(tmp_path / 'out.gro')
+    Gro(gro_file).write(sele, box=[1, 2, 3], title='Test')
+
+    with open(gro_file) as f:
+        assert f.read() == ("Test, Generated by MiMiCPy\n3\n"
+                            "    1SOL     OW    1   1.000   0.000   3.000\n"
+                            "    1SOL    HW1    2  -2.500   1.000   2.000\n"
+                            "12345LONGN  HW210000   0.123   2.000   1.000\n"
+                            "   1.00000   2.00000   3.00000\n")
+    assert Gro(gro_file).write(sele, box=[1, 2, 3], title='Test', as_str=True) == open(gro_file).read()
+
+    coords, box = Gro(gro_file).read()
+    assert coords.to_numpy().tolist() == [[1.0, 0.0, 3.0], [-2.5, 1.0, 2.0], [0.123, 2.0, 1.0]]
+
+def test_join_coords():
+    import pandas as pd
+    from mimicpy.coords.base import join_coords, has_contiguous_ids
+    sele = pd.DataFrame({'name': ['C1', 'C2']}, index=pd.Index([3, 1], name='id'))
+    coords = pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y': [4.0, 5.0, 6.0], 'z': [7.0, 8.0, 9.0]},
+                          index=pd.RangeIndex(1, 4, name='id'))
+    shuffled = coords.iloc[[2, 0, 1]]
+
+    assert has_contiguous_ids(coords) and not has_contiguous_ids(shuffled)
+    joined = join_coords(sele, coords)
+    assert joined.index.to_list() == [3, 1]
+    assert joined[['x', 'y', 'z']].to_numpy().tolist() == [[3.0, 6.0, 9.0], [1.0, 4.0, 7.0]]
+    assert join_coords(sele, shuffled).sort_index().equals(joined.sort_index())
+
+def test_gro_frames(tmp_path):
+    from mimicpy import CoordsIO
+    with open('gro_files/gro2.gro') as f:
+        lines = f.read().splitlines()
+    traj_file = str(tmp_path / 'traj.gro')
+    with open(traj_file, 'w') as f:
+        for i in range(5):
+            f.write('Acetone t= {:.5f} step= {}\n'.format(i*2.0, i*1000))
+            f.write('\n'.join(lines[1:]) + '\n')
+        f.write('Truncated frame\n 10\n' + lines[2] + '\n')
+
+    traj = CoordsIO(traj_file)
+    coords, _ = Gro('gro_files/gro2.gro').read()
+    assert len(traj) == 5
+    assert traj.coords.equals(coords)
+    assert (traj[-1].step, traj[-1].time) == (4000, 8.0)
+    assert traj[2].box == [1.58732, 1.68732, 1.38732]
+
+    frames = traj.frames(1, 4)
+    first = next(frames)
+    assert first.step == 1000 and first.coords.tolist() == coords.to_numpy().tolist()
+    assert [frame.step for frame in frames] == [2000, 3000]
+    with pytest.raises(IndexError):
+        traj[5]
@@ -0,0 +1,44 @@
+import random
+from mimicpy.utils.intervals import IntervalSet
+
+def test_set_operations():
+    for _ in range(100):
+        a = set(random.sample(range(1, 100), random.randint(0, 60)))
+        b = set(random.sample(range(1, 100), random.randint(0, 60)))
+        set_a, set_b = IntervalSet.from_ids(list(a)), IntervalSet.from_ids(list(b))
+
+        assert (set_a | set_b).tolist() == sorted(a | b)
+        assert (set_a & set_b).tolist() == sorted(a & b)
+        assert (set_a - set_b).tolist() == sorted(a - b)
+        assert len(set_a) == len(a)
+
+    ids = IntervalSet([10, 1, 4], [20, 3, 10])
+    assert ids.starts.tolist() == [1, 4]
+    assert ids.stops.tolist() == [3, 20]
+    assert 5 in ids and 3 not in ids
+    assert ids.min() == 1 and ids.max() == 19
+    assert ids == IntervalSet.from_ids(list(range(1, 3)) + list(range(4, 20)))
+
+def test_mpt_select_ids():
+    from test_mpt import getMockTopol
+    from mimicpy import Mpt
+    from mimicpy.topology.topol_dict import TopolDict
+
+    df1, df2 = getMockTopol()
+    mpt = Mpt([('MOL1', 1), ('NA1', 1000), ('MOL1', 2)], TopolDict.from_dict({'MOL1':df1, 'NA1':df2}), 'w')
+
+    ids = mpt.select_ids('resname is NA+')
+    assert ids == IntervalSet.from_range(6, 1006)
+
+    ids = mpt.select_ids('name is C1') | mpt.select_ids('id 1000 to 1007')
+    assert ids.tolist() == [1] + list(range(1000, 1008)) + [1011]
+    assert mpt.select(ids).index.to_list() == ids.tolist()
+
+def test_ndx():
+    from mimicpy import Ndx
+    ndx_list, ndx_set = Ndx('qmatoms'), Ndx('qmatoms')
+    ndx_list.qmatoms = list(range(1, 40)) + [100]
+    ndx_set.qmatoms = IntervalSet.from_ids(ndx_list.qmatoms)
+
+    assert str(ndx_list) == str(ndx_set)
+    assert str(ndx_list).splitlines()[2].split() == [str(i) for i in range(1, 16)]
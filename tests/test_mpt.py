@@ -1,3 +1,4 @@
+import numpy as np
 from mimicpy import Mpt
 import pytest
 
@@ -88,3 +89,247 @@ def test_select():
     with pytest.raises(SelectionError) as e:
         assert mpt.select('name is CA or ( name is CT')
     assert str(e.value) == "Closing bracket is missing in selection"
+
+def test_getitem():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2})
+
+    mpt = Mpt([('MOL1', 2), ('NA1', 3)], topol_dict, 'r')
+
+    assert mpt.number_of_atoms == 13
+
+    sele = mpt[[2, 7, 13]]
+    assert sele.index.to_list() == [2, 7, 13]
+    assert sele['name'].to_list() == ['C2', 'C2', 'NA']
+    assert sele['resid'].to_list() == [1, 3, 7]
+    assert sele['mol'].to_list() == ['MOL1', 'MOL1', 'NA1']
+    assert sele['charge'].dtype == float
+
+    assert mpt[1:4].index.to_list() == [1, 2, 3]
+
+    from mimicpy.utils.errors import SelectionError
+
+    with pytest.raises(SelectionError):
+        assert mpt[14]
+
+def test_lazy_getitem():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2, 'MOL2':df1})
+    molecules = [('MOL1', 2), ('NA1', 3), ('MOL2', 0), ('MOL2', 2), ('NA1', 1)]
+
+    expanded_mpt = Mpt(molecules, topol_dict, 'r')
+    lazy_mpt = Mpt(molecules, topol_dict, 'w')
+
+    assert lazy_mpt.number_of_atoms == expanded_mpt.number_of_atoms == 24
+    ids = [24, 1, 13, 11, 14, 20, 12, 5]
+    assert lazy_mpt[ids].equals(expanded_mpt[ids])
+    assert lazy_mpt._expanded_data is None
+
+def test_read_write(tmp_path):
+    legacy_mpt = Mpt.from_file('dppc/topol.mpt')
+
+    assert legacy_mpt.molecules == [('DPPC', 2), ('SOL', 100)]
+    assert legacy_mpt.number_of_atoms == 2*50 + 100*3
+
+    for version in [1, 2]:
+        mpt_file = str(tmp_path / 'topol_v{}.mpt'.format(version))
+        legacy_mpt.write(mpt_file, version)
+        mpt = Mpt.from_file(mpt_file)
+
+        assert mpt.molecules == legacy_mpt.molecules
+        assert mpt.topol_dict.repeating == legacy_mpt.topol_dict.repeating
+        for mol, df in legacy_mpt.topol_dict.dict_df.items():
+            if version == 1:
+                # version 1 stores single precision floats
+                assert df.drop(columns=['charge', 'mass']).equals(mpt.topol_dict[mol].drop(columns=['charge', 'mass']))
+            else:
+                assert df.equals(mpt.topol_dict[mol])
+        assert mpt.select('all').equals(legacy_mpt.select('all'))
+
+    df1, df2 = getMockTopol()
+    from mimicpy.topology.topol_dict import TopolDict
+    mpt = Mpt([('MOL1', 2), ('NA1', 3), ('NA2', 1)], TopolDict.from_dict({'MOL1':df1.set_index('number'),\
+                                                                        'NA1':df2.set_index('number'),\
+                                                                        'NA2':df2.set_index('number')}))
+    mpt_file = str(tmp_path / 'mock.mpt')
+    mpt.write(mpt_file)
+    new_mpt = Mpt.from_file(mpt_file)
+
+    assert new_mpt.topol_dict.repeating == {'NA2': 'NA1'}
+    assert new_mpt.select('all').equals(mpt.select('all'))
+
+    # nothing is built on opening, columns are expanded on first use of the whole system
+    large_file = str(tmp_path / 'large.mpt')
+    Mpt([('MOL1', 10**6), ('NA1', 3)], mpt.topol_dict, 'w').write(large_file)
+    large_mpt = Mpt.from_file(large_file)
+    assert large_mpt._Mpt__encodings is None and large_mpt._Mpt__residue_tables is None
+    assert large_mpt[[5*10**6 + 1]]['resname'].tolist() == ['NA+']
+    assert large_mpt._Mpt__expanded is None
+    assert new_mpt['name'] == mpt['name'] and new_mpt._Mpt__expanded is not None
+
+    from mimicpy.utils.table_file import read_tables
+    empty_file = str(tmp_path / 'empty.mpt')
+    Mpt([], TopolDict.from_dict({})).write(empty_file)
+    _, tables = read_tables(empty_file)
+    assert tables['templates.start'].dtype == tables['templates.bond_start'].dtype == np.int64
+
+    from mimicpy.utils.errors import MiMiCPyError
+    with pytest.raises(MiMiCPyError):
+        mpt.write(mpt_file, 3)
+
+def test_selection_language():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2, 'MOL2':df1})
+
+    mpt = Mpt([('MOL1', 1), ('NA1', 1), ('MOL2', 1)], topol_dict, 'r')
+
+    assert mpt.select('name in [C1 NA H1]').index.to_list() == [1, 4, 6, 7, 10]
+    assert mpt.select('id 3 to 7').index.to_list() == [3, 4, 5, 6, 7]
+    assert mpt.select('name is C*').index.to_list() == [1, 2, 3, 7, 8, 9]
+    assert mpt.select('name not C? and type in [N* H]').index.to_list() == [4, 5, 6, 10, 11]
+    assert mpt.select('not (resname is UNK1 or mol is MOL2)').index.to_list() == [4, 5, 6]
+    assert mpt.select('charge < -0.1 or mass >= 14.0').index.to_list() == [2, 5, 6, 8, 11]
+    assert mpt.select('resid 2 to 3 and not name is NA').index.to_list() == [4, 5]
+
+    from mimicpy.topology.selection import compile_selection
+    assert compile_selection('name is CA and  (resid < 5)') is compile_selection(' name is CA and ( resid < 5 ) ')
+
+    from mimicpy.utils.errors import SelectionError
+
+    with pytest.raises(SelectionError) as e:
+        assert mpt.select('name C1 to C2')
+    assert str(e.value) == "Ranges can only be used with numeric keywords"
+
+    with pytest.raises(SelectionError) as e:
+        assert mpt.select('resid in [1 2')
+    assert str(e.value) == "Closing square bracket is missing in selection"
+
+    with pytest.raises(SelectionError) as e:
+        assert mpt.select('mass > heavy')
+    assert str(e.value) == "'heavy' is not a valid value for mass"
+
+def test_select_per_template():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2, 'MOL2':df1})
+
+    mpt = Mpt([('MOL1', 3), ('NA1', 4), ('MOL2', 2), ('NA1', 2)], topol_dict, 'w')
+    atoms = mpt.select('all')
+
+    assert mpt.select('name is C2').index.to_list() == [2, 7, 12, 21, 26]
+    assert mpt.select('resname is NA+ or (mol is MOL2 and name is H1)').index.to_list() ==\
+           [16, 17, 18, 19, 23, 28, 30, 31]
+    assert mpt.select('resid 4 to 7').index.to_list() == atoms[atoms['resid'].between(4, 7)].index.to_list()
+    assert mpt.select('element is C and id > 20').index.to_list() == [21, 22, 25, 26, 27]
+    assert mpt._expanded_data is None
+
+def test_encoded_columns(tmp_path):
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1.set_index('number'), 'NA1':df2.set_index('number')})
+    mpt = Mpt([('MOL1', 2), ('NA1', 3)], topol_dict, 'r')
+
+    for column in ['type', 'resname', 'name', 'element', 'mol']:
+        assert mpt._expanded_data[column].dtype.kind == 'i'
+    assert list(mpt._vocabularies['resname']) == ['UNK1', 'UNK2', 'NA+']
+    assert mpt.select('resname > UNK1 and name not H1').index.to_list() == [5, 10]
+
+    from mimicpy.utils.table_file import read_tables
+    mpt.write(str(tmp_path / 'mock.mpt'))
+    _, tables = read_tables(str(tmp_path / 'mock.mpt'))
+    assert tables['atoms.resname'].tolist() == [0, 0, 0, 1, 1, 2]
+
+def test_residues():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2, 'MOL2':df1})
+    mpt = Mpt([('MOL1', 2), ('NA1', 2), ('MOL2', 1)], topol_dict, 'w')
+
+    residues = mpt.residues
+    assert mpt.number_of_residues == 8
+    assert residues['resid'].to_list() == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert residues['resname'].to_list() == ['UNK1', 'UNK2']*2 + ['NA+']*2 + ['UNK1', 'UNK2']
+    assert residues['molecule'].to_list() == [0, 0, 1, 1, 2, 3, 4, 4]
+    assert residues['start_id'].to_list() == [1, 4, 6, 9, 11, 12, 13, 16]
+    assert residues['stop_id'].to_list() == [4, 6, 9, 11, 12, 13, 16, 18]
+    assert residues['charge'].round(6).to_list() == [0.2, 2, 0.2, 2, 1, 1, 0.2, 2]
+    assert residues['mass'].to_list() == [36, 15, 36, 15, 23, 23, 36, 15]
+
+    assert mpt['resid'] == Mpt([('MOL1', 2), ('NA1', 2), ('MOL2', 1)], topol_dict, 'r')['resid']
+    assert mpt.residue_of([1, 5, 11, 17]).tolist() == [0, 1, 4, 7]
+    assert mpt.residue_atoms(6).tolist() == [13, 14, 15]
+
+    assert mpt.select_ids('byres name is H1').tolist() == [4, 5, 9, 10, 16, 17]
+    assert mpt.select_ids('byres (id is 2 or id is 12)').tolist() == [1, 2, 3, 12]
+    assert mpt.select_ids('rescharge > 1.5').tolist() == [4, 5, 9, 10, 16, 17]
+    assert mpt.select_ids('resmass 20 to 40 and not resname is NA+').tolist() == [1, 2, 3, 6, 7, 8, 13, 14, 15]
+    assert mpt['resmass'][:6] == [36, 36, 36, 15, 15, 36]
+
+def test_topol_dict_hashing():
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    df3 = df1.copy()
+    df3.loc[2, 'charge'] = 0.3  # same shape and names, different values
+    df4 = df1.astype({'mass': float})  # same values, different dtype
+    topol_dict = TopolDict.from_dict({'MOL1': df1, 'NA1': df2, 'MOL2': df3, 'NA2': df2.copy(),
+                                      'MOL3': df1.copy(), 'MOL4': df4, 'MOL5': df3.copy()})
+
+    assert list(topol_dict.dict_df) == ['MOL1', 'NA1', 'MOL2', 'MOL4']
+    assert list(topol_dict.repeating.items()) == [('MOL3', 'MOL1'), ('NA2', 'NA1'), ('MOL5', 'MOL2')]
+
+    # equal dataframes with indexes of different dtypes are repeating, and bonds of the caller are not changed
+    from mimicpy.topology.bonds import Bonds
+    df5 = df1.set_index('number')
+    df6 = df5.copy()
+    df6.index = df6.index.astype(float)
+    bonds = {'MOL1': Bonds.empty(5), 'MOL2': Bonds.empty(5)}
+    topol_dict = TopolDict.from_dict({'MOL1': df5, 'MOL2': df6}, bonds)
+    assert topol_dict.repeating == {'MOL2': 'MOL1'}
+    assert list(bonds) == ['MOL1', 'MOL2'] and list(topol_dict.bonds) == ['MOL1']
+
+def test_bonds(tmp_path):
+    df1, df2 = getMockTopol()
+
+    from mimicpy.topology.topol_dict import TopolDict
+    from mimicpy.topology.bonds import Bonds
+    bonds = {'MOL1': Bonds.from_pairs([0, 1, 2], [1, 2, 4], 5), 'NA1': Bonds.empty(1)}
+    topol_dict = TopolDict.from_dict({'MOL1': df1.set_index('number'), 'NA1': df2.set_index('number')}, bonds)
+    mpt = Mpt([('MOL1', 2), ('NA1', 2)], topol_dict)
+
+    assert mpt.bonded_to([2]).tolist() == [1, 3]
+    assert mpt.bonded_to([8, 11]).tolist() == [7, 10]
+    assert mpt.within_bonds([1], 2).tolist() == [1, 2, 3]
+    assert mpt.within_bonds([6], 10).tolist() == [6, 7, 8, 10]
+    assert mpt.crossing_bonds([6, 7]).tolist() == [[7, 8]]
+    assert mpt.crossing_bonds([11, 12]).shape == (0, 2)
+    assert mpt.select_ids('bonded to name is C3').tolist() == [2, 5, 7, 10]
+    assert mpt.select_ids('name is C1 or bonded to name is C1').tolist() == [1, 2, 6, 7]
+
+    mpt_file = str(tmp_path / 'bonds.mpt')
+    mpt.write(mpt_file)
+    new_mpt = Mpt.from_file(mpt_file)
+    assert new_mpt.topol_dict.get_bonds('MOL1') == bonds['MOL1']
+    assert new_mpt.crossing_bonds([6, 7]).tolist() == [[7, 8]]
+
+def test_xdr_list():
+    from mimicpy.utils import xdr
+    packer = xdr.Packer()
+    packer.pack_list([1, 2], packer.pack_int)
+    unpacker = xdr.Unpacker(packer.get_buffer())
+    assert unpacker.unpack_list(unpacker.unpack_int) == [1, 2]
+
+    data = bytearray(packer.get_buffer())
+    data[8:12] = (2).to_bytes(4, 'big')  # flag before the second item
+    unpacker = xdr.Unpacker(bytes(data))
+    with pytest.raises(xdr.ConversionError):
+        unpacker.unpack_list(unpacker.unpack_int)
@@ -0,0 +1,68 @@
+import pytest
+from mimicpy import Pdb
+from mimicpy.utils.errors import ParserError
+
+
+def test_pdb(tmp_path):
+    pdb_file = str(tmp_path / 'test.pdb')
+    with open(pdb_file, 'w') as f:
+        f.write("REMARK    TEST\n"
+                "CRYST1   10.000   20.000   30.000  90.00  90.00  90.00 P 1           1\n"
+                "MODEL        1\n"
+                "ATOM      1  N   MET A   1      10.000  -2.500   0.125  1.00  0.00           N\n"
+                "ATOM      2  CA  MET A   1      11.000   2.500  -0.125\n"
+                "TER\n"
+                "HETATM    3 NA    NA     2       1.234   5.678   9.012  1.00  0.00          NA1+\n"
+                "ENDMDL\n"
+                "MODEL        2\n"
+                "ATOM      1  N   MET A   1      99.000  99.000  99.000  1.00  0.00           N\n"
+                "ENDMDL\n")
+
+    coords, box = Pdb(pdb_file).read()
+    assert coords.index.to_list() == [1, 2, 3]
+    assert coords.round(6).to_numpy().tolist() == [[1.0, -0.25, 0.0125], [1.1, 0.25, -0.0125],
+                                                    [0.1234, 0.5678, 0.9012]]
+    assert box == [1.0, 2.0, 3.0]
+
+    with open(pdb_file, 'w') as f:
+        f.write("ATOM      1  N   MET A   1      10.000  -2.500\n")
+
+    with pytest.raises(ParserError):
+        Pdb(pdb_file).read()
+
+def test_pdb_frames(tmp_path):
+    from mimicpy import CoordsIO
+    pdb_file = str(tmp_path / 'traj.pdb')
+    with open(pdb_file, 'w') as f:
+        for i in range(3):
+            f.write("TITLE     Protein t= {:.5f} step= {}\n"
+                    "CRYST1   10.000   20.000   30.000  90.00  90.00  90.00 P 1           1\n"
+                    "MODEL        {}\n"
+                    "ATOM      1  N   MET A   1      {:6.3f}  -2.500   0.125  1.00  0.00           N\n"
+                    "ATOM      2  CA  MET A   1      11.000   2.500  -0.125\n"
+                    "TER\n"
+                    "ENDMDL\n".format(i*1.5, i*10, i+1, i+1))
+        f.write("END\n")
+
+    traj = CoordsIO(pdb_file)
+    assert len(traj) == 3
+    assert traj.coords['x'].to_list() == [0.1, 1.1]
+    assert [(frame.step, frame.time, frame.coords[0, 0]) for frame in traj.frames()] == [(0, 0.0, 0.1), (10, 1.5, 0.2),
+                                                                                         (20, 3.0, 0.3)]
+    assert traj[1].box == [1.0, 2.0, 3.0]
+
+    # the box of a CRYST1 record before the first model applies to all models
+    with open(pdb_file, 'w') as f:
+        f.write("TITLE     Protein\n"
+                "CRYST1   10.000   20.000   30.000  90.00  90.00  90.00 P 1           1\n")
+        for i in range(3):
+            f.write("MODEL        {}\n"
+                    "ATOM      1  N   MET A   1      {:6.3f}  -2.500   0.125  1.00  0.00           N\n"
+                    "ATOM      2  CA  MET A   1      11.000   2.500  -0.125\n"
+                    "ENDMDL\n".format(i+1, i+1))
+
+    traj = CoordsIO(pdb_file)
+    assert [frame.box for frame in traj.frames()] == [[1.0, 2.0, 3.0]]*3
+    traj.seek(1)
+    assert traj.has_box and traj.box == [1.0, 2.0, 3.0]
+    assert CoordsIO(pdb_file, mode='w').read_frame(*traj.frame_offsets[2:4]).box == [1.0, 2.0, 3.0]
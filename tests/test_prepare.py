@@ -1,6 +1,8 @@
 import io
 import logging
-from mimicpy import Mdp
+import numpy as np
+from mimicpy import CpmdScript, Mdp
+from mimicpy.utils.constants import BOHR_RADIUS
 from mimicpy.utils.errors import SelectionError
 import pandas as pd
 import pytest
@@ -125,4 +127,117 @@ def test_prepare():
     assert "Index group for QM atoms is not qmatoms, set QMMM-grps to the appropriate group" in warns.getvalue()
     assert "Temperature coupling will not be active, set tcoupl = no" in warns.getvalue()
     assert "Molecules should not be constrained by Gromacs, set constraints = none" not in warns.getvalue()
-    assert "Pressure coupling will not be active, set pcoupl = no" not in warns.getvalue()
\ No newline at end of file
+    assert "Pressure coupling will not be active, set pcoupl = no" not in warns.getvalue()
+
+def test_mimic_inputs(tmp_path):
+    from mimicpy.core.prepare import Preparation
+    selector = MockSelector()
+    prep = Preparation(selector)
+    prep.add('resid is 1')
+    _, cpmd = prep.get_mimic_input()
+
+    df = selector.df
+    gro_files = []
+    for i in range(3):
+        gro_file = str(tmp_path / 'frame{}.gro'.format(i))
+        with open(gro_file, 'w') as f:
+            f.write('Frame {}\n{:5d}\n'.format(i, len(df)))
+            for atom_id, atom in df.iterrows():
+                f.write('{:5d}{:<5}{:>5}{:5d}{:8.3f}{:8.3f}{:8.3f}\n'.format(1, atom['resname'], atom['name'], atom_id,
+                                                                           atom['x'] + i, atom['y'], atom['z']))
+            f.write('   3.00000   3.00000   3.00000\n')
+        gro_files.append(gro_file)
+
+    with pytest.raises(SelectionError):
+        Preparation(selector).get_mimic_inputs(gro_files)
+
+    out = str(tmp_path / 'cpmd_{}.inp')
+    inp_files = prep.get_mimic_inputs(str(tmp_path), inp_out=out, workers=2)
+    assert inp_files == [out.format('frame{}'.format(i)) for i in range(3)]
+    with open(inp_files[0]) as f:
+        assert f.read() == str(cpmd).replace(cpmd.mimic.box, ' '.join([str(3.0/BOHR_RADIUS)]*3))
+
+    frame = CpmdScript.from_file(inp_files[2])
+    assert frame.system.cell == cpmd.system.cell
+    assert frame.mimic.overlaps.splitlines() == cpmd.mimic.overlaps.splitlines()
+    shift = [[2.0/BOHR_RADIUS, 0, 0]]*len(cpmd.atoms.c.coords)
+    assert np.allclose(np.array(frame.atoms.c.coords) - cpmd.atoms.c.coords, shift, atol=1e-6)
+
+
+def test_qm_region():
+    from mimicpy.core.prepare import Preparation
+    from mimicpy.utils.intervals import IntervalSet
+
+    class IdSelector(MockSelector):
+        def select(self, selection=None):
+            return self.df.loc[selection.to_array()]
+
+    prep = Preparation(IdSelector())
+    assert prep.qm_atoms.empty
+    prep.add(IntervalSet.from_ids([5, 1, 2]))
+    prep.add(IntervalSet.from_ids([2, 3]), is_link=True)
+    prep.add(IntervalSet.from_ids([9]))
+    prep.delete(IntervalSet.from_ids([1, 7]))
+
+    qm_atoms = prep.qm_atoms
+    assert qm_atoms is prep.qm_atoms  # only built again after the QM region changes
+    assert prep.qm_ids.tolist() == [2, 3, 5, 9]
+    assert qm_atoms.index.to_list() == [2, 3, 5, 9] and qm_atoms.index.name == 'id'
+    assert qm_atoms['is_link'].to_list() == [1, 1, 0, 0]
+    assert qm_atoms[['x', 'y', 'z']].equals(prep.selector.df.loc[[2, 3, 5, 9], ['x', 'y', 'z']])
+
+    prep.add(IntervalSet.from_ids([3]))
+    assert prep.qm_atoms['is_link'].to_list() == [1, 0, 0, 0]
+
+    # atoms of the CPMD input are ordered by element, link atoms last, and by ID within an element
+    prep.add(IntervalSet.from_ids([10, 7, 1, 8, 4, 6]))
+    prep.add(IntervalSet.from_ids([2]), is_link=True)
+    _, cpmd = prep.get_mimic_input()
+    overlaps = [line.split() for line in cpmd.mimic.overlaps.splitlines()[1:]]
+    assert [int(line[1]) for line in overlaps] == [8, 9, 10, 3, 4, 5, 6, 7, 1, 2]
+    assert [int(line[3]) for line in overlaps] == list(range(1, 11))
+    prep.clear()
+    assert prep.qm_atoms.empty and len(prep.qm_ids) == 0
+    with pytest.raises(SelectionError):
+        prep.get_mimic_input()
+
+
+def test_boundary_bonds(caplog):
+    from test_mpt import getMockTopol
+    from mimicpy import Mpt
+    from mimicpy.core.prepare import Preparation
+    from mimicpy.topology.bonds import Bonds
+    from mimicpy.topology.topol_dict import TopolDict
+
+    class BondSelector:
+        def __init__(self):
+            df1, df2 = getMockTopol()
+            bonds = {'MOL1': Bonds.from_pairs([0, 1, 2], [1, 2, 4], 5)}
+            self.mpt = Mpt([('MOL1', 1), ('NA1', 1)], TopolDict.from_dict({'MOL1': df1.set_index('number'),
+                                                                           'NA1': df2.set_index('number')}, bonds))
+            self.mm_box = [2.0, 2.0, 2.0]
+
+        def select_ids(self, selection):
+            return self.mpt.select_ids(selection)
+
+        def select(self, selection):
+            df = self.mpt.select(selection)
+            df['x'], df['y'], df['z'] = 0.1*df.index, 0.0, 0.0
+            return df
+
+    prep = Preparation(BondSelector())
+    with caplog.at_level(logging.INFO):
+        prep.add('name is C1 or name is C2')
+        prep.add('name is C3', is_link=True)
+        assert not caplog.records  # boundary bonds are only checked for inputs
+        assert prep.boundary_bonds.tolist() == [[3, 5]]
+
+        prep.get_mimic_input()
+        messages = [record.getMessage() for record in caplog.records]
+        assert '1 bonds cross the boundary of the QM region at QM atoms 3' in messages
+        assert not any('are not link atoms' in message for message in messages)
+
+        caplog.clear()
+        prep.add('name is C3')
+        prep.get_mimic_input()
+        assert 'QM atoms 3 are bonded to MM atoms but are not link atoms' in caplog.text
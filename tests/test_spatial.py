@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from mimicpy import Mpt
+from mimicpy.core.spatial import CellList
+from mimicpy.utils.errors import SelectionError
+from mimicpy.utils.intervals import IntervalSet
+
+def brute_force_within(coords, box, distance, ids):
+    delta = coords[:, np.newaxis, :] - coords[np.asarray(ids)-1][np.newaxis, :, :]
+    if box is not None:
+        delta -= np.asarray(box) * np.round(delta / np.asarray(box))
+    close = np.any(np.linalg.norm(delta, axis=2) <= distance, axis=1)
+    return IntervalSet.from_ids(np.flatnonzero(close)+1)
+
+def test_within():
+    rng = np.random.default_rng(7)
+    box = [3.0, 2.5, 4.0]
+    coords = rng.random((2000, 3)) * box
+    query = IntervalSet.from_ids(rng.choice(np.arange(1, 2001), 15, replace=False))
+
+    for b in [box, None]:
+        cell_list = CellList(coords, b)
+        for distance in [0.2, 0.5, 1.3]:
+            assert cell_list.within(distance, query) == brute_force_within(coords, b, distance, query)
+
+    # atoms on opposite sides of the box are neighbours through the periodic boundary
+    cell_list = CellList(np.array([[0.05, 1, 1], [2.95, 1, 1], [1.5, 1, 1]]), box)
+    assert cell_list.within(0.2, IntervalSet.from_ids([1])).tolist() == [1, 2]
+    assert CellList(np.array([[0.05, 1, 1], [2.95, 1, 1]])).within(0.2, IntervalSet.from_ids([1])).tolist() == [1]
+
+def test_mpt_within():
+    from test_mpt import getMockTopol
+    from mimicpy.topology.topol_dict import TopolDict
+    df1, df2 = getMockTopol()
+    topol_dict = TopolDict.from_dict({'MOL1':df1, 'NA1':df2})
+    mpt = Mpt([('MOL1', 2), ('NA1', 3)], topol_dict, 'w')
+
+    # atoms on a line 1 nm apart
+    coords = np.zeros((13, 3))
+    coords[:, 0] = np.arange(13)
+    cell_list = CellList(coords, [20, 20, 20])
+
+    assert mpt.select_ids('within 1.5 of id is 6', cell_list).tolist() == [5, 6, 7]
+    assert mpt.select_ids('same residue as id is 6', cell_list).tolist() == [6, 7, 8]
+    assert mpt.select_ids('same residue as within 1.5 of name is C3', cell_list).tolist() == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert mpt.select_ids('resname is NA+ and not within 1 of resname is UNK2', cell_list).tolist() == [12, 13]
+    assert mpt.select_ids('within 0.5 of (name is N1 or resname is NA+)', cell_list).tolist() == [5, 10, 11, 12, 13]
+
+    with pytest.raises(SelectionError) as e:
+        mpt.select_ids('within 1.5 of id is 6')
+    assert str(e.value) == "Coordinates are needed for 'within' selections"
+
+    with pytest.raises(SelectionError) as e:
+        mpt.select_ids('within 1.5 resname is NA+', cell_list)
+    assert str(e.value) == "Expected 'of' but found 'resname' in selection"
+
+def test_pdb_without_box(tmp_path):
+    from test_mpt import getMockTopol
+    from mimicpy import CoordsIO, DefaultSelector
+    from mimicpy.topology.topol_dict import TopolDict
+    _, df2 = getMockTopol()
+    mpt = Mpt([('NA1', 3)], TopolDict.from_dict({'NA1': df2}), 'w')
+
+    # without CRYST1 the box is the extent of the coordinates, which is not periodic
+    pdb_file = str(tmp_path / 'nobox.pdb')
+    with open(pdb_file, 'w') as f:
+        for i, x in enumerate([0, 10, 5]):
+            f.write("HETATM{:5d} NA    NA     1    {:8.3f}{:8.3f}{:8.3f}\n".format(i+1, x, x, x))
+    coords = CoordsIO(pdb_file)
+    assert not coords.has_box and coords.box == [1.0, 1.0, 1.0]
+    assert DefaultSelector(mpt, pdb_file).select_ids('within 0.2 of id is 1').tolist() == [1]
+
+    with open(pdb_file, 'r+') as f:
+        text = f.read()
+        f.seek(0)
+        f.write("CRYST1   10.000   10.000   10.000  90.00  90.00  90.00 P 1           1\n" + text)
+    assert CoordsIO(pdb_file).has_box
+    assert DefaultSelector(mpt, pdb_file).select_ids('within 0.2 of id is 1').tolist() == [1, 2]
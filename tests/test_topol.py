@@ -54,4 +54,181 @@ def test_4aj3():
     assert mol_list==[('Protein', 1), ('NAP', 1), ('ICT', 1), ('SOL', 47708), ('NA', 18), ('SOL', 18)]
     assert set(topol_dict.keys()) == {'Protein', 'NAP', 'ICT', 'SOL', 'NA', 'SOL'}
     assert set(topol_dict['NAP']['element']) == {'C', 'H', 'O', 'N', 'P'}
-    assert set(topol_dict['ICT']['element']) == {'C', 'H', 'O'}
\ No newline at end of file
+    assert set(topol_dict['ICT']['element']) == {'C', 'H', 'O'}
+
+def test_workers():
+    for file in ['dppc/topol.top', '4aj3/topol.top']:
+        serial = Top(file)
+        parallel = Top(file, workers=3)
+        assert parallel.molecules == serial.molecules
+        assert parallel.topol_dict.repeating == serial.topol_dict.repeating
+        assert list(parallel.topol_dict.dict_df) == list(serial.topol_dict.dict_df)
+        for mol, df in serial.topol_dict.dict_df.items():
+            assert parallel.topol_dict[mol].equals(df)
+
+def test_cache(tmp_path, monkeypatch):
+    import shutil
+    import mimicpy.topology.top as top_module
+    shutil.copytree('dppc', str(tmp_path / 'dppc'))
+    file = str(tmp_path / 'dppc' / 'topol.top')
+    cache_dir = str(tmp_path / 'cache')
+
+    serial = Top(file)
+    cached = Top(file, cache_dir=cache_dir)
+    assert cached.molecules == serial.molecules
+    assert cached.topol_dict.repeating == serial.topol_dict.repeating
+
+    def fail(*args, **kwargs):
+        raise AssertionError('File should not be parsed')
+
+    # nothing changed, so the topology is loaded from the cache
+    with monkeypatch.context() as m:
+        m.setattr(top_module, 'Itp', fail)
+        top = Top(file, cache_dir=cache_dir)
+    assert top.molecules == serial.molecules
+    for mol, df in serial.topol_dict.dict_df.items():
+        assert top.topol_dict[mol].equals(df)
+
+    # only the changed itp file is parsed again, and the missing posre.itp is looked up again
+    parsed = []
+    read_itp = top_module._read_itp
+    monkeypatch.setattr(top_module, '_read_itp', lambda file, *args: parsed.append(file) or read_itp(file, *args))
+    with open(str(tmp_path / 'dppc' / 'gromos53a6.ff' / 'spc.itp'), 'a') as f:
+        f.write('\n; changed\n')
+    top = Top(file, cache_dir=cache_dir)
+    assert [file.split('/')[-1] for file in parsed] == ['posre.itp', 'spc.itp']
+    assert top.topol_dict['SOL'].equals(serial.topol_dict['SOL'])
+
+def test_cache_mtime(tmp_path, monkeypatch):
+    import os
+    import mimicpy.topology.parse_cache as parse_cache
+    itp_file = tmp_path / 'mol.itp'
+    itp_file.write_text('[ moleculetype ]\nMOL 3\n')
+    cache = parse_cache.ParseCache(str(tmp_path / 'cache'))
+    cache.store('key', 'value', [str(itp_file)])
+
+    # same content with a new modification time, the file is hashed once and the entry is updated
+    os.utime(str(itp_file), (0, 12345))
+    hashed = []
+    content_hash = parse_cache._content_hash
+    monkeypatch.setattr(parse_cache, '_content_hash', lambda file: hashed.append(file) or content_hash(file))
+    assert cache.load('key') == 'value'
+    assert cache.load('key') == 'value'
+    assert hashed == [str(itp_file)]
+
+    itp_file.write_text('[ moleculetype ]\nMOL 2\n')
+    assert cache.load('key') is None
+
+def test_include_resolver():
+    top = Top('4aj3/topol.top', mode='w')
+    assert len(top.resolver.read_counts) > 2
+    assert set(top.resolver.read_counts.values()) == {1}
+    assert sum(top.resolver.request_counts.values()) > len(top.resolver.read_counts)
+
+    # itp files are parsed with the shared resolver unless they are parsed in a process pool
+    from os.path import abspath
+    itp_file = abspath('dppc/dppc_A.itp')
+    serial = Top('dppc/topol.top', mode='r')
+    pool = Top('dppc/topol.top', mode='r', workers=2)
+    assert serial.resolver.request_counts[itp_file] > pool.resolver.request_counts[itp_file]
+
+def test_atoms_section(tmp_path):
+    from mimicpy.topology.itp import Itp
+    itp_file = str(tmp_path / 'mol.itp')
+    with open(itp_file, 'w') as f:
+        f.write("[ moleculetype ]\n"
+                "MOL   3\n\n"
+                "[ atoms ]\n"
+                "; nr type resnr residue atom cgnr charge mass\n"
+                "  1   CT    1    LIG     C1   1   -0.1   12.011 ; inline comment\n"
+                "  2   HC    1    LIG     H1   1    0.1\n"
+                "  3   br    1    LIG     BR   2   -0.2   79.90\n"
+                "#ifdef FLEXIBLE\n"
+                "  4   XX    2    LIG     Q1   3    0.2   80.00\n"
+                "#endif\n"
+                "  5   CT    2    LIG     C2   4    0.0   12.011\n"
+                "[ bonds ]\n"
+                "1 2 1\n")
+
+    itp = Itp(itp_file, atom_types={'CT': 'C'})
+    atoms = itp.topol['MOL']
+    assert atoms.index.to_list() == [1, 2, 3, 4, 5]
+    assert atoms['resid'].to_list() == [1, 1, 1, 2, 2]
+    assert atoms['mass'].to_list() == [12.011, 0, 79.9, 80, 12.011]
+    assert atoms['element'].to_list() == ['C', 'H', 'Br', 'H', 'C']
+    assert itp.guessed_elems_history == {'HC': 'H', 'br': 'Br', 'XX': 'H'}
+
+    with pytest.raises(ParserError):
+        Itp(itp_file, atom_types={'CT': 'C'}, guess_elements=False).topol
+
+    # malformed lines are skipped, up to 6 of them
+    bad_lines = ["  6   CT    2    LIG     C3   4    0.0   12.011   a b c d e\n", "  7   CT    2\n"]
+    with open(itp_file, 'w') as f:
+        f.write("[ moleculetype ]\nMOL   3\n\n[ atoms ]\n"
+                "  1   CT    1    LIG     C1   1   -0.1   12.011\n" + ''.join(bad_lines))
+    assert Itp(itp_file, atom_types={'CT': 'C'}).topol['MOL'].index.to_list() == [1]
+    with open(itp_file, 'a') as f:
+        f.write(''.join(bad_lines*3))
+    with pytest.raises(ParserError):
+        Itp(itp_file, atom_types={'CT': 'C'}).topol
+
+def test_molecule_index(tmp_path):
+    from mimicpy.topology.itp import Itp
+    from mimicpy.topology.sections import index_molecules
+    text = ""
+    for i, mol in enumerate(['LIGA', 'LIGB', 'LIGC']):
+        text += ("[ moleculetype ]\n; name nrexcl\n{} 3\n\n[ atoms ]\n"
+                 "1 CT 1 {} C1 1 0.0 12.011\n2 HC 1 {} H1 1 0.0 1.008\n\n"
+                 "[ bonds ]\n1 2 1\n\n").format(mol, mol, mol)
+    itp_file = str(tmp_path / 'library.itp')
+    with open(itp_file, 'w') as f:
+        f.write(text)
+
+    index = index_molecules(text)
+    assert list(index) == ['LIGA', 'LIGB', 'LIGC']
+    start, stop = index['LIGB']['atoms'][0]
+    assert text[start:stop].splitlines()[0] == "1 CT 1 LIGB C1 1 0.0 12.011"
+
+    itp = Itp(itp_file, requested_molecules=['LIGB'])
+    assert list(itp.topol) == ['LIGB']
+    assert itp.topol['LIGB']['name'].to_list() == ['C1', 'H1']
+    assert itp.topol['LIGB']['element'].to_list() == ['C', 'H']
+    assert list(itp.bonds) == ['LIGB']
+
+    # the last definition of a molecule type is used
+    redefined = text + "[ moleculetype ]\nLIGA 3\n\n[ atoms ]\n1 OW 1 LIGA O1 1 0.0 15.999\n"
+    index = index_molecules(redefined)
+    assert list(index) == ['LIGA', 'LIGB', 'LIGC'] and len(index['LIGA']['atoms']) == 1
+    with open(itp_file, 'w') as f:
+        f.write(redefined)
+    itp = Itp(itp_file, requested_molecules=['LIGA'])
+    assert itp.topol['LIGA']['name'].to_list() == ['O1']
+    assert len(itp.bonds['LIGA']) == 0
+
+def test_bonds(tmp_path):
+    from mimicpy.topology.itp import Itp
+    from mimicpy.topology.bonds import Bonds
+    itp_file = str(tmp_path / 'mol.itp')
+    with open(itp_file, 'w') as f:
+        f.write("[ moleculetype ]\n"
+                "MOL   3\n\n"
+                "[ atoms ]\n"
+                "  1   CT    1    LIG     C1   1   -0.1   12.011\n"
+                "  2   HC    1    LIG     H1   1    0.1   1.008\n"
+                "  3   CT    1    LIG     C2   1    0.0   12.011\n"
+                "  4   HC    1    LIG     H2   1    0.0   1.008\n"
+                "[ bonds ]\n"
+                "; ai aj funct\n"
+                "  1   2   1\n"
+                "  1   3   1 ; comment\n"
+                "  3   1   1\n"
+                "  3   4   1\n"
+                "  3   9   1\n")
+
+    bonds = Itp(itp_file).bonds['MOL']
+    assert bonds == Bonds.from_pairs([0, 0, 2], [1, 2, 3], 4)
+    assert len(bonds) == 3
+    assert [list(pair) for pair in bonds.pairs()] == [[0, 0, 2], [1, 2, 3]]
+    positions, rows = bonds.neighbors([2, 1])
+    assert positions.tolist() == [0, 0, 1]
+    assert rows.tolist() == [0, 3, 0]
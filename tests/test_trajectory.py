@@ -0,0 +1,123 @@
+import struct
+import numpy as np
+import pytest
+from mimicpy import CoordsIO, Gro, Trr, Xtc
+from mimicpy.utils.errors import MiMiCPyError, ParserError
+
+
+def _trr_frame(step, time, box, coords, double=False, velocities=False):
+    """Frame with coords as coordinates, or as velocities only"""
+    real = 'd' if double else 'f'
+    size = 8 if double else 4
+    header = struct.pack('>ii', 1993, 13) + struct.pack('>i', 12) + b'GMX_trn_file'
+    x_size, v_size = (0, coords.size*size) if velocities else (coords.size*size, 0)
+    header += struct.pack('>13i', 0, 0, 9*size, 0, 0, 0, 0, x_size, v_size, 0, len(coords), step, 0)
+    header += struct.pack('>' + real*2, time, 0.0)
+    return header + np.asarray(box, '>' + real).tobytes() + np.asarray(coords, '>' + real).tobytes()
+
+
+def _xtc_frame(step, time, box, coords):
+    """Frame of a system of at most 9 atoms, which are not compressed"""
+    return struct.pack('>iiif', 1995, len(coords), step, time) + np.asarray(box, '>f4').tobytes() \
+           + struct.pack('>i', len(coords)) + np.asarray(coords, '>f4').tobytes()
+
+
+def test_trr(tmp_path):
+    coords = np.arange(12, dtype=float).reshape(4, 3) / 8
+    triclinic = [[2.0, 0, 0], [0.5, 2.0, 0], [0.25, 0.75, 2.0]]
+    for double in [False, True]:
+        trr_file = str(tmp_path / 'traj{}.trr'.format(int(double)))
+        with open(trr_file, 'wb') as f:
+            f.write(_trr_frame(0, 0.0, np.diag([2.0]*3), coords, double))
+            f.write(_trr_frame(500, 1.5, triclinic, coords + 1, double))
+            f.write(_trr_frame(1000, 3.0, triclinic, coords)[:-8])  # truncated frame
+
+        traj = CoordsIO(trr_file)
+        assert isinstance(traj, CoordsIO) and len(traj) == 2
+        assert traj.coords.to_numpy().tolist() == coords.tolist()
+        assert traj.coords.index[0] == 1 and traj.box == [2.0, 2.0, 2.0]
+        frame = traj[-1]
+        assert (frame.step, frame.time) == (500, 1.5)
+        assert frame.box == [2.0, 2.0, 2.0, 0.0, 0.0, 0.5, 0.0, 0.25, 0.75]
+        assert frame.coords.tolist() == (coords + 1).tolist()
+
+    with pytest.raises(MiMiCPyError):
+        Trr(str(tmp_path / 'out.trr')).write(None)
+    assert not (tmp_path / 'out.trr').exists()
+
+
+def test_trr_velocities(tmp_path):
+    coords = np.arange(12, dtype=float).reshape(4, 3) / 8
+    trr_file = str(tmp_path / 'traj.trr')
+    with open(trr_file, 'wb') as f:
+        f.write(_trr_frame(0, 0.0, np.eye(3), coords + 5, velocities=True))
+        f.write(_trr_frame(1, 0.5, np.eye(3), coords))
+        f.write(_trr_frame(2, 1.0, np.eye(3), coords + 5, velocities=True))
+        f.write(_trr_frame(3, 1.5, np.eye(3), coords + 1))
+        f.write(_trr_frame(4, 2.0, np.eye(3), coords + 5, velocities=True))
+
+    traj = CoordsIO(trr_file)
+    assert len(traj) == 2
+    assert traj.coords.to_numpy().tolist() == coords.tolist()
+    assert [(frame.step, frame.coords.tolist()) for frame in traj.frames()] == [(1, coords.tolist()),
+                                                                               (3, (coords + 1).tolist())]
+    assert traj[-1].step == 3
+
+    with open(trr_file, 'wb') as f:
+        f.write(_trr_frame(0, 0.0, np.eye(3), coords, velocities=True))
+    with pytest.raises(ParserError):
+        CoordsIO(trr_file)
+
+
+def test_xtc(tmp_path):
+    coords = np.arange(9, dtype=float).reshape(3, 3) / 8
+    xtc_file = str(tmp_path / 'traj.xtc')
+    with open(xtc_file, 'wb') as f:
+        for i in range(4):
+            f.write(_xtc_frame(i*10, i*0.5, np.diag([3.0]*3), coords + i))
+
+    traj = CoordsIO(xtc_file)
+    assert len(traj) == 4
+    assert [frame.step for frame in traj.frames(step=2)] == [0, 20]
+    assert traj[3].coords.tolist() == (coords + 3).tolist() and traj[3].time == 1.5
+
+    traj.seek(2)
+    assert traj.coords.to_numpy().tolist() == (coords + 2).tolist()
+    assert traj.positions.tolist() == (coords + 2).tolist()
+
+    with open(xtc_file, 'r+b') as f:
+        f.write(struct.pack('>i', 1993))
+    with pytest.raises(ParserError):
+        CoordsIO(xtc_file)
+
+
+def test_compressed_xtc():
+    traj = CoordsIO('traj_files/water.xtc')
+    coords, box = Gro('traj_files/water.gro').read()
+    assert len(traj) == 3
+    assert np.allclose(traj.coords.to_numpy(), coords.to_numpy(), atol=1e-6)
+    assert traj.box == pytest.approx(box)
+    for i, frame in enumerate(traj.frames()):
+        assert frame.step == i and frame.time == 2.0*i
+        assert np.allclose(frame.coords, coords.to_numpy() + 0.01*i, atol=1e-6)
+
+
+def test_corrupted_xtc(tmp_path):
+    data = bytearray(open('traj_files/water.xtc', 'rb').read())
+    data[84:88] = struct.pack('>i', 5)  # smallidx below the first size of differences
+    xtc_file = tmp_path / 'corrupted.xtc'
+    xtc_file.write_bytes(bytes(data))
+    with pytest.raises(ParserError):
+        CoordsIO(str(xtc_file))
+
+
+def test_frame_offsets(tmp_path):
+    coords = np.zeros((2, 3))
+    xtc_file = tmp_path / 'traj.xtc'
+    xtc_file.write_bytes(_xtc_frame(0, 0.0, np.eye(3), coords) * 2)
+    assert len(CoordsIO(str(xtc_file))) == 2
+    assert (tmp_path / '.traj.xtc.offsets.npz').exists()
+
+    # the saved index is not used once the file has changed
+    xtc_file.write_bytes(_xtc_frame(0, 0.0, np.eye(3), coords) * 3)
+    assert Xtc(str(xtc_file)).frame_offsets().tolist() == [0, 80, 160, 240]